@@ -4,8 +4,6 @@ from pathlib import Path
 import os
 from datetime import datetime
 import zipfile
-import tempfile
-import io
 import logging
 import sys
 import hashlib
@@ -67,8 +65,23 @@ def check_password():
         # Password correct
         return True
 
+def open_parse_cache():
+    """Open the on-disk parse cache, or run without one if it is unavailable"""
+    from parse_cache import ParseCache
+    
+    try:
+        return ParseCache()
+    except Exception as e:
+        logger.warning(f"Parse cache unavailable, parsing every file: {str(e)}")
+        return None
+
 def upload_and_process_page():
     from email_processor_simple import EmailProcessor, create_vector_database
+    from style_profiles import build_style_profiles
+    from sender_index import SenderIndex
+    from email_corpus import EmailCorpus, emails_frame
+    from email_sources import close_email_files
+    from search_index import FullTextIndex, fts5_available
     
     st.header("📤 Upload Email Files")
     
@@ -108,75 +121,93 @@ def upload_and_process_page():
         if zip_file:
             uploaded_files = extract_eml_from_zip(zip_file)
     
-    if uploaded_files:
-        st.success(f"📁 {len(uploaded_files)} .eml files ready to process")
-        logger.info(f"Files ready for processing: {len(uploaded_files)} files")
-        
-        if st.button("🔄 Process Files", type="primary", key="process_files_btn"):
-            logger.info("Process Files button clicked")
-            processor = EmailProcessor()
-            parsed_emails = processor.parse_eml_files(uploaded_files)
-            
-            st.session_state['parsed_emails'] = parsed_emails
-            logger.info(f"Stored {len(parsed_emails)} parsed emails in session state")
-            
-            df = pd.DataFrame(parsed_emails)
-            
-            # Add body length column to check if content was extracted
-            df['body_length'] = df['body'].str.len()
-            
-            st.subheader("📊 Processing Summary")
-            
-            # Show extraction stats
-            emails_with_body = (df['body_length'] > 0).sum()
-            emails_without_body = (df['body_length'] == 0).sum()
-            
-            # Detect user email from corpus
-            user_email = processor.detect_user_email(parsed_emails)
-            if user_email:
-                st.session_state['user_email'] = user_email
-                st.info(f"👤 Detected user email: **{user_email}**")
-                logger.info(f"Detected user email: {user_email}")
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Total Emails", len(parsed_emails))
-            with col2:
-                st.metric("With Body Content", emails_with_body)
-            with col3:
-                st.metric("Missing Body", emails_without_body)
-            
-            # Show the dataframe with body info
-            display_df = df[['filename', 'from', 'subject', 'body_length', 'date']].copy()
-            display_df['has_body'] = display_df['body_length'] > 0
-            st.dataframe(display_df)
-            
-            # If we have emails with bodies, show a sample
-            if emails_with_body > 0:
-                sample_email = df[df['body_length'] > 0].iloc[0]
-                with st.expander("📧 Sample Email Body (first 500 chars)"):
-                    st.text(sample_email['body'][:500])
+    try:
+        if uploaded_files:
+            st.success(f"📁 {len(uploaded_files)} .eml files ready to process")
+            logger.info(f"Files ready for processing: {len(uploaded_files)} files")
             
-            # Automatically create vector database if embeddings are enabled
-            if st.session_state.get('use_embeddings', True):
-                st.info("🚀 Automatically creating vector database for embeddings...")
-                logger.info("Auto-creating vector database with embeddings")
-                with st.spinner("🔄 Creating embeddings and building vector database..."):
-                    try:
-                        create_vector_database(parsed_emails)
-                        st.success("✅ Vector database created successfully!")
-                    except Exception as e:
-                        st.error(f"❌ Failed to create vector database: {str(e)}")
-                        logger.error(f"Vector database creation failed: {str(e)}", exc_info=True)
-                        st.info("You can still use Direct Context mode for style mimicking")
-            else:
-                st.info("🔧 Embeddings disabled - emails stored for direct retrieval")
+            if st.button("🔄 Process Files", type="primary", key="process_files_btn"):
+                logger.info("Process Files button clicked")
+                processor = EmailProcessor(parse_cache=open_parse_cache())
+                # Kept column-wise; the list of dicts is dropped after this
+                parsed_emails = EmailCorpus.from_records(processor.parse_eml_files(uploaded_files))
+                
                 st.session_state['parsed_emails'] = parsed_emails
-                st.session_state['vector_ready'] = True
-                logger.info("Embeddings disabled - storing emails for direct access")
+                st.session_state['sender_index'] = SenderIndex(parsed_emails)
+                if fts5_available():
+                    st.session_state['search_index'] = FullTextIndex(parsed_emails)
+                else:
+                    logger.warning("SQLite has no FTS5 support, knowledge base search will scan emails")
+                    st.session_state.pop('search_index', None)
+                logger.info(f"Stored {len(parsed_emails)} parsed emails in session state")
+                
+                # Display columns only; bodies stay in the corpus buffers
+                df = emails_frame(parsed_emails)
+                
+                st.subheader("📊 Processing Summary")
+                
+                # Show extraction stats
+                emails_with_body = (df['body_length'] > 0).sum()
+                emails_without_body = (df['body_length'] == 0).sum()
+                
+                # Detect user email from corpus
+                user_email = processor.detect_user_email(parsed_emails)
+                if user_email:
+                    st.session_state['user_email'] = user_email
+                    st.info(f"👤 Detected user email: **{user_email}**")
+                    logger.info(f"Detected user email: {user_email}")
+                
+                # Profile each author once here instead of on every generation
+                try:
+                    st.session_state['style_profiles'] = build_style_profiles(parsed_emails)
+                except Exception as e:
+                    logger.error(f"Style profile extraction failed: {str(e)}", exc_info=True)
+                    st.session_state['style_profiles'] = {}
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total Emails", len(parsed_emails))
+                with col2:
+                    st.metric("With Body Content", emails_with_body)
+                with col3:
+                    st.metric("Missing Body", emails_without_body)
+                
+                # Show the dataframe with body info
+                display_df = df[['filename', 'from', 'subject', 'body_length', 'date']].copy()
+                display_df['has_body'] = display_df['body_length'] > 0
+                st.dataframe(display_df)
+                
+                # If we have emails with bodies, show a sample
+                if emails_with_body > 0:
+                    sample_email = parsed_emails[int(df.index[df['body_length'] > 0][0])]
+                    with st.expander("📧 Sample Email Body (first 500 chars)"):
+                        st.text(sample_email['body'][:500])
+                
+                # Automatically create vector database if embeddings are enabled
+                if st.session_state.get('use_embeddings', True):
+                    st.info("🚀 Automatically creating vector database for embeddings...")
+                    logger.info("Auto-creating vector database with embeddings")
+                    with st.spinner("🔄 Creating embeddings and building vector database..."):
+                        try:
+                            create_vector_database(parsed_emails)
+                            st.success("✅ Vector database created successfully!")
+                        except Exception as e:
+                            st.error(f"❌ Failed to create vector database: {str(e)}")
+                            logger.error(f"Vector database creation failed: {str(e)}", exc_info=True)
+                            st.info("You can still use Direct Context mode for style mimicking")
+                else:
+                    st.info("🔧 Embeddings disabled - emails stored for direct retrieval")
+                    st.session_state['parsed_emails'] = parsed_emails
+                    st.session_state['vector_ready'] = True
+                    logger.info("Embeddings disabled - storing emails for direct access")
+    finally:
+        # Every rerun reopens the archive, so it is closed whether or not it was parsed
+        close_email_files(uploaded_files or [])
 
 def response_generation_page():
     from response_generator import ResponseGenerator
+    from style_profiles import select_style_profile
+    from retrieval_filters import RETRIEVAL_SCOPES, scope_filters
     
     st.header("🤖 Generate Email Response")
     logger.info("Response generation page loaded")
@@ -195,7 +226,8 @@ def response_generation_page():
         st.write("- Vector Database:", "✅ Ready" if st.session_state.get('vector_ready') else "❌ Not Ready")
         st.write("- Vector Index:", "✅ Exists" if 'vector_index' in st.session_state else "❌ Missing")
         st.write("- Emails Processed:", len(st.session_state.get('parsed_emails', [])))
-        emails_with_body = sum(1 for e in st.session_state.get('parsed_emails', []) if e.get('body'))
+        parsed_emails = st.session_state.get('parsed_emails')
+        emails_with_body = int((parsed_emails.body_lengths() > 0).sum()) if parsed_emails else 0
         st.write("- Emails with Body Content:", emails_with_body)
     
     # Display detected user email if available
@@ -242,6 +274,24 @@ def response_generation_page():
                 value=True,
                 help="✅ ON: Uses RAG embeddings to mimic email style | ❌ OFF: Standard professional response"
             )
+            
+            scope_options = list(RETRIEVAL_SCOPES)
+            if not st.session_state.get('user_email'):
+                scope_options.remove('mine')
+            retrieval_scope = st.selectbox(
+                "Learn From",
+                scope_options,
+                format_func=RETRIEVAL_SCOPES.get,
+                help="Which past emails are searched for examples"
+            )
+            
+            recent_days = st.number_input(
+                "Only the Last N Days",
+                min_value=0,
+                value=0,
+                step=30,
+                help="0 searches the whole mailbox"
+            )
         
         generate_button = st.form_submit_button("✨ Generate Response", type="primary")
     
@@ -265,22 +315,52 @@ def response_generation_page():
             try:
                 generator = ResponseGenerator()
                 
-                if include_context:
-                    # Use RAG with embeddings
-                    if not st.session_state.get('vector_index'):
+                if include_context and not st.session_state.get('vector_index') and st.session_state.get('search_index') is None:
+                    # Neither index exists: pick examples by sender instead
+                    if not st.session_state.get('parsed_emails'):
                         st.error("❌ Vector index not found in session!")
                         logger.error("Vector index missing from session state")
                         return
                     
+                    logger.info("=== USING DIRECT CONTEXT (NO INDEX) ===")
+                    result = generator.generate_response_direct(
+                        incoming_email,
+                        sender_email,
+                        st.session_state['parsed_emails'],
+                        response_style,
+                        message_type=message_type,
+                        is_internal=is_internal,
+                        stream=True,
+                        style_profile=select_style_profile(
+                            st.session_state.get('style_profiles'),
+                            st.session_state.get('user_email')
+                        ),
+                        sender_index=st.session_state.get('sender_index')
+                    )
+                elif include_context:
+                    # Use RAG with embeddings
                     logger.info("=== USING RAG SYSTEM WITH EMBEDDINGS ===")
                     result = generator.generate_response(
                         incoming_email, 
                         sender_email, 
-                        st.session_state['vector_index'],
+                        st.session_state.get('vector_index'),
                         response_style,
                         message_type=message_type,
                         is_internal=is_internal,
-                        user_email=st.session_state.get('user_email')
+                        user_email=st.session_state.get('user_email'),
+                        stream=True,
+                        style_profile=select_style_profile(
+                            st.session_state.get('style_profiles'),
+                            st.session_state.get('user_email')
+                        ),
+                        filters=scope_filters(
+                            retrieval_scope,
+                            sender_email,
+                            st.session_state.get('user_email'),
+                            days=recent_days or None
+                        ),
+                        text_index=st.session_state.get('search_index'),
+                        parsed_emails=st.session_state.get('parsed_emails')
                     )
                 else:
                     # Use baseline without embeddings
@@ -290,44 +370,65 @@ def response_generation_page():
                         sender_email,
                         response_style,
                         message_type=message_type,
-                        is_internal=is_internal
+                        is_internal=is_internal,
+                        stream=True
                     )
                 
                 logger.info(f"Response generation result: success={result.get('success')}, mode={result.get('mode', 'unknown')}")
             except Exception as e:
                 logger.error(f"Error generating response: {str(e)}", exc_info=True)
                 result = {'success': False, 'error': str(e)}
+        
+        if result.get('success'):
+            mode_msg = result.get('mode', 'unknown')
+            st.success(f"✅ Response generated successfully! Mode: {mode_msg}")
+            logger.info(f"Response generated successfully using mode: {mode_msg}")
+            if result.get('retrieval_timings'):
+                st.caption("Retrieval: " + ", ".join(
+                    f"{stage} {ms:.0f} ms" for stage, ms in result['retrieval_timings'].items()
+                ))
             
-            if result.get('success'):
-                mode_msg = result.get('mode', 'unknown')
-                st.success(f"✅ Response generated successfully! Mode: {mode_msg}")
-                logger.info(f"Response generated successfully using mode: {mode_msg}")
-                
-                st.subheader("📧 Generated Response")
-                response_text = st.text_area(
-                    "Edit response if needed:",
-                    value=result['response'],
-                    height=300
-                )
-                
-                if result.get('sources'):
-                    with st.expander(f"📚 Context Sources Used ({len(result['sources'])} emails retrieved)"):
-                        for idx, source in enumerate(result['sources'], 1):
-                            st.write(f"**Email {idx}:** {source.get('filename', 'Unknown')}")
-                            st.write(f"From: {source.get('sender', 'Unknown')}")
-                            st.write(f"Subject: {source.get('subject', 'No subject')}")
-                            if source.get('body_preview'):
-                                st.write(f"Preview: {source.get('body_preview')[:100]}...")
-                            st.write("---")
-                
-                st.code(response_text, language=None)
-                
-            else:
-                error_msg = result.get('error', 'Unknown error')
-                st.error(f"❌ Failed to generate response: {error_msg}")
-                logger.error(f"Failed to generate response: {error_msg}")
+            st.subheader("📧 Generated Response")
+            
+            if result.get('response_gen') is not None:
+                # Show tokens as they arrive, then swap in the editable copy
+                stream_placeholder = st.empty()
+                try:
+                    with stream_placeholder.container():
+                        result['response'] = st.write_stream(result['response_gen'])
+                except Exception as e:
+                    logger.error(f"Error streaming response: {str(e)}", exc_info=True)
+                    st.error(f"❌ Failed to generate response: {str(e)}")
+                    return
+                stream_placeholder.empty()
+            
+            response_text = st.text_area(
+                "Edit response if needed:",
+                value=result['response'],
+                height=300
+            )
+            
+            if result.get('sources'):
+                with st.expander(f"📚 Context Sources Used ({len(result['sources'])} emails retrieved)"):
+                    for idx, source in enumerate(result['sources'], 1):
+                        st.write(f"**Email {idx}:** {source.get('filename', 'Unknown')}")
+                        st.write(f"From: {source.get('sender', 'Unknown')}")
+                        st.write(f"Subject: {source.get('subject', 'No subject')}")
+                        if source.get('body_preview'):
+                            st.write(f"Preview: {source.get('body_preview')[:100]}...")
+                        st.write("---")
+            
+            st.code(response_text, language=None)
+            
+        else:
+            error_msg = result.get('error', 'Unknown error')
+            st.error(f"❌ Failed to generate response: {error_msg}")
+            logger.error(f"Failed to generate response: {error_msg}")
 
 def knowledge_base_page():
+    from email_corpus import emails_frame, matching_positions
+    from search_index import DEFAULT_PAGE_SIZE
+    
     st.header("🗃️ Email Knowledge Base")
     
     if not st.session_state.get('parsed_emails'):
@@ -335,7 +436,7 @@ def knowledge_base_page():
         return
     
     emails = st.session_state['parsed_emails']
-    df = pd.DataFrame(emails)
+    df = emails_frame(emails)
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -344,30 +445,86 @@ def knowledge_base_page():
         unique_senders = df['from'].nunique()
         st.metric("Unique Senders", unique_senders)
     with col3:
-        date_range = pd.to_datetime(df['date'], errors='coerce').dt.date
-        date_span = (date_range.max() - date_range.min()).days if len(date_range.dropna()) > 1 else 0
+        timestamps = df['date_ts'].dropna() if 'date_ts' in df else pd.Series(dtype='int64')
+        date_span = int((timestamps.max() - timestamps.min()) // 86400) if len(timestamps) > 1 else 0
         st.metric("Date Span (days)", date_span)
     with col4:
-        avg_length = df['body'].str.len().mean()
+        avg_length = df['body_length'].mean()
         st.metric("Avg Email Length", f"{avg_length:.0f} chars")
     
     st.subheader("🔍 Search Emails")
-    search_term = st.text_input("Search in emails...")
+    search_term = st.text_input(
+        "Search in emails...",
+        help='Filter with from:, subject: or body:, quote "exact phrases", end a word with * to match prefixes'
+    )
     
-    if search_term:
-        mask = df.apply(lambda x: x.astype(str).str.contains(search_term, case=False).any(), axis=1)
-        filtered_df = df[mask]
+    search_index = st.session_state.get('search_index')
+    columns = ['filename', 'from', 'subject', 'date']
+    if search_term and search_index is not None:
+        # Keyed on the query so a new search starts on page 1; the value is
+        # read before the input is drawn, since its maximum needs the total
+        page_key = f"kb_search_page:{search_term}"
+        page = st.session_state.get(page_key, 1)
+        results = search_index.search(search_term, limit=DEFAULT_PAGE_SIZE, offset=(page - 1) * DEFAULT_PAGE_SIZE)
+        pages = max(1, -(-results['total'] // DEFAULT_PAGE_SIZE))
+        if page > pages:
+            # The index was rebuilt with fewer matches since this page was picked
+            del st.session_state[page_key]
+            page = 1
+            results = search_index.search(search_term, limit=DEFAULT_PAGE_SIZE)
+        st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=page_key)
+        st.caption(f"{results['total']} matches - page {page} of {pages}")
+        filtered_df = df.iloc[[hit['position'] for hit in results['hits']]].copy()
+        filtered_df['score'] = [round(hit['score'], 2) for hit in results['hits']]
+        filtered_df['snippet'] = [hit['snippet'] for hit in results['hits']]
+        columns = columns + ['score', 'snippet']
+    elif search_term:
+        # No index (SQLite without FTS5): scan the emails instead
+        filtered_df = df.iloc[matching_positions(emails, search_term)]
     else:
         filtered_df = df
     
     st.dataframe(
-        filtered_df[['filename', 'from', 'subject', 'date']],
+        filtered_df[columns],
         use_container_width=True
     )
     
+    if st.session_state.get('vector_index'):
+        with st.expander("🧹 Vector Index Maintenance"):
+            st.write("Find vectors with legacy random IDs or chunks left over from older versions of an email.")
+            prune_unknown = st.checkbox(
+                "Also remove emails not in the current upload",
+                value=False,
+                help="Only use this if the current upload is your complete mailbox"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                check_clicked = st.button("🔍 Check Index", key="reconcile_check_btn")
+            with col2:
+                prune_clicked = st.button("🧹 Prune Orphans", key="reconcile_prune_btn")
+            
+            if check_clicked or prune_clicked:
+                from vector_manager import VectorManager
+                with st.spinner("Scanning vector index..."):
+                    report = VectorManager().reconcile(
+                        emails,
+                        prune=prune_clicked,
+                        prune_unknown=prune_unknown
+                    )
+                if report:
+                    st.write(f"- Vectors in index: {report['total']}")
+                    st.write(f"- Legacy random IDs: {len(report['legacy'])}")
+                    st.write(f"- Stale chunks: {len(report['stale'])}")
+                    st.write(f"- Not in current upload: {len(report['unknown'])}")
+                    if prune_clicked:
+                        st.success(f"Removed {report['pruned']} orphaned vectors")
+    
     if st.button("🗑️ Clear Knowledge Base"):
         if st.checkbox("I understand this will delete all processed emails"):
             st.session_state.pop('parsed_emails', None)
+            st.session_state.pop('sender_index', None)
+            st.session_state.pop('search_index', None)
+            st.session_state.pop('style_profiles', None)
             st.session_state.pop('vector_index', None)
             st.session_state.pop('vector_ready', None)
             st.success("Knowledge base cleared!")
@@ -400,41 +557,28 @@ def main():
         knowledge_base_page()
 
 def extract_eml_from_zip(zip_file):
-    """Extract .eml files from uploaded ZIP file"""
-    eml_files = []
+    """Extract .eml files from uploaded ZIP file
+    
+    Members are not decompressed here; each returned handle reads its
+    message when the parser asks for it. The archive is opened directly on
+    the uploaded file object rather than on a second in-memory copy.
+    """
     logger.info(f"Extracting .eml files from ZIP: {zip_file.name}")
     
+    from email_sources import iter_eml_from_zip
+    
     try:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            zip_bytes = zip_file.read()
-            
-            with zipfile.ZipFile(io.BytesIO(zip_bytes), 'r') as zip_ref:
-                for file_info in zip_ref.namelist():
-                    # Check for all .eml files
-                    if file_info.lower().endswith('.eml') and not file_info.startswith('__MACOSX/'):
-                        file_data = zip_ref.read(file_info)
-                        
-                        # Use the full path as the name to preserve folder structure
-                        display_name = file_info
-                        
-                        class EMLFile:
-                            def __init__(self, name, data):
-                                self.name = os.path.basename(name)  # Just the filename for processing
-                                self.full_path = name  # Keep full path for display
-                                self.data = data
-                            
-                            def read(self):
-                                return self.data
-                        
-                        eml_files.append(EMLFile(file_info, file_data))
-                        logger.debug(f"Found .eml file: {file_info}")
-            
-            if eml_files:
-                st.success(f"📦 Found {len(eml_files)} .eml file(s) in ZIP")
-                logger.info(f"Successfully extracted {len(eml_files)} .eml files from ZIP")
-            else:
-                st.warning("⚠️ No .eml files found in the ZIP archive")
-                logger.warning("No .eml files found in ZIP archive")
+        zip_file.seek(0)
+        zip_ref = zipfile.ZipFile(zip_file, 'r')
+        eml_files = list(iter_eml_from_zip(zip_ref))
+        
+        if eml_files:
+            st.success(f"📦 Found {len(eml_files)} .eml file(s) in ZIP")
+            logger.info(f"Successfully indexed {len(eml_files)} .eml files in ZIP")
+        else:
+            zip_ref.close()
+            st.warning("⚠️ No .eml files found in the ZIP archive")
+            logger.warning("No .eml files found in ZIP archive")
                 
     except Exception as e:
         st.error(f"Error extracting ZIP file: {str(e)}")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark the embedding executor against a local fake of the OpenAI
+embeddings endpoint, with simulated latency and a request rate limit
+
+    python bench_embeddings.py --texts 2000 --latency 0.2 --server-rpm 600
+
+The fake answers 429 with a Retry-After header once the limit is hit, the
+same way the real API does, so retry and throttling behaviour can be
+checked without an API key or network access.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from embedding_executor import EmbeddingExecutor, openai_embed_batch
+
+DIMENSIONS = 8
+
+def fake_vector(text: str):
+    digest = hashlib.sha256(text.encode()).digest()
+    return [byte / 255.0 for byte in digest[:DIMENSIONS]]
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    """OpenAI-compatible ``POST /v1/embeddings`` with latency and a rate limit"""
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.1, requests_per_minute: int = 0,
+                 window: float = 60.0):
+        super().__init__(('127.0.0.1', port), FakeEmbeddingHandler)
+        self.latency = latency
+        # The limit is enforced over a sliding ``window`` seconds, scaled
+        # from the per-minute figure so short runs can exercise it
+        self.limit = round(requests_per_minute * window / 60)
+        self.window = window
+        self.served = 0
+        self.rejected = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def admit(self) -> float:
+        """0 if the request is within the limit, else seconds until it would be"""
+        if not self.limit:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= self.window:
+                self._recent.popleft()
+            if len(self._recent) >= self.limit:
+                self.rejected += 1
+                return self.window - (now - self._recent[0])
+            self._recent.append(now)
+            return 0.0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        wait = self.server.admit()
+        if wait:
+            self._reply(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                        {'retry-after': f"{wait:.2f}"})
+            return
+        time.sleep(self.server.latency)
+        texts = request['input'] if isinstance(request['input'], list) else [request['input']]
+        with self.server._lock:
+            self.server.served += 1
+        self._reply(200, {
+            'object': 'list',
+            'model': request.get('model'),
+            'data': [{'object': 'embedding', 'index': i, 'embedding': fake_vector(text)}
+                     for i, text in enumerate(texts)],
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+        })
+
+def run(label: str, executor: EmbeddingExecutor, texts):
+    started = time.perf_counter()
+    vectors = executor.embed(texts)
+    seconds = time.perf_counter() - started
+    # The OpenAI client flattens newlines before sending
+    assert vectors == [fake_vector(text.replace("\n", " ")) for text in texts], "vectors out of order"
+    print(f"{label:<22} {len(texts) / seconds:8.1f} texts/s  {seconds:6.2f}s  {executor.stats}")
+    executor.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark batched, concurrent embedding")
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds per request at the fake server")
+    parser.add_argument('--server-rpm', type=int, default=0, help="requests per minute before the fake returns 429")
+    parser.add_argument('--server-window', type=float, default=60.0,
+                        help="seconds over which the fake enforces its limit")
+    parser.add_argument('--client-rpm', type=float, default=None, help="executor request limit")
+    args = parser.parse_args(argv)
+
+    server = FakeEmbeddingServer(latency=args.latency, requests_per_minute=args.server_rpm,
+                                 window=args.server_window).start()
+    texts = [f"email body number {i}\nwith a second line" for i in range(args.texts)]
+
+    # One request at a time, as VectorStoreIndex does with the stock model
+    run("sequential", EmbeddingExecutor(openai_embed_batch('fake', base_url=server.base_url),
+                                        batch_size=args.batch_size, max_concurrency=1,
+                                        token_counter=len), texts)
+    run("executor", EmbeddingExecutor(openai_embed_batch('fake', base_url=server.base_url),
+                                      batch_size=args.batch_size, max_concurrency=args.concurrency,
+                                      requests_per_minute=args.client_rpm, token_counter=len), texts)
+    print(f"server: {server.served} served, {server.rejected} rejected with 429")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark Pinecone upserts against a local stand-in for the index data plane
+
+    python bench_pinecone.py --vectors 5000 --latency 0.05
+
+Compares PineconeVectorStore's sequential 100-vector batches with the bulk
+writer, and reports requests, connections opened and the largest request.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.pinecone import PineconeVectorStore
+from pinecone import Pinecone
+
+from pinecone_writer import MAX_REQUEST_BYTES, BulkPineconeVectorStore
+
+class FakeDataPlane(ThreadingHTTPServer):
+    """Accepts ``POST /vectors/upsert`` like a Pinecone index host"""
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.05, max_request_bytes: int = 0):
+        super().__init__(('127.0.0.1', port), FakeDataPlaneHandler)
+        self.latency = latency
+        self.max_request_bytes = max_request_bytes
+        self.vectors = {}
+        self.requests = 0
+        self.connections = 0
+        self.largest_request = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.connections = self.largest_request = self.rejected = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class FakeDataPlaneHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.largest_request = max(self.server.largest_request, len(raw))
+        if self.path != '/vectors/upsert':
+            self._reply(404, {'message': f"Not found: {self.path}"})
+            return
+        if self.server.max_request_bytes and len(raw) > self.server.max_request_bytes:
+            with self.server.lock:
+                self.server.rejected += 1
+            self._reply(400, {'code': 3, 'message': f"Request size {len(raw)} exceeds the limit"})
+            return
+        time.sleep(self.server.latency)
+        vectors = json.loads(raw)['vectors']
+        with self.server.lock:
+            for vector in vectors:
+                self.server.vectors[vector['id']] = vector
+        self._reply(200, {'upsertedCount': len(vectors)})
+
+def make_nodes(count: int, dimensions: int):
+    rng = random.Random(0)
+    nodes = []
+    for i in range(count):
+        node = TextNode(id_=f"hash-{i:032x}#0", text=f"email {i} " * 40,
+                        metadata={'sender': f"user{i % 50}@example.com", 'subject': f"Subject {i}"})
+        node.embedding = [rng.uniform(-0.1, 0.1) for _ in range(dimensions)]
+        nodes.append(node)
+    return nodes
+
+def run(label: str, server: FakeDataPlane, vector_store, nodes):
+    server.reset_counters()
+    started = time.perf_counter()
+    vector_store.add(nodes)
+    seconds = time.perf_counter() - started
+    print(f"{label:<12} {len(nodes) / seconds:8.1f} vectors/s  {seconds:6.2f}s  "
+          f"{server.requests} requests, {server.connections} connections, "
+          f"largest {server.largest_request / 1e6:.2f} MB, {server.rejected} rejected")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Pinecone upsert throughput")
+    parser.add_argument('--vectors', type=int, default=5000)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per request at the stand-in")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--enforce-size', action='store_true',
+                        help=f"reject requests over {MAX_REQUEST_BYTES} bytes of JSON")
+    args = parser.parse_args(argv)
+
+    server = FakeDataPlane(latency=args.latency,
+                           max_request_bytes=MAX_REQUEST_BYTES if args.enforce_size else 0).start()
+    nodes = make_nodes(args.vectors, args.dimensions)
+    pc = Pinecone(api_key='fake')
+    index = pc.Index(host=server.host, pool_threads=args.workers)
+
+    try:
+        run("sequential", server, PineconeVectorStore(pinecone_index=index), nodes)
+    except Exception as e:
+        print(f"sequential   failed: {str(e).splitlines()[0]}")
+    run("bulk", server, BulkPineconeVectorStore(pinecone_index=index, workers=args.workers), nodes)
+    print(f"stand-in holds {len(server.vectors)} vectors")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Token-budgeted context assembly for direct (no embeddings) generation
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from email_text import clean_body, count_tokens, truncate_to_tokens
+from style_profiles import sender_address
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_TOKEN_BUDGET = 6000
+DEFAULT_MAX_TOKENS_PER_EMAIL = 1200
+# Not worth adding an example that would be cut below this
+MIN_EMAIL_TOKENS = 60
+# Joins the entries of the context
+ENTRY_SEPARATOR = "\n"
+
+def rank_emails(emails: List[Dict], sender_email: Optional[str] = None) -> List[Dict]:
+    """Order candidates: exact sender matches, then ones with a body, then input order
+
+    Input order is kept as the final tiebreaker since callers already sort
+    by recency.
+    """
+    target = (sender_email or '').strip().lower()
+
+    def rank_key(item):
+        position, email = item
+        exact_sender = bool(target) and sender_address(email.get('sender', '')) == target
+        has_body = bool((email.get('body_preview') or '').strip())
+        return (not exact_sender, not has_body, position)
+
+    return [email for _, email in sorted(enumerate(emails), key=rank_key)]
+
+def format_context_entry(idx: int, email: Dict, body: str) -> str:
+    return f"""
+Email {idx}:
+- From: {email.get('sender', 'Unknown')}
+- Subject: {email.get('subject', 'No subject')}
+- Date: {email.get('date', 'Unknown date')}
+- Content: {body}
+---"""
+
+def build_budgeted_context(emails: List[Dict],
+                           sender_email: Optional[str] = None,
+                           token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+                           max_tokens_per_email: int = DEFAULT_MAX_TOKENS_PER_EMAIL,
+                           max_emails: Optional[int] = None) -> Tuple[str, Dict, List[Dict]]:
+    """Fill a token budget with the best-ranked example emails
+
+    Quoted history and signatures are stripped first; a body that is still
+    over ``max_tokens_per_email`` or over what is left of the budget is cut.
+    At most ``max_emails`` examples are used when it is given. Returns the
+    context string, a usage report with per-source counts and the emails
+    used, in context order.
+    """
+    usage = {'budget': token_budget, 'used': 0, 'sources': []}
+    if not emails:
+        return "No previous email history found with this sender.", usage, []
+
+    context_parts = []
+    selected = []
+    separator_tokens = count_tokens(ENTRY_SEPARATOR)
+    for email in rank_emails(emails, sender_email):
+        if max_emails is not None and len(context_parts) >= max_emails:
+            break
+        # Every entry after the first also costs the separator before it
+        joiner_tokens = separator_tokens if context_parts else 0
+        remaining = token_budget - usage['used'] - joiner_tokens
+        header_tokens = count_tokens(format_context_entry(len(context_parts) + 1, email, ''))
+        if remaining - header_tokens < MIN_EMAIL_TOKENS:
+            break
+
+        original = email.get('body_preview') or ''
+        body = clean_body(original) or original.strip() or 'No content'
+        original_tokens = count_tokens(original)
+        body = truncate_to_tokens(body, min(max_tokens_per_email, remaining - header_tokens))
+
+        entry = format_context_entry(len(context_parts) + 1, email, body)
+        entry_tokens = count_tokens(entry)
+        context_parts.append(entry)
+        selected.append(email)
+        usage['used'] += joiner_tokens + entry_tokens
+        usage['sources'].append({
+            'filename': email.get('filename', 'Unknown'),
+            'sender': email.get('sender', ''),
+            'tokens': entry_tokens,
+            'original_body_tokens': original_tokens,
+            'trimmed': count_tokens(body) < original_tokens
+        })
+
+    usage['skipped'] = len(emails) - len(context_parts)
+    logger.info(
+        f"Context builder: {len(context_parts)} emails, {usage['used']}/{token_budget} tokens, "
+        f"{usage['skipped']} skipped"
+    )
+    return ENTRY_SEPARATOR.join(context_parts), usage, selected
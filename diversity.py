@@ -0,0 +1,110 @@
+"""
+Diversity reranking of retrieved examples with maximal marginal relevance
+Works on the vectors and scores the retriever already returned, no extra API calls
+"""
+import logging
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from email_text import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Examples kept for the prompt, and how many candidates they are picked from
+DIVERSE_EXAMPLE_COUNT = 5
+MMR_CANDIDATE_FACTOR = 3
+
+LEXICAL_DIMENSIONS = 1024
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+def lexical_vectors(texts: List[str], dimensions: int = LEXICAL_DIMENSIONS) -> np.ndarray:
+    """Hashed bag-of-words vectors, for nodes that came back without embeddings"""
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in WORD_PATTERN.findall(text.lower()):
+            vectors[row, zlib.crc32(word.encode()) % dimensions] += 1.0
+    return vectors
+
+def cosine_similarity(vectors: np.ndarray) -> np.ndarray:
+    """Pairwise cosine similarity of the rows of ``vectors``"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    return unit @ unit.T
+
+def mmr_select(relevance: np.ndarray, similarity: np.ndarray, k: int,
+               lambda_mult: float = 0.5, duplicate_threshold: float = 0.97) -> List[int]:
+    """Positions of up to ``k`` candidates by maximal marginal relevance
+
+    Each step takes the candidate maximizing
+    ``lambda_mult * relevance - (1 - lambda_mult) * max similarity to those
+    already taken``, from the pairwise ``similarity`` matrix. Candidates at least ``duplicate_threshold`` similar to a
+    taken one (forwards, quoted copies) are never taken.
+    """
+    if not len(relevance):
+        return []
+
+    # Rescale so relevance and similarity trade off on the same 0-1 range
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    available = redundancy < duplicate_threshold
+    available[selected[0]] = False
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+        available &= similarity[best] < duplicate_threshold
+        available[best] = False
+    return selected
+
+class MMRPostprocessor(BaseNodePostprocessor):
+    """Keep ``top_n`` relevant but mutually dissimilar nodes
+
+    Relevance is the retriever's score. Two nodes are compared by their
+    stored embeddings when both have one, and by hashed word counts
+    otherwise, e.g. for keyword-only hits.
+    """
+
+    top_n: int = Field(default=DIVERSE_EXAMPLE_COUNT)
+    lambda_mult: float = Field(default=0.5, description="1.0 ranks by relevance only")
+    duplicate_threshold: float = Field(default=0.97)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MMRPostprocessor"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if len(nodes) <= 1:
+            return nodes
+        embedded = [i for i, node in enumerate(nodes) if node.node.embedding is not None]
+        if len(embedded) == len(nodes):
+            similarity = cosine_similarity(np.asarray([node.node.embedding for node in nodes], dtype=np.float32))
+        else:
+            similarity = cosine_similarity(
+                lexical_vectors([node.node.get_content(MetadataMode.NONE) for node in nodes])
+            )
+            if len(embedded) > 1:
+                similarity[np.ix_(embedded, embedded)] = cosine_similarity(
+                    np.asarray([nodes[i].node.embedding for i in embedded], dtype=np.float32)
+                )
+        relevance = np.array([node.score if node.score is not None else 0.0 for node in nodes])
+
+        chosen = [nodes[i] for i in mmr_select(relevance, similarity, self.top_n,
+                                               self.lambda_mult, self.duplicate_threshold)]
+        logger.info(
+            f"MMR kept {len(chosen)} of {len(nodes)} nodes "
+            f"({sum(count_tokens(node.node.get_content()) for node in chosen)} of "
+            f"{sum(count_tokens(node.node.get_content()) for node in nodes)} tokens)"
+        )
+        return chosen
@@ -0,0 +1,193 @@
+"""
+Email-aware chunking of documents before embedding
+Splits long emails where quoted history starts, drops delimited signature
+blocks and packs paragraphs under a token budget; short emails stay whole
+"""
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tqdm_iterable
+
+from email_text import REPLY_HEADER_PATTERNS, SIGNATURE_PATTERNS, count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_TOKENS = 512
+# Chunks smaller than this are merged into the next one when they fit
+MIN_CHUNK_TOKENS = 64
+
+PARENT_ID_KEY = 'parent_id'
+CHUNK_INDEX_KEY = 'chunk_index'
+CHUNK_COUNT_KEY = 'chunk_count'
+CHUNK_METADATA_KEYS = [PARENT_ID_KEY, CHUNK_INDEX_KEY, CHUNK_COUNT_KEY]
+
+# Placed between non-adjacent chunks when merging them back together
+ELIDED_SEPARATOR = '\n\n[...]\n\n'
+
+def _is_reply_header(line: str, after_blank: bool) -> bool:
+    # A From: line only starts a quoted message after a blank line
+    if REPLY_HEADER_PATTERNS[-1].match(line) and not after_blank:
+        return False
+    return any(pattern.match(line) for pattern in REPLY_HEADER_PATTERNS)
+
+def _is_signature(line: str) -> bool:
+    return any(pattern.match(line) for pattern in SIGNATURE_PATTERNS)
+
+def email_blocks(text: str) -> List[Tuple[str, str]]:
+    """Paragraph blocks of an email as ``(kind, text)`` pairs
+
+    ``kind`` is 'quote' for a block starting quoted history (a reply
+    header or the first of a run of ``>`` lines), 'signature' for a
+    delimited signature up to the next blank line, and 'text' otherwise.
+    """
+    blocks = []
+    kind, lines = 'text', []
+
+    def flush():
+        if lines:
+            blocks.append((kind, '\n'.join(lines).strip('\n')))
+        lines.clear()
+
+    for line in text.splitlines():
+        if not line.strip():
+            flush()
+            kind = 'text'
+            continue
+        quoted = line.lstrip().startswith('>')
+        if _is_reply_header(line, not lines) or (quoted and kind != 'quote'):
+            flush()
+            kind = 'quote'
+        elif _is_signature(line) and kind != 'signature':
+            flush()
+            kind = 'signature'
+        elif kind == 'quote' and lines and not quoted and lines[-1].lstrip().startswith('>'):
+            # Inline reply after a quoted passage
+            flush()
+            kind = 'text'
+        lines.append(line)
+    flush()
+    return blocks
+
+class EmailNodeParser(NodeParser):
+    """Chunk email Documents on quote, signature and paragraph boundaries
+
+    A document whose text and metadata fit ``chunk_size`` tokens becomes a
+    single node with its text unchanged. Longer ones are split: each block
+    of quoted history starts a new chunk, signature blocks are dropped, and
+    paragraphs are packed greedily, with oversized paragraphs split by
+    sentence. Every node records its email in ``parent_id`` along with its
+    ``chunk_index`` and ``chunk_count``, so merge_chunks() can put
+    retrieved chunks back together.
+    """
+
+    chunk_size: int = Field(default=DEFAULT_CHUNK_TOKENS, gt=0)
+    min_chunk_size: int = Field(default=MIN_CHUNK_TOKENS, ge=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "EmailNodeParser"
+
+    def _budget(self, node: BaseNode) -> int:
+        # Metadata is embedded and prompted with every chunk
+        metadata_tokens = max(
+            count_tokens(node.get_metadata_str(mode=MetadataMode.EMBED)),
+            count_tokens(node.get_metadata_str(mode=MetadataMode.LLM)),
+        )
+        return max(self.chunk_size - metadata_tokens, self.chunk_size // 4)
+
+    def split_email(self, text: str, budget: int) -> List[str]:
+        """Chunk texts for one email body under ``budget`` tokens each"""
+        if count_tokens(text) <= budget:
+            return [text.strip()]
+
+        splitter = None
+        chunks = []  # [tokens, [block texts]]
+        for kind, block in email_blocks(text):
+            if kind == 'signature':
+                continue
+            tokens = count_tokens(block)
+            if tokens > budget:
+                splitter = splitter or SentenceSplitter(chunk_size=budget, chunk_overlap=0)
+                pieces = splitter.split_text(block)
+            else:
+                pieces = [block]
+            starts_chunk = kind == 'quote'
+            for piece in pieces:
+                size = count_tokens(piece) if len(pieces) > 1 else tokens
+                # Separator tokens are ignored; they are a few per chunk at most
+                if chunks and not starts_chunk and chunks[-1][0] + size <= budget:
+                    chunks[-1][0] += size
+                    chunks[-1][1].append(piece)
+                else:
+                    chunks.append([size, [piece]])
+                starts_chunk = False
+
+        merged = []
+        for size, pieces in chunks:
+            if merged and merged[-1][0] < self.min_chunk_size and merged[-1][0] + size <= budget:
+                merged[-1][0] += size
+                merged[-1][1].extend(pieces)
+            else:
+                merged.append([size, list(pieces)])
+        return ['\n\n'.join(pieces) for _, pieces in merged]
+
+    def _parse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False,
+                     **kwargs: Any) -> List[BaseNode]:
+        all_nodes = []
+        for node in get_tqdm_iterable(nodes, show_progress, "Chunking emails"):
+            splits = self.split_email(node.get_content(), self._budget(node))
+            chunk_nodes = build_nodes_from_splits(splits, node, id_func=self.id_func)
+            for index, chunk in enumerate(chunk_nodes):
+                chunk.metadata.update({
+                    PARENT_ID_KEY: node.node_id,
+                    CHUNK_INDEX_KEY: index,
+                    CHUNK_COUNT_KEY: len(chunk_nodes),
+                })
+                # New lists: the document's are shared by all of its chunks
+                chunk.excluded_embed_metadata_keys = node.excluded_embed_metadata_keys + CHUNK_METADATA_KEYS
+                chunk.excluded_llm_metadata_keys = node.excluded_llm_metadata_keys + CHUNK_METADATA_KEYS
+            all_nodes.extend(chunk_nodes)
+
+        if nodes:
+            logger.info(
+                f"Chunked {len(nodes)} emails into {len(all_nodes)} chunks "
+                f"({sum(count_tokens(chunk.get_content()) for chunk in all_nodes)} tokens)"
+            )
+        return all_nodes
+
+def parent_id(node: BaseNode) -> str:
+    """ID of the email a chunk came from; a node that is not a chunk is its own"""
+    return node.metadata.get(PARENT_ID_KEY) or node.ref_doc_id or node.node_id
+
+def merge_chunks(nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+    """One node per email, joining its retrieved chunks in document order
+
+    Each email takes the place and score of its best chunk, and keeps that
+    chunk's metadata and embedding. Chunks that were not adjacent in the
+    email are joined with ELIDED_SEPARATOR.
+    """
+    groups: Dict[str, List[NodeWithScore]] = {}
+    for node in nodes:
+        groups.setdefault(parent_id(node.node), []).append(node)
+
+    merged = []
+    for group in groups.values():
+        best = max(group, key=lambda node: node.score if node.score is not None else 0.0)
+        if len(group) == 1:
+            merged.append(best)
+            continue
+        ordered = sorted(group, key=lambda node: node.node.metadata.get(CHUNK_INDEX_KEY, 0))
+        text = ordered[0].node.get_content()
+        for previous, node in zip(ordered, ordered[1:]):
+            adjacent = node.node.metadata.get(CHUNK_INDEX_KEY, 0) == previous.node.metadata.get(CHUNK_INDEX_KEY, 0) + 1
+            text += ('\n\n' if adjacent else ELIDED_SEPARATOR) + node.node.get_content()
+        merged.append(NodeWithScore(node=best.node.copy(update={'text': text}), score=best.score))
+
+    merged.sort(key=lambda node: node.score if node.score is not None else 0.0, reverse=True)
+    if len(merged) < len(nodes):
+        logger.debug(f"Merged {len(nodes)} chunks into {len(merged)} emails")
+    return merged
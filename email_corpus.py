@@ -0,0 +1,240 @@
+"""
+Column-oriented container for a parsed email corpus
+Holds what used to be a list of dicts in session state at a fraction of the memory
+"""
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Stands in for a Date header that did not parse
+MISSING_TS = np.iinfo(np.int64).min
+
+# Fields of the dicts produced by EmailProcessor, in display order
+TEXT_FIELDS = ('subject', 'date', 'body', 'filename', 'message_id', 'hash')
+LIST_FIELDS = ('to', 'cc')
+# Separates addresses of a list field inside its string column
+LIST_SEPARATOR = '\n'
+# Columns the pages display; bodies stay in the corpus buffers
+DISPLAY_FIELDS = ('filename', 'from', 'subject', 'date', 'date_ts', 'body_length')
+
+class StringColumn:
+    """Strings stored back to back in one UTF-8 buffer, located by offsets
+
+    ``offsets`` has one more entry than there are strings; string ``i`` is
+    ``data[offsets[i]:offsets[i + 1]]``. This is Arrow's large_string
+    layout, so an Arrow array can wrap the buffers without copying.
+    """
+
+    def __init__(self, values: Iterable[str]):
+        data = bytearray()
+        offsets = [0]
+        for value in values:
+            data += (value or '').encode('utf-8', 'surrogatepass')
+            offsets.append(len(data))
+        self.data = bytes(data)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].decode('utf-8', 'surrogatepass')
+
+    def to_list(self) -> List[str]:
+        return [self[idx] for idx in range(len(self))]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.nbytes
+
+class EmailCorpus(Sequence):
+    """Parsed emails stored column by column
+
+    Senders are interned (an int32 code per email plus one copy of each
+    distinct From header), dates are an int64 epoch column, and text fields
+    such as bodies live in StringColumns. Indexing or iterating yields the
+    same dicts EmailProcessor produces, so code written against a list of
+    dicts keeps working; hot paths can read the columns directly instead.
+    """
+
+    def __init__(self, records: Iterable[Dict]):
+        sender_codes = {}
+        codes = []
+        date_ts = []
+        tz_offsets = []
+        body_chars = []
+        text = {field: [] for field in TEXT_FIELDS + LIST_FIELDS}
+
+        for record in records:
+            sender = record.get('from', '')
+            codes.append(sender_codes.setdefault(sender, len(sender_codes)))
+            ts = record.get('date_ts')
+            date_ts.append(MISSING_TS if ts is None else ts)
+            tz_offsets.append(record.get('date_tz_offset') or 0)
+            body_chars.append(len(record.get('body') or ''))
+            for field in TEXT_FIELDS:
+                text[field].append(record.get(field, ''))
+            for field in LIST_FIELDS:
+                text[field].append(LIST_SEPARATOR.join(record.get(field) or []))
+
+        self.senders = list(sender_codes)
+        self.sender_codes = np.asarray(codes, dtype=np.int32)
+        self.date_ts = np.asarray(date_ts, dtype=np.int64)
+        self.date_tz_offset = np.asarray(tz_offsets, dtype=np.int16)
+        # Characters, not the encoded bytes the body buffer holds
+        self.body_chars = np.asarray(body_chars, dtype=np.int64)
+        self.columns = {field: StringColumn(values) for field, values in text.items()}
+        self._hash_positions = None
+        logger.info(
+            f"Email corpus: {len(self)} emails, {len(self.senders)} distinct senders, "
+            f"{self.nbytes / 1e6:.1f} MB"
+        )
+
+    @classmethod
+    def from_records(cls, records: Union["EmailCorpus", Iterable[Dict]]) -> "EmailCorpus":
+        """Build a corpus from parsed email dicts; a corpus is returned as is"""
+        if isinstance(records, cls):
+            return records
+        return cls(records)
+
+    def __len__(self) -> int:
+        return len(self.sender_codes)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[pos] for pos in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('email index out of range')
+
+        ts = int(self.date_ts[idx])
+        row = {
+            'subject': self.columns['subject'][idx],
+            'from': self.senders[self.sender_codes[idx]],
+            'to': self._split(self.columns['to'][idx]),
+            'cc': self._split(self.columns['cc'][idx]),
+            'date': self.columns['date'][idx],
+            'date_ts': None if ts == MISSING_TS else ts,
+            'date_tz_offset': None if ts == MISSING_TS else int(self.date_tz_offset[idx]),
+        }
+        for field in ('body', 'filename', 'message_id', 'hash'):
+            row[field] = self.columns[field][idx]
+        return row
+
+    def __iter__(self) -> Iterator[Dict]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @staticmethod
+    def _split(joined: str) -> List[str]:
+        return joined.split(LIST_SEPARATOR) if joined else []
+
+    def column(self, field: str) -> List[str]:
+        """All values of a text field, e.g. every From header"""
+        if field == 'from':
+            return [self.senders[code] for code in self.sender_codes]
+        return self.columns[field].to_list()
+
+    def dated(self) -> np.ndarray:
+        """Mask of emails whose Date header parsed"""
+        return self.date_ts != MISSING_TS
+
+    def position_of(self, content_hash: str) -> Optional[int]:
+        """Position of the email with this content hash, if present"""
+        if self._hash_positions is None:
+            hashes = self.columns['hash']
+            self._hash_positions = {hashes[idx]: idx for idx in range(len(self))}
+        return self._hash_positions.get(content_hash)
+
+    def to_frame(self, fields: Sequence[str] = DISPLAY_FIELDS) -> pd.DataFrame:
+        """DataFrame with one row per email and only the given ``fields``
+
+        Senders come out as a Categorical over the interned codes and
+        ``date_ts`` as a nullable Int64 over the epoch column, neither
+        copied; other text fields are decoded into new strings, so the
+        frame is built per call and not kept. ``body_length`` is the
+        length of each body in characters, read without decoding it.
+        """
+        frame = {}
+        for field in fields:
+            if field == 'from':
+                frame[field] = pd.Categorical.from_codes(self.sender_codes,
+                                                         categories=pd.Index(self.senders, dtype=object))
+            elif field == 'date_ts':
+                frame[field] = pd.arrays.IntegerArray(self.date_ts, ~self.dated())
+            elif field == 'body_length':
+                frame[field] = self.body_lengths()
+            elif field in LIST_FIELDS:
+                frame[field] = [self._split(value) for value in self.column(field)]
+            else:
+                frame[field] = self.column(field)
+        return pd.DataFrame(frame)
+
+    def to_arrow(self):
+        """Arrow table whose text columns wrap the corpus buffers without copying"""
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError("EmailCorpus.to_arrow requires pyarrow: pip install pyarrow") from e
+
+        columns = {}
+        for field in ('subject', 'date', 'body', 'filename', 'message_id', 'hash'):
+            column = self.columns[field]
+            columns[field] = pa.LargeStringArray.from_buffers(
+                len(column), pa.py_buffer(column.offsets), pa.py_buffer(column.data)
+            )
+        columns['from'] = pa.DictionaryArray.from_arrays(
+            pa.array(self.sender_codes), pa.array(self.senders, type=pa.string())
+        )
+        columns['date_ts'] = pa.array(self.date_ts, mask=~self.dated())
+        return pa.table(columns)
+
+    def body_lengths(self) -> np.ndarray:
+        """Length of each body in characters, without decoding any body"""
+        return self.body_chars
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the corpus"""
+        return (sum(column.nbytes for column in self.columns.values())
+                + self.sender_codes.nbytes + self.date_ts.nbytes + self.date_tz_offset.nbytes
+                + self.body_chars.nbytes
+                + sum(len(sender) for sender in self.senders))
+
+def emails_frame(emails: Union[EmailCorpus, List[Dict]],
+                 fields: Sequence[str] = DISPLAY_FIELDS) -> pd.DataFrame:
+    """DataFrame of the given ``fields`` of parsed emails, bodies left out by default"""
+    if isinstance(emails, EmailCorpus):
+        return emails.to_frame(fields)
+    frame = pd.DataFrame(emails)
+    if 'body_length' in fields:
+        frame['body_length'] = [len(email.get('body') or '') for email in emails]
+    return frame[[field for field in fields if field in frame]]
+
+def matching_positions(emails: Union[EmailCorpus, List[Dict]], term: str,
+                       fields: Sequence[str] = ('from', 'subject', 'body', 'filename')) -> List[int]:
+    """Positions of emails with ``term`` in any of ``fields``, ignoring case
+
+    A plain scan for when there is no full-text index; each field is
+    decoded one at a time rather than kept.
+    """
+    term = term.lower()
+    matched = set()
+    for field in fields:
+        if isinstance(emails, EmailCorpus):
+            values = emails.column(field)
+        else:
+            values = [str(email.get(field) or '') for email in emails]
+        matched.update(pos for pos, value in enumerate(values) if term in value.lower())
+    return sorted(matched)
+
+def sender_column(emails: Union[EmailCorpus, List[Dict]]) -> List[str]:
+    """From header of every email, read straight from a corpus's interned column"""
+    if isinstance(emails, EmailCorpus):
+        return emails.column('from')
+    return [email.get('from', '') for email in emails]
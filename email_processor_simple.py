@@ -3,64 +3,231 @@ Simple email processor using Python's built-in email module
 Replacement for eml_parser to avoid cchardet build issues
 """
 import email
+import os
 from email import policy
 from email.parser import BytesParser
-import streamlit as st
 import pandas as pd
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Tuple
 import json
 import hashlib
+import time
 from datetime import datetime
 from collections import Counter
 import chardet
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from parse_cache import ParseCache
+from progress import ProgressReporter, StreamlitReporter
+from email_text import parse_date_header
+from email_corpus import emails_frame, sender_column
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Below this many files the process pool costs more to spin up than it saves
+PARALLEL_PARSE_THRESHOLD = 200
+PARSE_CHUNK_SIZE = 64
+# chardet is only consulted on this many leading bytes
+CHARDET_SAMPLE_BYTES = 32 * 1024
+
+def decode_payload(payload: bytes, declared_charset: Optional[str] = None) -> str:
+    """Decode a MIME payload, trusting the declared charset first
+    
+    The declared ``charset`` and then UTF-8 are tried as strict decodes;
+    statistical detection only runs, on a bounded sample, when both fail.
+    """
+    for candidate in (declared_charset, 'utf-8'):
+        if not candidate:
+            continue
+        try:
+            return payload.decode(candidate)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    
+    detected = chardet.detect(payload[:CHARDET_SAMPLE_BYTES])
+    encoding = detected['encoding'] or 'utf-8'
+    try:
+        return payload.decode(encoding, errors='ignore')
+    except LookupError:
+        return payload.decode('utf-8', errors='ignore')
+
+def error_record(filename: str, error: str, digest: str) -> Dict:
+    """Minimal placeholder for an email that could not be read or parsed"""
+    return {
+        'subject': f"Error: {filename}",
+        'from': 'unknown',
+        'to': [],
+        'date': datetime.now().isoformat(),
+        'date_ts': int(time.time()),
+        'date_tz_offset': 0,
+        'body': f"Error processing email: {error}",
+        'filename': filename,
+        'message_id': '',
+        'hash': digest
+    }
+
+def read_email_file(uploaded_file) -> Tuple[Optional[bytes], str, Optional[str]]:
+    """``(raw_email, name, error)`` for one file; ``raw_email`` is None if it could not be read
+
+    A corrupt ZIP member or an unreadable file is reported like a parse
+    error instead of stopping the whole upload.
+    """
+    try:
+        return uploaded_file.read(), uploaded_file.name, None
+    except Exception as e:
+        return None, uploaded_file.name, f"Could not read file: {str(e)}"
+
+def parse_raw_email(raw_email: bytes, filename: str) -> Tuple[Dict, Optional[str]]:
+    """Parse raw .eml bytes into the structured email dict.
+
+    Returns ``(email_data, error)``. When parsing fails ``email_data`` is the
+    minimal placeholder record and ``error`` holds the message to report.
+    Kept at module level so it can be shipped to worker processes.
+    """
+    try:
+        # Parse email using built-in parser
+        msg = BytesParser(policy=policy.default).parsebytes(raw_email)
+        
+        # Body parts are decoded by their own declared charsets
+        encoding = msg.get_content_charset() or 'utf-8'
+        
+        # Extract email data
+        return EmailProcessor().extract_email_info_from_msg(msg, filename, encoding), None
+    except Exception as e:
+        # Add minimal data even on error
+        return error_record(filename, str(e), hashlib.md5(raw_email).hexdigest()), str(e)
+
+def parse_pool_size(max_workers: Optional[int] = None) -> int:
+    """Processes a parallel parse uses for ``max_workers`` (None: one per CPU)"""
+    return max_workers or os.cpu_count() or 1
+
+def _parse_raw_email_args(args: Tuple[bytes, str]) -> Tuple[Dict, Optional[str]]:
+    return parse_raw_email(*args)
 
 class EmailProcessor:
-    def __init__(self):
+    def __init__(self, parse_cache: Optional[ParseCache] = None,
+                 reporter: Optional[ProgressReporter] = None):
         self.parsed_emails = []
+        self.parse_cache = parse_cache
+        # Progress goes to the Streamlit page unless a caller says otherwise
+        self.reporter = reporter
     
-    def parse_eml_files(self, uploaded_files) -> List[Dict]:
-        """Parse multiple .eml files and extract structured data"""
+    def iter_parse_eml_files(self, uploaded_files, parallel: bool = False,
+                             max_workers: Optional[int] = None,
+                             chunk_size: int = PARSE_CHUNK_SIZE) -> Iterator[Tuple[Dict, Optional[str]]]:
+        """Lazily parse files, yielding ``(email_data, error)`` in input order
+        
+        Files are only read when their turn comes, so at most one window of
+        raw messages is held in memory at a time. This lets ZIP members be
+        decompressed on demand instead of up front.
+        """
+        jobs = (read_email_file(uploaded_file) for uploaded_file in uploaded_files)
+        chunk_size = max(1, chunk_size)
+        
+        executor = None
+        window_size = chunk_size
+        if parallel:
+            max_workers = parse_pool_size(max_workers)
+            # Keep every worker busy with a couple of chunks, but no more
+            window_size = chunk_size * max_workers * 2
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        
+        try:
+            while True:
+                window = list(islice(jobs, window_size))
+                if not window:
+                    break
+                yield from self._parse_window(window, executor, chunk_size)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    
+    def _parse_window(self, window: List[Tuple[Optional[bytes], str, Optional[str]]], executor, chunk_size: int):
+        """Parse one window of raw messages, serving cache hits without parsing"""
+        keys = [
+            ParseCache.key_for(raw_email) if self.parse_cache is not None and raw_email is not None else None
+            for raw_email, _, _ in window
+        ]
+        cached = self.parse_cache.get_many([key for key in keys if key is not None]) if self.parse_cache is not None else {}
+        
+        # A message repeated inside the window only needs parsing once
+        misses = []
+        queued = set()
+        for (raw_email, name, read_error), key in zip(window, keys):
+            if read_error or key in cached or key in queued:
+                continue
+            if key is not None:
+                queued.add(key)
+            misses.append((raw_email, name))
+        
+        if executor is not None:
+            parsed = executor.map(_parse_raw_email_args, misses, chunksize=chunk_size)
+        else:
+            parsed = (parse_raw_email(raw_email, name) for raw_email, name in misses)
+        
+        seen = {}
+        new_entries = []
+        for (raw_email, name, read_error), key in zip(window, keys):
+            if read_error:
+                # Named after the file, since there are no bytes to hash
+                yield error_record(name, read_error, hashlib.md5(f"unreadable:{name}".encode()).hexdigest()), read_error
+                continue
+            if key in cached:
+                email_data = dict(cached[key])
+                # Same message may arrive under a different name this time
+                email_data['filename'] = name
+                yield email_data, None
+                continue
+            
+            if key in seen:
+                email_data, error = seen[key]
+                email_data = dict(email_data, filename=name)
+            else:
+                email_data, error = next(parsed)
+                if key is not None:
+                    seen[key] = (email_data, error)
+                    if not error:
+                        new_entries.append((key, dict(email_data)))
+            yield email_data, error
+        
+        if new_entries:
+            self.parse_cache.put_many(new_entries)
+    
+    def parse_eml_files(self, uploaded_files, parallel: Optional[bool] = None,
+                        max_workers: Optional[int] = None,
+                        chunk_size: int = PARSE_CHUNK_SIZE,
+                        total: Optional[int] = None) -> List[Dict]:
+        """Parse multiple .eml files and extract structured data
+        
+        With ``parallel`` the raw bytes are parsed in a process pool, sent in
+        chunks of ``chunk_size`` messages; results keep the input order. Left
+        as ``None`` it is enabled for uploads of PARALLEL_PARSE_THRESHOLD files
+        or more. ``uploaded_files`` may be any iterable of file-like objects;
+        pass ``total`` when it has no ``len()``.
+        """
         parsed_data = []
+        if total is None:
+            total = len(uploaded_files)
+        if parallel is None:
+            parallel = total >= PARALLEL_PARSE_THRESHOLD
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        reporter = self.reporter if self.reporter is not None else StreamlitReporter()
+        reporter.start(total, label="parse")
         
-        for idx, uploaded_file in enumerate(uploaded_files):
-            try:
-                raw_email = uploaded_file.read()
-                
-                # Detect encoding
-                detected = chardet.detect(raw_email)
-                encoding = detected['encoding'] or 'utf-8'
-                
-                # Parse email using built-in parser
-                msg = BytesParser(policy=policy.default).parsebytes(raw_email)
-                
-                # Extract email data
-                email_data = self.extract_email_info_from_msg(msg, uploaded_file.name, encoding)
-                
-                parsed_data.append(email_data)
-                
-                # Update progress
-                progress = (idx + 1) / len(uploaded_files)
-                progress_bar.progress(progress)
-                status_text.text(f"Processing: {idx + 1}/{len(uploaded_files)} emails")
-                
-            except Exception as e:
-                st.warning(f"⚠️ Error processing {uploaded_file.name}: {str(e)}")
-                # Add minimal data even on error
-                parsed_data.append({
-                    'subject': f"Error: {uploaded_file.name}",
-                    'from': 'unknown',
-                    'to': [],
-                    'date': datetime.now().isoformat(),
-                    'body': f"Error processing email: {str(e)}",
-                    'filename': uploaded_file.name,
-                    'hash': hashlib.md5(raw_email).hexdigest()
-                })
+        results = self.iter_parse_eml_files(uploaded_files, parallel, max_workers, chunk_size)
+        for idx, (email_data, error) in enumerate(results):
+            if error:
+                reporter.warning(f"⚠️ Error processing {email_data['filename']}: {error}")
+            
+            parsed_data.append(email_data)
+            
+            # Update progress
+            reporter.advance(idx + 1, f"Processing: {idx + 1}/{total} emails")
         
-        progress_bar.empty()
-        status_text.empty()
+        reporter.finish()
+        
+        if self.parse_cache is not None:
+            logger.info(f"Parse cache: {self.parse_cache.hits} hits, {self.parse_cache.misses} misses")
         
         self.parsed_emails = parsed_data
         return parsed_data
@@ -74,6 +241,9 @@ class EmailProcessor:
         to_addrs = str(msg.get('To', '')).split(',')
         cc_addrs = str(msg.get('Cc', '')).split(',') if msg.get('Cc') else []
         date_str = str(msg.get('Date', ''))
+        message_id = str(msg.get('Message-ID', '')).strip()
+        # Parsed once here so sorting and range filters never re-parse strings
+        date_ts, date_tz_offset = parse_date_header(date_str)
         
         # Extract body
         body = self.extract_body(msg)
@@ -89,8 +259,11 @@ class EmailProcessor:
             'to': [addr.strip() for addr in to_addrs if addr.strip()],
             'cc': [addr.strip() for addr in cc_addrs if addr.strip()],
             'date': date_str,
+            'date_ts': date_ts,
+            'date_tz_offset': date_tz_offset,
             'body': body,
             'filename': filename,
+            'message_id': message_id,
             'hash': content_hash
         }
     
@@ -115,9 +288,7 @@ class EmailProcessor:
                         try:
                             payload = part.get_payload(decode=True)
                             if payload:
-                                detected = chardet.detect(payload)
-                                encoding = detected['encoding'] or 'utf-8'
-                                body_parts.append(payload.decode(encoding, errors='ignore'))
+                                body_parts.append(decode_payload(payload, part.get_content_charset()))
                         except:
                             pass
                 elif content_type == "text/html" and not body_parts:
@@ -139,9 +310,7 @@ class EmailProcessor:
                 try:
                     payload = msg.get_payload(decode=True)
                     if payload:
-                        detected = chardet.detect(payload)
-                        encoding = detected['encoding'] or 'utf-8'
-                        body_parts.append(payload.decode(encoding, errors='ignore'))
+                        body_parts.append(decode_payload(payload, msg.get_content_charset()))
                 except:
                     body_parts.append("Could not extract body")
         
@@ -151,8 +320,7 @@ class EmailProcessor:
         """Detect the user's email address from the corpus"""
         from_counter = Counter()
         
-        for email_data in parsed_emails:
-            from_addr = email_data.get('from', '')
+        for from_addr in sender_column(parsed_emails):
             if from_addr and '@' in from_addr:
                 # Extract just the email part if it includes name
                 if '<' in from_addr and '>' in from_addr:
@@ -174,15 +342,14 @@ class EmailProcessor:
         if not parsed_emails:
             return {}
         
-        df = pd.DataFrame(parsed_emails)
+        df = emails_frame(parsed_emails)
         
         # Email statistics
         total_emails = len(parsed_emails)
         unique_senders = df['from'].nunique() if 'from' in df else 0
         
         # Body statistics
-        if 'body' in df:
-            df['body_length'] = df['body'].str.len()
+        if 'body_length' in df:
             avg_body_length = df['body_length'].mean()
             emails_with_body = (df['body_length'] > 0).sum()
         else:
@@ -191,9 +358,8 @@ class EmailProcessor:
         
         # Date range
         try:
-            if 'date' in df and not df['date'].empty:
-                dates = pd.to_datetime(df['date'], errors='coerce')
-                valid_dates = dates.dropna()
+            if 'date_ts' in df and not df['date_ts'].empty:
+                valid_dates = pd.to_datetime(df['date_ts'].dropna().astype('int64'), unit='s', utc=True)
                 if not valid_dates.empty:
                     date_range = f"{valid_dates.min().date()} to {valid_dates.max().date()}"
                 else:
@@ -211,8 +377,11 @@ class EmailProcessor:
             'date_range': date_range
         }
 
-def create_vector_database(parsed_emails):
-    """Main function to create vector database"""
+def create_vector_database(parsed_emails, incremental: bool = True):
+    """Main function to create vector database
+    
+    With ``incremental`` only emails missing from the index are embedded.
+    """
     import streamlit as st
     import logging
     logger = logging.getLogger(__name__)
@@ -229,7 +398,7 @@ def create_vector_database(parsed_emails):
         vector_manager = VectorManager()
         
         logger.info("VectorManager initialized, creating vector store...")
-        index = vector_manager.create_vector_store(parsed_emails)
+        index = vector_manager.create_vector_store(parsed_emails, incremental=incremental)
         
         if index:
             st.session_state['vector_index'] = index
@@ -243,7 +412,7 @@ def create_vector_database(parsed_emails):
             with col1:
                 st.metric("📧 Emails Processed", len(parsed_emails))
             with col2:
-                unique_senders = len(set([email['from'] for email in parsed_emails]))
+                unique_senders = len(set(sender_column(parsed_emails)))
                 st.metric("👥 Unique Senders", unique_senders)
             with col3:
                 st.metric("🗃️ Vector Dimensions", 1536)
@@ -0,0 +1,101 @@
+"""
+Lazy file handles for emails stored in directories, ZIP archives and mbox files
+Each handle has a ``name`` and a ``read()`` returning the raw message bytes
+"""
+import logging
+import mailbox
+import os
+import zipfile
+from typing import Iterator, List
+
+logger = logging.getLogger(__name__)
+
+class ZipEMLFile:
+    """Lazy handle on a .eml member of an open ZIP archive"""
+
+    def __init__(self, zip_ref, info):
+        self.name = os.path.basename(info.filename)  # Just the filename for processing
+        self.full_path = info.filename  # Keep full path for display
+        self.size = info.file_size
+        self._zip_ref = zip_ref
+        self._info = info
+
+    def read(self):
+        # Decompressed on demand so only the messages being parsed are in memory
+        return self._zip_ref.read(self._info)
+
+class PathEMLFile:
+    """Lazy handle on a .eml file on disk"""
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        self.full_path = path
+        self.size = os.path.getsize(path)
+
+    def read(self):
+        with open(self.full_path, 'rb') as f:
+            return f.read()
+
+class MboxMessageFile:
+    """Lazy handle on one message of an mbox file"""
+
+    def __init__(self, mbox: mailbox.mbox, key, name: str):
+        self.name = name
+        self.full_path = name
+        self._mbox = mbox
+        self._key = key
+
+    def read(self):
+        return self._mbox.get_bytes(self._key)
+
+def iter_eml_from_zip(zip_ref):
+    """Yield lazy handles for the .eml members of an open ZipFile"""
+    for file_info in zip_ref.infolist():
+        # Check for all .eml files
+        if file_info.is_dir() or file_info.filename.startswith('__MACOSX/'):
+            continue
+        if file_info.filename.lower().endswith('.eml'):
+            logger.debug(f"Found .eml file: {file_info.filename}")
+            yield ZipEMLFile(zip_ref, file_info)
+
+def close_email_files(handles):
+    """Close the ZIP archives behind ``handles``; other handles hold nothing open"""
+    archives = {id(handle._zip_ref): handle._zip_ref for handle in handles if isinstance(handle, ZipEMLFile)}
+    for archive in archives.values():
+        archive.close()
+
+def iter_eml_from_dir(path: str) -> Iterator[PathEMLFile]:
+    """Yield handles for every .eml file under ``path``, in a stable order"""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith('.eml'):
+                yield PathEMLFile(os.path.join(root, filename))
+
+def iter_eml_from_mbox(path: str) -> Iterator[MboxMessageFile]:
+    """Yield a handle per message of an mbox file, named ``<file>#<n>``"""
+    mbox = mailbox.mbox(path, create=False)
+    base = os.path.basename(path)
+    for position, key in enumerate(mbox.iterkeys(), 1):
+        yield MboxMessageFile(mbox, key, f"{base}#{position}")
+
+def collect_email_files(paths: List[str]) -> List:
+    """Handles for every email in the given directories, .eml, .zip and mbox files
+
+    Any other regular file is read as an mbox.
+    """
+    handles = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = list(iter_eml_from_dir(path))
+        elif path.lower().endswith('.eml'):
+            found = [PathEMLFile(path)]
+        elif zipfile.is_zipfile(path):
+            found = list(iter_eml_from_zip(zipfile.ZipFile(path, 'r')))
+        elif os.path.isfile(path):
+            found = list(iter_eml_from_mbox(path))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+        logger.info(f"Found {len(found)} emails in {path}")
+        handles.extend(found)
+    return handles
@@ -0,0 +1,114 @@
+"""
+Text helpers for email headers and bodies: date normalization, token
+counting and removal of quoted history and signature blocks
+"""
+import re
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+from llama_index.core.utils import get_tokenizer
+
+# "On Mon, Jan 15, 2024 at 2:32 PM Jane <jane@x.com> wrote:" and the
+# Outlook-style separators that introduce a quoted earlier message
+REPLY_HEADER_PATTERNS = [
+    re.compile(r'^\s*On\b.{0,300}\bwrote:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*-{2,}\s*Original Message\s*-{2,}\s*$', re.IGNORECASE),
+    re.compile(r'^\s*-{2,}\s*Forwarded message\s*-{2,}\s*$', re.IGNORECASE),
+    re.compile(r'^\s*_{10,}\s*$'),
+    re.compile(r'^\s*From:\s.+$'),
+]
+
+# "-- " is the conventional signature delimiter; mobile footers act the same
+SIGNATURE_PATTERNS = [
+    re.compile(r'^--\s*$'),
+    re.compile(r'^\s*Sent from my \w+', re.IGNORECASE),
+    re.compile(r'^\s*Get Outlook for \w+', re.IGNORECASE),
+]
+
+def parse_date_header(date: str) -> Tuple[Optional[int], Optional[int]]:
+    """Epoch seconds and UTC offset in minutes for an RFC 2822 Date header
+
+    Returns ``(None, None)`` when the header is missing or malformed. A
+    header without a zone (or with ``-0000``) is taken as UTC.
+    """
+    if not date:
+        return None, None
+    try:
+        parsed = parsedate_to_datetime(date)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None, None
+    offset = parsed.utcoffset()
+    if offset is None:
+        return int(parsed.replace(tzinfo=timezone.utc).timestamp()), 0
+    return int(parsed.timestamp()), int(offset.total_seconds() // 60)
+
+def count_tokens(text: str) -> int:
+    """Number of tokens ``text`` costs with the tokenizer LlamaIndex is using"""
+    if not text:
+        return 0
+    return len(get_tokenizer()(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to at most ``max_tokens`` tokens, preferring a line boundary"""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    # Binary search on characters is cheaper than decoding token IDs, and
+    # works with whatever tokenizer is configured
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    line_end = cut.rfind('\n')
+    if line_end > len(cut) // 2:
+        cut = cut[:line_end]
+    return cut.rstrip()
+
+def split_quoted_history(body: str) -> List[str]:
+    """Split a body into the newly written part and the quoted history
+
+    Returns ``[new_text, quoted_text]``; ``quoted_text`` is empty when no
+    reply header or ``>``-quoted block is found.
+    """
+    lines = body.splitlines()
+    for idx, line in enumerate(lines):
+        # A From: line only starts a quoted message after a blank line
+        if REPLY_HEADER_PATTERNS[-1].match(line) and (idx == 0 or lines[idx - 1].strip()):
+            continue
+        if any(pattern.match(line) for pattern in REPLY_HEADER_PATTERNS):
+            return ['\n'.join(lines[:idx]).rstrip(), '\n'.join(lines[idx:])]
+        if line.startswith('>'):
+            # Only treat it as history if the rest of the body is quoted too
+            rest = [l for l in lines[idx:] if l.strip()]
+            if all(l.startswith('>') for l in rest):
+                return ['\n'.join(lines[:idx]).rstrip(), '\n'.join(lines[idx:])]
+    return [body, '']
+
+def strip_quoted_history(body: str) -> str:
+    """Drop quoted earlier messages, keeping what the author actually wrote"""
+    new_text, _ = split_quoted_history(body)
+    # Interleaved quotes inside the reply are not the author's words either
+    return '\n'.join(line for line in new_text.splitlines() if not line.startswith('>')).strip()
+
+def strip_signature(body: str) -> str:
+    """Drop a delimited signature block or mobile footer
+
+    Sign-offs such as "Best,\\nJane" sit above the delimiter and are kept,
+    since they are part of the writing style.
+    """
+    lines = body.splitlines()
+    for idx, line in enumerate(lines):
+        if idx > 0 and any(pattern.match(line) for pattern in SIGNATURE_PATTERNS):
+            return '\n'.join(lines[:idx]).rstrip()
+    return body
+
+def clean_body(body: str) -> str:
+    """Body with quoted history and signature removed"""
+    return strip_signature(strip_quoted_history(body or ''))
@@ -0,0 +1,292 @@
+"""
+Disk-backed embedding cache that sits in front of an embedding model
+Vectors live in a memory-mapped array, their keys and recency in SQLite
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from parse_cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'embeddings')
+DEFAULT_MAX_ENTRIES = 50_000
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share an entry"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+def embedding_key(model_name: str, text: str, kind: str = 'text') -> str:
+    """Cache key for a text; queries and documents may embed differently"""
+    return hashlib.sha256(f"{model_name}\0{kind}\0{normalize_text(text)}".encode()).hexdigest()
+
+class EmbeddingCacheStore:
+    """Fixed-capacity vector store with least-recently-used eviction
+
+    Slots in ``vectors.npy`` are reused in place, so the file never grows
+    past ``max_entries`` vectors. Vectors are stored as float16 by default,
+    half the size of float32 with no measurable effect on cosine ranking.
+
+    Every lookup and write runs inside a ``BEGIN IMMEDIATE`` transaction,
+    so stores in other processes sharing the directory never allocate the
+    same slot or read a vector while it is rewritten. Within a process use
+    shared_store(), which hands every caller the same instance.
+    """
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_DIR,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, dtype: str = 'float16'):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+
+        # Transactions are managed explicitly; waits out other writers
+        self.conn = sqlite3.connect(os.path.join(path, 'index.sqlite3'), check_same_thread=False,
+                                    timeout=30, isolation_level=None)
+        with self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " slot INTEGER NOT NULL UNIQUE,"
+                " last_used INTEGER NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            meta = dict(self.conn.execute("SELECT name, value FROM meta"))
+            if meta and (int(meta['max_entries']) != max_entries or meta['dtype'] != self.dtype.name):
+                # Layout changed, start over rather than misread the file
+                logger.info("Embedding cache layout changed, clearing it")
+                self._reset()
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the database write lock, committing on success"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, 'vectors.npy')
+
+    def _open_vectors(self, dim: int, mode: str):
+        self._vectors = np.lib.format.open_memmap(
+            self._vectors_path(), mode=mode, dtype=self.dtype, shape=(self.max_entries, dim)
+        )
+        self.dim = dim
+
+    def _reset(self):
+        self.conn.execute("DELETE FROM entries")
+        self.conn.execute("DELETE FROM meta")
+        self._vectors = None
+        if os.path.exists(self._vectors_path()):
+            os.remove(self._vectors_path())
+
+    def _attach_vectors(self, dim: Optional[int] = None) -> bool:
+        """Open the vector file, creating it for ``dim`` if no store has yet
+
+        Called inside a transaction, so the file is created only once.
+        """
+        if self._vectors is None:
+            stored = self.conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+            if stored is not None:
+                self._open_vectors(int(stored[0]), mode='r+')
+            elif dim is not None:
+                self._open_vectors(dim, mode='w+')
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                    [('dim', str(dim)), ('max_entries', str(self.max_entries)), ('dtype', self.dtype.name)]
+                )
+            else:
+                return False
+        if dim is not None and dim != self.dim:
+            raise ValueError(f"Embedding dimension {dim} does not match cache ({self.dim})")
+        return True
+
+    def _tick(self) -> int:
+        # One recency clock for every store on the file, not one per instance
+        return self.conn.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM entries").fetchone()[0]
+
+    def _lookup(self, keys: List[str]) -> Dict[str, int]:
+        slots = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            slots.update(self.conn.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch
+            ))
+        return slots
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for the keys present, marking them recently used"""
+        if not keys:
+            return {}
+
+        with self._lock, self._transaction():
+            found = {}
+            if self._attach_vectors():
+                slots = self._lookup(list(dict.fromkeys(keys)))
+                if slots:
+                    clock = self._tick()
+                    self.conn.executemany(
+                        "UPDATE entries SET last_used = ? WHERE key = ?",
+                        [(clock, key) for key in slots]
+                    )
+                found = {key: self._vectors[slot].astype(np.float32).tolist() for key, slot in slots.items()}
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Store vectors, evicting the least recently used entries when full"""
+        if not items:
+            return
+
+        with self._lock, self._transaction():
+            self._attach_vectors(len(next(iter(items.values()))))
+            clock = self._tick()
+
+            keys = list(items)
+            existing = self._lookup(keys)
+            new_keys = [key for key in keys if key not in existing][:self.max_entries - len(existing)]
+
+            # Refresh the entries being overwritten first so they are never
+            # picked for eviction below
+            self.conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(clock, key) for key in existing]
+            )
+
+            # Slots past the highest one in use have never been written
+            next_slot = self.conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM entries").fetchone()[0]
+            free_slots = list(range(next_slot, min(next_slot + len(new_keys), self.max_entries)))
+
+            evict_count = len(new_keys) - len(free_slots)
+            evicted = []
+            if evict_count > 0:
+                evicted = self.conn.execute(
+                    "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (evict_count,)
+                ).fetchall()
+                self.evictions += len(evicted)
+                self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+
+            slots = dict(zip(new_keys, free_slots + [slot for _, slot in evicted]))
+            self.conn.executemany(
+                "INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slot, clock) for key, slot in slots.items()]
+            )
+            slots.update(existing)
+            # Written before the commit, while no other store can read or
+            # reassign these slots
+            for key, slot in slots.items():
+                self._vectors[slot] = np.asarray(items[key], dtype=self.dtype)
+            self._vectors.flush()
+
+    def stats(self) -> Dict:
+        entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+_stores: Dict[str, EmbeddingCacheStore] = {}
+_stores_lock = threading.Lock()
+
+def shared_store(path: str = DEFAULT_EMBEDDING_CACHE_DIR, **kwargs) -> EmbeddingCacheStore:
+    """The process-wide store for ``path``, created on first use"""
+    key = os.path.realpath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingCacheStore(path, **kwargs)
+        return _stores[key]
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model wrapper that serves repeated texts from an EmbeddingCacheStore
+
+    Drop-in replacement for the wrapped model wherever LlamaIndex expects an
+    ``embed_model``; only cache misses reach the underlying API.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingCacheStore = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, store: Optional[EmbeddingCacheStore] = None, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs
+        )
+        self._embed_model = embed_model
+        self._store = store if store is not None else shared_store()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def store(self) -> EmbeddingCacheStore:
+        return self._store
+
+    def _cached(self, texts: List[str], embed_missing, kind: str = 'text') -> List[List[float]]:
+        keys = [embedding_key(self.model_name, text, kind) for text in texts]
+        found = self._store.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = embed_missing(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self._store.put_many(computed)
+            # Return the exact vectors just computed, not their float16 copies
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._cached(
+            [query], lambda texts: [self._embed_model.get_query_embedding(texts[0])], kind='query'
+        )[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        key = embedding_key(self.model_name, query, 'query')
+        found = self._store.get_many([key])
+        if key in found:
+            return found[key]
+        vector = await self._embed_model.aget_query_embedding(query)
+        self._store.put_many({key: vector})
+        return vector
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._cached([text], self._embed_model.get_text_embedding_batch)[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._cached(texts, self._embed_model.get_text_embedding_batch)
@@ -0,0 +1,300 @@
+"""
+Concurrent, rate-limited embedding calls
+Batches texts, keeps several requests in flight and paces them with token
+buckets for requests and tokens per minute, retrying 429s with jittered backoff
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from email_text import count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_CONCURRENCY = 8
+# OpenAI rejects embedding requests with more inputs than this
+MAX_BATCH_SIZE = 2048
+
+EmbedBatch = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+_executors: Dict[Tuple[str, Optional[str]], 'EmbeddingExecutor'] = {}
+_executors_lock = threading.Lock()
+
+class TokenBucket:
+    """Allows ``per_minute`` units per minute, with bursts up to ``capacity``
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        # Ten seconds of budget by default: enough to start several requests
+        # at once without spending the whole minute in the first instant
+        self.capacity = capacity or max(self.rate * 10, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Wait until ``amount`` units are available and take them; returns seconds waited"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # A single request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the server says we are going too fast"""
+        self._refill()
+        self.tokens = 0.0
+
+def is_retryable(error: BaseException) -> bool:
+    """429s, 5xx responses and connection failures are worth retrying"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    try:
+        import openai
+        return isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+    except ImportError:
+        return False
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Delay the server asked for in a Retry-After header, if any"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class EmbeddingExecutor:
+    """Runs embedding requests concurrently within rate limits
+
+    Texts are split into batches of ``batch_size``; up to
+    ``max_concurrency`` batches are in flight at once, each first taking a
+    request from the ``requests_per_minute`` bucket and its token count from
+    the ``tokens_per_minute`` bucket. Retryable failures back off
+    exponentially with full jitter, or as long as Retry-After says. A 429
+    also pauses every other request until then and halves the concurrency,
+    which grows back as requests succeed, so an unconfigured or
+    overestimated limit settles instead of failing batches.
+
+    Requests run on one background event loop owned by the executor, so
+    the limits hold across every thread and loop that calls it; use
+    shared_executor() so every caller in the process uses the same one.
+    """
+
+    def __init__(self, embed_batch: EmbedBatch,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_retries: int = 6,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 token_counter: Callable[[str], int] = count_tokens):
+        self.embed_batch = embed_batch
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.max_concurrency = max(1, max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.token_counter = token_counter
+        self.stats = {'requests': 0, 'texts': 0, 'tokens': 0, 'retries': 0,
+                      'rate_limited': 0, 'throttle_seconds': 0.0}
+
+        self._loop = asyncio.new_event_loop()
+        # Requests allowed in flight; halved on every 429 and grown back
+        # by one per round of successes, up to max_concurrency
+        self.concurrency = float(self.max_concurrency)
+        self._in_flight = 0
+        self._slots = None
+        self._paused_until = 0.0
+        self._thread = threading.Thread(target=self._loop.run_forever, name="embedding-executor", daemon=True)
+        self._thread.start()
+
+    async def _wait_for_pause(self) -> float:
+        waited = 0.0
+        while True:
+            delay = self._paused_until - self._loop.time()
+            if delay <= 0:
+                return waited
+            waited += delay
+            await asyncio.sleep(delay)
+
+    async def _take_slot(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < int(self.concurrency))
+            self._in_flight += 1
+
+    async def _release_slot(self, rate_limited: bool):
+        async with self._slots:
+            self._in_flight -= 1
+            if rate_limited:
+                # Multiplicative decrease: the server limit is below what we send
+                self.concurrency = max(1.0, self.concurrency / 2)
+            else:
+                # Additive increase: one more slot per round of successes
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            self._slots.notify_all()
+
+    async def _embed_one(self, texts: List[str]) -> List[List[float]]:
+        tokens = sum(self.token_counter(text) for text in texts)
+        for attempt in range(self.max_retries + 1):
+            await self._take_slot()
+            rate_limited = False
+            try:
+                self.stats['throttle_seconds'] += await self._wait_for_pause()
+                if self.request_bucket is not None:
+                    self.stats['throttle_seconds'] += await self.request_bucket.acquire(1)
+                if self.token_bucket is not None:
+                    self.stats['throttle_seconds'] += await self.token_bucket.acquire(tokens)
+                vectors = await self.embed_batch(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if getattr(e, 'status_code', None) == 429:
+                    rate_limited = True
+                    self.stats['rate_limited'] += 1
+                    requested = retry_after_seconds(e)
+                    if requested is not None:
+                        # Spread the retries out instead of all firing when the limit resets
+                        delay = requested + random.uniform(0, max(requested, self.base_delay))
+                    # Stop the other in-flight requests from piling on
+                    if self.request_bucket is not None:
+                        self.request_bucket.drain()
+                    self._paused_until = max(self._paused_until, self._loop.time() + (requested or delay))
+                self.stats['retries'] += 1
+                logger.warning(f"Embedding request failed ({str(e)}), retry {attempt + 1} in {delay:.2f}s")
+            else:
+                self.stats['requests'] += 1
+                self.stats['texts'] += len(texts)
+                self.stats['tokens'] += tokens
+                return vectors
+            finally:
+                await self._release_slot(rate_limited)
+            # Back off without holding a slot
+            await asyncio.sleep(delay)
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_one(batch) for batch in batches))
+        return [vector for batch in results for vector in batch]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts from synchronous code; blocks until all batches finish"""
+        if not texts:
+            return []
+        return asyncio.run_coroutine_threadsafe(self._embed(texts), self._loop).result()
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts from any event loop"""
+        if not texts:
+            return []
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._embed(texts), self._loop))
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+def shared_executor(api_key: str, base_url: Optional[str],
+                    factory: Callable[[], EmbeddingExecutor]) -> EmbeddingExecutor:
+    """The process-wide executor for an API key and endpoint, created on first use
+
+    One event loop thread and HTTP client serve every session, and the
+    rate limits and concurrency backoff are shared between them.
+    """
+    key = (api_key, base_url)
+    with _executors_lock:
+        if key not in _executors:
+            _executors[key] = factory()
+        return _executors[key]
+
+def openai_embed_batch(api_key: str, model: str = DEFAULT_EMBEDDING_MODEL,
+                       base_url: Optional[str] = None, timeout: float = 60.0) -> EmbedBatch:
+    """Async batch embedding function backed by the OpenAI API
+
+    ``base_url`` points the client at any OpenAI-compatible server, e.g. a
+    local fake for load tests. The client's own retries are turned off so
+    the executor alone decides when to retry.
+    """
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+
+    async def embed_batch(texts: List[str]) -> List[List[float]]:
+        # Same input normalization as LlamaIndex's OpenAIEmbedding, so
+        # vectors (and embedding cache entries) stay interchangeable
+        response = await client.embeddings.create(input=[text.replace("\n", " ") for text in texts], model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    return embed_batch
+
+class ScheduledEmbedding(BaseEmbedding):
+    """LlamaIndex embedding model that sends every call through an EmbeddingExecutor
+
+    ``embed_batch_size`` is set to a full round of concurrent requests, so
+    each batch LlamaIndex hands over is fanned out in parallel.
+    """
+
+    _executor: EmbeddingExecutor = PrivateAttr()
+
+    def __init__(self, executor: EmbeddingExecutor, model_name: str = DEFAULT_EMBEDDING_MODEL, **kwargs):
+        super().__init__(
+            model_name=model_name,
+            embed_batch_size=min(executor.batch_size * executor.max_concurrency, MAX_BATCH_SIZE * 4),
+            **kwargs
+        )
+        self._executor = executor
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledEmbedding"
+
+    @property
+    def executor(self) -> EmbeddingExecutor:
+        return self._executor
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._executor.embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._executor.aembed([query]))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._executor.embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._executor.embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._executor.aembed(texts)
@@ -0,0 +1,150 @@
+"""
+Hybrid retrieval: BM25 over email text fused with vector search
+Exact identifiers (ticket numbers, product codes) are found by the keyword
+side, paraphrases by the vector side; either one alone still works
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from email_chunker import EmailNodeParser, parent_id
+from local_vector_store import matches_filters
+from retrieval_filters import filter_metadata
+from search_index import FullTextIndex, keyword_terms
+from vector_manager import configured_document_template, configured_node_parser, email_document
+
+logger = logging.getLogger(__name__)
+
+# Reciprocal-rank fusion constant; larger values flatten the rank curve
+RRF_K = 60
+DEFAULT_LEXICAL_TOP_K = 20
+
+# Shared so concurrent requests do not each start their own threads
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-retrieval")
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[str]], weights: Optional[Dict[str, float]] = None,
+                           k: int = RRF_K) -> Dict[str, float]:
+    """Fused score per key: the sum over rankings of ``weight / (k + rank)``"""
+    scores = {}
+    for name, keys in rankings.items():
+        weight = (weights or {}).get(name, 1.0)
+        for rank, key in enumerate(keys, 1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return scores
+
+class HybridRetriever(BaseRetriever):
+    """Fuses a vector retriever with a FullTextIndex by reciprocal rank
+
+    Both searches run at once. Emails are ranked by the fusion of their
+    best vector chunk and their keyword rank, and the top ``top_k`` are
+    returned with every chunk retrieved for them, ready for merge_chunks().
+    An email only the keyword side found is chunked with ``node_parser``
+    from its ``document_template`` document (by default the configured
+    ones, as at ingestion), and its chunk matching the most query terms
+    stands in for it. Without a ``vector_retriever``, or if it fails,
+    results come from the keyword side alone, which costs no embedding
+    calls. ``last_timings`` holds each stage's latency in milliseconds for
+    the latest query.
+    """
+
+    def __init__(self, text_index: FullTextIndex, parsed_emails,
+                 vector_retriever: Optional[BaseRetriever] = None,
+                 top_k: int = 10, lexical_top_k: int = DEFAULT_LEXICAL_TOP_K,
+                 filters: Optional[MetadataFilters] = None,
+                 weights: Optional[Dict[str, float]] = None, rrf_k: int = RRF_K,
+                 node_parser: Optional[EmailNodeParser] = None,
+                 document_template: Optional[str] = None):
+        super().__init__()
+        self.text_index = text_index
+        self.parsed_emails = parsed_emails
+        self.vector_retriever = vector_retriever
+        self.top_k = top_k
+        self.lexical_top_k = lexical_top_k
+        self.filters = filters
+        self.weights = weights
+        self.rrf_k = rrf_k
+        self.node_parser = node_parser or configured_node_parser()
+        self.document_template = document_template or configured_document_template()
+        self.last_timings = {}
+
+    def _timed(self, name: str, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.last_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _lexical(self, text: str) -> List[NodeWithScore]:
+        hits = []
+        # Over-fetch when filtering, since filters apply after ranking here
+        limit = self.lexical_top_k * (4 if self.filters is not None else 1)
+        for position, score in self.text_index.rank(text, limit=limit):
+            email = self.parsed_emails[position]
+            if self.filters is not None and not matches_filters(filter_metadata(email), self.filters):
+                continue
+            hits.append((email_document(email, self.document_template), score))
+            if len(hits) == self.lexical_top_k:
+                break
+        if not hits:
+            return []
+
+        # Chunked as at ingestion, so a long thread stays within the budget
+        chunks = {}
+        for chunk in self.node_parser.get_nodes_from_documents([document for document, _ in hits]):
+            chunks.setdefault(parent_id(chunk), []).append(chunk)
+        terms = keyword_terms(text)
+        nodes = []
+        for document, score in hits:
+            candidates = chunks.get(document.doc_id) or [document]
+            best = max(candidates, key=lambda chunk: sum(term in chunk.get_content().lower() for term in terms))
+            nodes.append(NodeWithScore(node=best, score=score))
+        return nodes
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        self.last_timings = {}
+        started = time.perf_counter()
+        # The embedding strings are the email itself, without prompt boilerplate
+        text = ' '.join(query_bundle.embedding_strs)
+        lexical = _executor.submit(self._timed, 'lexical', self._lexical, text)
+        vector = None
+        if self.vector_retriever is not None:
+            vector = _executor.submit(self._timed, 'vector', self.vector_retriever.retrieve, query_bundle)
+
+        lexical_nodes = lexical.result()
+        vector_nodes = []
+        if vector is not None:
+            try:
+                vector_nodes = vector.result()
+            except Exception as e:
+                logger.warning(f"Vector retrieval failed, using keyword results only: {str(e)}")
+
+        fusion_started = time.perf_counter()
+        # Emails are ranked by their best chunk on each side; every vector
+        # chunk is kept, the keyword chunk only when no vector chunk came back
+        chunks = {}
+        rankings = {'vector': [], 'lexical': []}
+        for name, nodes in (('vector', vector_nodes), ('lexical', lexical_nodes)):
+            seen = set()
+            for node in nodes:
+                doc_id = parent_id(node.node)
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    rankings[name].append(doc_id)
+                if name == 'vector' or doc_id not in chunks:
+                    chunks.setdefault(doc_id, []).append(node.node)
+        scores = reciprocal_rank_fusion(rankings, self.weights, self.rrf_k)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.top_k]
+        fused = [NodeWithScore(node=chunk, score=scores[doc_id]) for doc_id in ranked for chunk in chunks[doc_id]]
+
+        self.last_timings['fusion'] = round((time.perf_counter() - fusion_started) * 1000, 1)
+        self.last_timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(
+            f"Hybrid retrieval: {len(vector_nodes)} vector + {len(lexical_nodes)} keyword hits "
+            f"-> {len(ranked)} emails in {len(fused)} chunks, timings {self.last_timings}"
+        )
+        return fused
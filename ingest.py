@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Headless ingestion: parse emails from directories, ZIPs or mbox files and
+index them into the configured vector store, without a browser session
+
+    python ingest.py ~/mail/archive.zip ~/mail/inbox.mbox --backend local
+
+Secrets (OPENAI_API_KEY, PINECONE_API_KEY, VECTOR_BACKEND, ...) are read
+from the environment first, then from .streamlit/secrets.toml.
+"""
+import argparse
+import logging
+import sys
+import time
+from typing import Dict, List, Optional
+
+from email_processor_simple import EmailProcessor
+from email_sources import close_email_files, collect_email_files
+from parse_cache import ParseCache
+from pipeline import DEFAULT_BATCH_SIZE, DEFAULT_STAGE_WORKERS, run_ingestion_pipeline
+from progress import ConsoleReporter
+
+logger = logging.getLogger(__name__)
+
+def format_throughput(count: int, seconds: float, unit: str, nbytes: Optional[int] = None) -> str:
+    seconds = max(seconds, 1e-9)
+    line = f"{count} {unit} in {seconds:.1f}s ({count / seconds:.1f} {unit}/s"
+    if nbytes is not None:
+        line += f", {nbytes / seconds / 1e6:.2f} MB/s"
+    return line + ")"
+
+def report_parse_cache(reporter: ConsoleReporter, parse_cache: Optional[ParseCache]):
+    if parse_cache is not None:
+        reporter.info(f"Parse cache: {parse_cache.hits} hits, {parse_cache.misses} misses")
+
+def report_embedding_tokens(reporter: ConsoleReporter, report: Dict[str, Dict], current: str):
+    baseline = report['legacy']['tokens']
+    for template, counts in report.items():
+        saved = baseline - counts['tokens']
+        reporter.info(
+            f"  {template:<8}{' (configured)' if template == current else '':<13} "
+            f"{counts['tokens']} tokens in {counts['chunks']} chunks, "
+            f"{saved} saved vs legacy ({saved / max(baseline, 1):.0%}), "
+            f"{counts['tokens'] / max(counts['documents'], 1):.0f} per email"
+        )
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Ingest emails into the vector store")
+    parser.add_argument('paths', nargs='+', help="directories of .eml files, .eml, .zip or mbox files")
+    parser.add_argument('--backend', choices=['pinecone', 'local'], default=None,
+                        help="vector backend (default: VECTOR_BACKEND secret, else pinecone)")
+    parser.add_argument('--full', action='store_true',
+                        help="re-embed every email instead of only new or changed ones")
+    parser.add_argument('--parse-only', action='store_true', help="parse and report, skip indexing")
+    parser.add_argument('--token-report', action='store_true',
+                        help="parse, then compare embedding tokens per document template, skip indexing")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="parser processes (default: one per CPU for large inputs)")
+    parser.add_argument('--serial', action='store_true', help="parse in this process only")
+    parser.add_argument('--no-parse-cache', action='store_true', help="parse every file even if seen before")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="emails per pipeline batch")
+    for stage, count in DEFAULT_STAGE_WORKERS.items():
+        parser.add_argument(f'--{stage}-workers', type=int, default=count,
+                            help=f"threads for the {stage} stage (default: {count})")
+    parser.add_argument('-v', '--verbose', action='store_true', help="debug logging")
+    return parser
+
+def ingest_files(args, files: List, reporter: ConsoleReporter) -> int:
+    """Parse, or parse and index, the collected email handles; returns the exit code"""
+    parse_cache = None
+    if not args.no_parse_cache:
+        try:
+            parse_cache = ParseCache()
+        except Exception as e:
+            logger.warning(f"Parse cache unavailable, parsing every file: {str(e)}")
+
+    processor = EmailProcessor(parse_cache=parse_cache, reporter=reporter)
+    sizes = [getattr(handle, 'size', None) for handle in files]
+    nbytes = sum(sizes) if None not in sizes else None
+
+    if args.parse_only or args.token_report:
+        parallel = False if args.serial else (True if args.workers else None)
+        started = time.perf_counter()
+        parsed_emails = processor.parse_eml_files(files, parallel=parallel, max_workers=args.workers)
+        parse_seconds = time.perf_counter() - started
+        reporter.info("Parsed " + format_throughput(len(parsed_emails), parse_seconds, 'emails', nbytes))
+        if reporter.warnings:
+            reporter.info(f"{reporter.warnings} emails could not be parsed cleanly")
+        report_parse_cache(reporter, parse_cache)
+        if args.token_report:
+            from vector_manager import VectorManager
+            vector_manager = VectorManager(backend=args.backend, reporter=reporter)
+            reporter.info("Embedding tokens by document template:")
+            report_embedding_tokens(reporter, vector_manager.embedding_token_report(parsed_emails),
+                                    vector_manager.document_template)
+        return 0
+
+    from vector_manager import VectorManager
+    vector_manager = VectorManager(backend=args.backend, reporter=reporter)
+    started = time.perf_counter()
+    summary = run_ingestion_pipeline(
+        files, processor, vector_manager,
+        incremental=not args.full,
+        batch_size=args.batch_size,
+        workers={stage: getattr(args, f'{stage}_workers') for stage in DEFAULT_STAGE_WORKERS},
+        parse_workers=1 if args.serial else args.workers,
+        reporter=reporter
+    )
+    seconds = time.perf_counter() - started
+    if summary is None:
+        return 1
+
+    for stats in summary['stages']:
+        reporter.info(
+            f"  {stats['stage']:<7} x{stats['workers']}: {stats['items']} items, "
+            f"{stats['items_per_second']}/s, utilization {stats['utilization']:.0%}"
+        )
+    reporter.info(
+        f"{summary['emails']} emails: {summary['skipped']} already indexed, "
+        f"{summary['duplicates']} duplicates, {summary['parse_errors']} parse errors, "
+        f"{summary['stale_chunks']} stale chunks removed"
+    )
+    report_parse_cache(reporter, parse_cache)
+    reporter.info("Total " + format_throughput(summary['emails'], seconds, 'emails', nbytes))
+    return 0 if not reporter.errors else 1
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    reporter = ConsoleReporter()
+
+    try:
+        files = collect_email_files(args.paths)
+    except (OSError, ValueError) as e:
+        reporter.error(str(e))
+        return 2
+    if not files:
+        reporter.error("No emails found")
+        return 2
+    reporter.info(f"Found {len(files)} emails in {len(args.paths)} source(s)")
+
+    try:
+        return ingest_files(args, files, reporter)
+    finally:
+        close_email_files(files)
+
+if __name__ == "__main__":
+    sys.exit(main())
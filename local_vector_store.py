@@ -0,0 +1,451 @@
+"""
+In-process vector index persisted to disk, an offline alternative to Pinecone
+Exact brute-force search for small corpora, IVF (inverted file) search for large ones
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+from parse_cache import DEFAULT_CACHE_DIR
+from retrieval_filters import DATE_TS_KEY, SENDER_DOMAIN_KEY, SENDER_EMAIL_KEY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_INDEX_DIR = os.path.join(DEFAULT_CACHE_DIR, 'vector_index')
+
+# Above this many vectors 'auto' switches from exact search to IVF
+IVF_THRESHOLD = 20_000
+
+# Filter fields also kept as NumPy columns, so filtering is a row mask
+# rather than a Python pass over every record. Strings are stored as codes
+# into a per-column vocabulary, numbers as float64
+STRING_COLUMNS = (SENDER_EMAIL_KEY, SENDER_DOMAIN_KEY)
+NUMBER_COLUMNS = (DATE_TS_KEY,)
+COLUMN_DTYPES = {
+    **{key: np.int32 for key in STRING_COLUMNS},
+    **{key: np.float64 for key in NUMBER_COLUMNS},
+}
+MISSING_CODE = -1
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def train_ivf(vectors: np.ndarray, n_lists: int, iterations: int = 10,
+              seed: int = 0) -> np.ndarray:
+    """Spherical k-means over normalized vectors, returning the centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(vectors, centroids)
+        for list_no in range(n_lists):
+            members = vectors[assignments == list_no]
+            if len(members):
+                centroids[list_no] = members.sum(axis=0)
+            else:
+                # Re-seed empty lists so every list stays useful
+                centroids[list_no] = vectors[rng.integers(len(vectors))]
+        centroids = _normalize(centroids)
+    return centroids
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    """Nearest centroid for each vector, computed in batches to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        assignments[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+_FILTER_OPERATORS = {
+    FilterOperator.EQ: lambda value, target: value == target,
+    FilterOperator.NE: lambda value, target: value != target,
+    FilterOperator.GT: lambda value, target: value > target,
+    FilterOperator.GTE: lambda value, target: value >= target,
+    FilterOperator.LT: lambda value, target: value < target,
+    FilterOperator.LTE: lambda value, target: value <= target,
+    FilterOperator.IN: lambda value, target: value in target,
+    FilterOperator.NIN: lambda value, target: value not in target,
+    FilterOperator.TEXT_MATCH: lambda value, target: str(target) in str(value),
+}
+
+_COMPARISONS = {
+    FilterOperator.EQ: np.equal,
+    FilterOperator.NE: np.not_equal,
+    FilterOperator.GT: np.greater,
+    FilterOperator.GTE: np.greater_equal,
+    FilterOperator.LT: np.less,
+    FilterOperator.LTE: np.less_equal,
+}
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def matches_filters(metadata: Dict, filters: MetadataFilters) -> bool:
+    """Whether a stored record passes ``filters``
+
+    A record without the filtered key does not match, not even ``!=``.
+    """
+    results = []
+    for metadata_filter in filters.filters:
+        value = metadata.get(metadata_filter.key)
+        if value is None:
+            results.append(False)
+            continue
+        compare = _FILTER_OPERATORS[getattr(metadata_filter, 'operator', FilterOperator.EQ)]
+        try:
+            results.append(compare(value, metadata_filter.value))
+        except TypeError:
+            # e.g. a string compared with a number
+            results.append(False)
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """Vector store kept in memory as a NumPy matrix and persisted to a directory
+
+    Vectors are L2-normalized on insert so cosine similarity is a single
+    matrix-vector product. With ``index_type='ivf'`` (or ``'auto'`` above
+    IVF_THRESHOLD vectors) a coarse k-means quantizer restricts each query to
+    the ``n_probe`` closest lists. The matrix is a view of a buffer that
+    doubles when full, so adding is amortized constant time per vector.
+    Node IDs are unique: adding a node whose ID is already stored replaces
+    it. Filters on STRING_COLUMNS and NUMBER_COLUMNS are evaluated over
+    NumPy columns kept alongside the matrix; other filters, and columns that
+    ever held a value of another type, fall back to matches_filters.
+    Changes stay in memory until ``persist``.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    persist_dir: Optional[str] = None
+    index_type: str = 'auto'
+    n_probe: int = 8
+
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _rows: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _records: List[Dict] = PrivateAttr(default_factory=list)
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+    _buffer: Optional[np.ndarray] = PrivateAttr(default=None)
+    _columns: Dict[str, np.ndarray] = PrivateAttr(default_factory=dict)
+    _vocabularies: Dict[str, Dict[str, int]] = PrivateAttr(
+        default_factory=lambda: {key: {} for key in STRING_COLUMNS}
+    )
+    _mixed_columns: Set[str] = PrivateAttr(default_factory=set)
+    _centroids: Optional[np.ndarray] = PrivateAttr(default=None)
+    _assignments: Optional[np.ndarray] = PrivateAttr(default=None)
+    _list_order: Optional[np.ndarray] = PrivateAttr(default=None)
+    _list_bounds: Optional[np.ndarray] = PrivateAttr(default=None)
+    _trained_size: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str = DEFAULT_LOCAL_INDEX_DIR, **kwargs: Any) -> "LocalVectorStore":
+        """Load a store saved with ``persist``, or start an empty one there"""
+        store = cls(persist_dir=persist_dir, **kwargs)
+        records_path = os.path.join(persist_dir, 'records.json')
+        if not os.path.exists(records_path):
+            return store
+
+        with open(records_path) as f:
+            saved = json.load(f)
+        store._ids = saved['ids']
+        store._records = saved['records']
+        store._rows = {node_id: row for row, node_id in enumerate(store._ids)}
+        if store._ids:
+            store._buffer = np.load(os.path.join(persist_dir, 'vectors.npy'))
+            store._vectors = store._buffer
+            store._columns = store._encode_columns(store._records)
+
+        centroids_path = os.path.join(persist_dir, 'centroids.npy')
+        if os.path.exists(centroids_path):
+            store._centroids = np.load(centroids_path)
+            store._assignments = np.load(os.path.join(persist_dir, 'assignments.npy'))
+            store._trained_size = saved.get('trained_size', len(store._ids))
+            store._build_lists()
+        logger.info(f"Loaded local vector index with {len(store._ids)} vectors from {persist_dir}")
+        return store
+
+    @property
+    def client(self) -> None:
+        return None
+
+    def count(self) -> int:
+        # Deliberately not __len__: LlamaIndex treats an empty store as falsy
+        # and silently swaps in its own in-memory one
+        return len(self._ids)
+
+    def _use_ivf(self) -> bool:
+        if self.index_type == 'ivf':
+            return len(self._ids) > 0
+        if self.index_type == 'auto':
+            return len(self._ids) >= IVF_THRESHOLD
+        return False
+
+    def _refresh_ivf(self):
+        """Train the quantizer when needed, otherwise just assign new rows"""
+        if not self._use_ivf():
+            self._centroids = None
+            self._assignments = None
+            self._list_order = None
+            self._list_bounds = None
+            return
+
+        size = len(self._ids)
+        # Retrain once the corpus has doubled since the last training run
+        if self._centroids is None or size >= 2 * self._trained_size:
+            n_lists = max(1, min(int(np.sqrt(size)), size))
+            self._centroids = train_ivf(self._vectors, n_lists)
+            self._assignments = assign_lists(self._vectors, self._centroids)
+            self._trained_size = size
+            logger.info(f"Trained IVF index with {n_lists} lists over {size} vectors")
+        elif len(self._assignments) < size:
+            new_rows = self._vectors[len(self._assignments):]
+            self._assignments = np.concatenate([self._assignments, assign_lists(new_rows, self._centroids)])
+        self._build_lists()
+
+    def _build_lists(self):
+        """Group row numbers by list so a probe is a slice, not a scan"""
+        self._list_order = np.argsort(self._assignments, kind='stable')
+        self._list_bounds = np.searchsorted(
+            self._assignments[self._list_order], np.arange(len(self._centroids) + 1)
+        )
+
+    def _column_value(self, key: str, record: Dict) -> Any:
+        value = record.get(key)
+        if key in STRING_COLUMNS and isinstance(value, str):
+            vocabulary = self._vocabularies[key]
+            return vocabulary.setdefault(value, len(vocabulary))
+        if key in NUMBER_COLUMNS and _is_number(value):
+            return float(value)
+        if value is not None:
+            # The column cannot compare it like matches_filters would
+            self._mixed_columns.add(key)
+        return MISSING_CODE if key in STRING_COLUMNS else np.nan
+
+    def _encode_columns(self, records: List[Dict]) -> Dict[str, np.ndarray]:
+        return {
+            key: np.array([self._column_value(key, record) for record in records], dtype=dtype)
+            for key, dtype in COLUMN_DTYPES.items()
+        }
+
+    def _append_rows(self, vectors: np.ndarray, records: List[Dict]):
+        """Write rows after the last one, doubling the buffers when they are full"""
+        size = 0 if self._vectors is None else len(self._vectors)
+        needed = size + len(vectors)
+        if self._buffer is None or needed > len(self._buffer):
+            capacity = max(needed, 2 * (0 if self._buffer is None else len(self._buffer)))
+            buffer = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            if size:
+                buffer[:size] = self._vectors
+            self._buffer = buffer
+            for key, dtype in COLUMN_DTYPES.items():
+                column = np.empty(capacity, dtype=dtype)
+                if size:
+                    column[:size] = self._columns[key][:size]
+                self._columns[key] = column
+        self._buffer[size:needed] = vectors
+        self._vectors = self._buffer[:needed]
+        for key, values in self._encode_columns(records).items():
+            self._columns[key][size:needed] = values
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        new_vectors = []
+        new_records = []
+        replaced = []
+        # An ID repeated within the call is stored once, from its last node
+        for node in {node.node_id: node for node in nodes}.values():
+            vector = np.asarray(node.get_embedding(), dtype=np.float32)
+            record = node_to_metadata_dict(node, remove_text=False, flat_metadata=self.flat_metadata)
+            row = self._rows.get(node.node_id)
+            if row is not None:
+                self._vectors[row] = _normalize(vector)
+                self._records[row] = record
+                for key in self._columns:
+                    self._columns[key][row] = self._column_value(key, record)
+                replaced.append(row)
+                continue
+
+            self._rows[node.node_id] = len(self._ids)
+            self._ids.append(node.node_id)
+            self._records.append(record)
+            new_vectors.append(vector)
+            new_records.append(record)
+
+        if new_vectors:
+            self._append_rows(_normalize(np.vstack(new_vectors)), new_records)
+        if replaced and self._assignments is not None:
+            # Lists are rebuilt once, by _refresh_ivf
+            self._assignments[replaced] = assign_lists(self._vectors[replaced], self._centroids)
+        self._refresh_ivf()
+        return [node.node_id for node in nodes]
+
+    def delete_nodes(self, node_ids: List[str]):
+        """Delete vectors by node ID"""
+        doomed = {self._rows[node_id] for node_id in node_ids if node_id in self._rows}
+        if not doomed:
+            return
+        keep = np.array([row not in doomed for row in range(len(self._ids))], dtype=bool)
+        self._ids = [node_id for node_id, kept in zip(self._ids, keep) if kept]
+        self._records = [record for record, kept in zip(self._records, keep) if kept]
+        self._rows = {node_id: row for row, node_id in enumerate(self._ids)}
+        # Compacted in place, keeping the buffer's capacity
+        kept = self._vectors[keep]
+        self._buffer[:len(kept)] = kept
+        self._vectors = self._buffer[:len(kept)]
+        for column in self._columns.values():
+            column[:len(kept)] = column[:len(keep)][keep]
+        if self._assignments is not None:
+            self._assignments = self._assignments[keep]
+        self._refresh_ivf()
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self.delete_nodes([
+            node_id for node_id, record in zip(self._ids, self._records)
+            if record.get('ref_doc_id') == ref_doc_id
+        ])
+
+    def get_metadata(self, node_ids: List[str]) -> Dict[str, Dict]:
+        """Stored metadata for the given node IDs that exist"""
+        return {node_id: self._records[self._rows[node_id]] for node_id in node_ids if node_id in self._rows}
+
+    def list_ids(self, prefix: Optional[str] = None, page_size: int = 1000) -> Iterator[List[str]]:
+        """Yield stored node IDs in pages, mirroring Pinecone's ``list``"""
+        ids = [node_id for node_id in self._ids if prefix is None or node_id.startswith(prefix)]
+        for start in range(0, len(ids), page_size):
+            yield ids[start:start + page_size]
+
+    def _column_mask(self, metadata_filter) -> Optional[np.ndarray]:
+        """Rows passing one filter, or None when the columns cannot answer it"""
+        if metadata_filter.key not in self._columns or metadata_filter.key in self._mixed_columns:
+            return None
+        column = self._columns[metadata_filter.key][:len(self._ids)]
+        operator = getattr(metadata_filter, 'operator', FilterOperator.EQ)
+        target = metadata_filter.value
+
+        if metadata_filter.key in STRING_COLUMNS:
+            present = column != MISSING_CODE
+            vocabulary = self._vocabularies[metadata_filter.key]
+            if operator not in (FilterOperator.EQ, FilterOperator.NE) or not isinstance(target, str):
+                return None
+            # A value never stored has no code, so it matches nothing
+            equal = column == vocabulary.get(target, MISSING_CODE - 1)
+            return equal if operator == FilterOperator.EQ else present & ~equal
+
+        if operator not in _COMPARISONS or not _is_number(target):
+            return None
+        # Missing values are NaN, which != would otherwise let through
+        return _COMPARISONS[operator](column, target) & ~np.isnan(column)
+
+    def _filter_mask(self, filters: MetadataFilters) -> Optional[np.ndarray]:
+        """Rows passing ``filters``, or None if any filter needs the records"""
+        masks = []
+        for metadata_filter in filters.filters:
+            mask = self._column_mask(metadata_filter)
+            if mask is None:
+                return None
+            masks.append(mask)
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def _candidate_rows(self, query_vector: np.ndarray) -> Optional[np.ndarray]:
+        """Rows to score, or None to score everything"""
+        if self._centroids is None:
+            return None
+        n_probe = min(self.n_probe, len(self._centroids))
+        probes = np.argpartition(-(self._centroids @ query_vector), n_probe - 1)[:n_probe]
+        return np.sort(np.concatenate([
+            self._list_order[self._list_bounds[probe]:self._list_bounds[probe + 1]] for probe in probes
+        ]))
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if self._vectors is None or not len(self._ids) or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        query_vector = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+
+        # Rows the query may return, None for all of them
+        restricted = None
+        if query.node_ids or query.doc_ids:
+            allowed_nodes = set(query.node_ids or [])
+            allowed_docs = set(query.doc_ids or [])
+            restricted = np.array([
+                row for row, node_id in enumerate(self._ids)
+                if node_id in allowed_nodes or self._records[row].get('ref_doc_id') in allowed_docs
+            ], dtype=np.int64)
+        if query.filters is not None and query.filters.filters:
+            mask = self._filter_mask(query.filters)
+            if mask is not None:
+                matching = np.flatnonzero(mask)
+            else:
+                matching = np.array([
+                    row for row, record in enumerate(self._records) if matches_filters(record, query.filters)
+                ], dtype=np.int64)
+            restricted = matching if restricted is None else np.intersect1d(restricted, matching)
+
+        # A small restricted set is scored exactly: probing only the nearest
+        # lists could leave fewer than top_k of its rows
+        rows = restricted
+        if restricted is None or len(restricted) >= IVF_THRESHOLD:
+            probed = self._candidate_rows(query_vector)
+            if probed is not None:
+                rows = probed if restricted is None else np.intersect1d(probed, restricted)
+
+        candidates = self._vectors if rows is None else self._vectors[rows]
+        if not len(candidates):
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        scores = candidates @ query_vector
+        top_k = min(query.similarity_top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+
+        nodes, similarities, ids = [], [], []
+        for position in top:
+            row = int(position if rows is None else rows[position])
+            node = metadata_dict_to_node(self._records[row])
+            node.embedding = self._vectors[row].tolist()
+            nodes.append(node)
+            similarities.append(float(scores[position]))
+            ids.append(self._ids[row])
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        persist_dir = persist_path or self.persist_dir
+        if not persist_dir:
+            return
+        os.makedirs(persist_dir, exist_ok=True)
+
+        vectors = self._vectors if self._vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(persist_dir, 'vectors.npy'), vectors)
+
+        centroids_path = os.path.join(persist_dir, 'centroids.npy')
+        if self._centroids is not None:
+            np.save(centroids_path, self._centroids)
+            np.save(os.path.join(persist_dir, 'assignments.npy'), self._assignments)
+        elif os.path.exists(centroids_path):
+            os.remove(centroids_path)
+
+        records_path = os.path.join(persist_dir, 'records.json')
+        with open(records_path + '.tmp', 'w') as f:
+            json.dump({'ids': self._ids, 'records': self._records, 'trained_size': self._trained_size}, f)
+        os.replace(records_path + '.tmp', records_path)
+        logger.debug(f"Persisted {len(self._ids)} vectors to {persist_dir}")
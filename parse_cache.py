@@ -0,0 +1,88 @@
+"""
+Persistent cache of parsed emails keyed by a hash of the raw message bytes
+Lets repeated or overlapping uploads skip MIME parsing for messages seen before
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the structure of the parsed email dict changes so stale
+# entries are ignored instead of served
+PARSE_CACHE_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.environ.get('EMAILOGAN_CACHE_DIR', '.cache')
+DEFAULT_PARSE_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIR, 'parse_cache.sqlite3')
+
+class ParseCache:
+    """SQLite-backed map of raw-bytes hash -> parsed email dict"""
+
+    def __init__(self, path: str = DEFAULT_PARSE_CACHE_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS parsed_emails ("
+            " key TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(raw_email: bytes) -> str:
+        """Content address for a raw message"""
+        return hashlib.sha256(raw_email).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        """Look up several keys at once, returning only the ones cached"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, data FROM parsed_emails WHERE version = ? AND key IN ({placeholders})",
+                [PARSE_CACHE_VERSION, *batch]
+            )
+            for key, data in rows:
+                found[key] = json.loads(data)
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Iterable[Tuple[str, Dict]]):
+        """Store parsed emails, replacing any older entry for the same key"""
+        rows = [(key, PARSE_CACHE_VERSION, json.dumps(data)) for key, data in items]
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO parsed_emails (key, version, data) VALUES (?, ?, ?)",
+                rows
+            )
+        logger.debug(f"Cached {len(rows)} parsed emails in {self.path}")
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM parsed_emails")
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM parsed_emails WHERE version = ?", (PARSE_CACHE_VERSION,)
+        ).fetchone()[0]
@@ -0,0 +1,176 @@
+"""
+Bulk Pinecone upserts and per-process index handles
+Vectors are packed into batches capped by count and request size and sent
+in parallel over the client's pooled keep-alive connections
+"""
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from llama_index.vector_stores.pinecone import PineconeVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Pinecone rejects upsert requests over 2MB or 1000 vectors
+MAX_REQUEST_BYTES = 2 * 1024 * 1024
+MAX_BATCH_VECTORS = 1000
+# Headroom for the request envelope and the client's JSON spacing
+DEFAULT_BATCH_BYTES = int(MAX_REQUEST_BYTES * 0.85)
+# Upper bound for one float32 value in JSON, e.g. "-0.012345678901234567, "
+FLOAT_JSON_BYTES = 25
+DEFAULT_UPSERT_WORKERS = 4
+
+_clients: Dict[str, Any] = {}
+_indexes: Dict[tuple, Any] = {}
+_cache_lock = threading.Lock()
+
+def cached_client(api_key: str, factory: Callable[[], Any]):
+    """The process-wide Pinecone client for ``api_key``, created on first use"""
+    with _cache_lock:
+        if api_key not in _clients:
+            _clients[api_key] = factory()
+        return _clients[api_key]
+
+def cached_index(api_key: str, index_name: str, factory: Callable[[], Any]):
+    """The process-wide index handle, so only the first connection pays for
+    the control-plane lookups and every later one reuses its connection pool
+    """
+    key = (api_key, index_name)
+    with _cache_lock:
+        index = _indexes.get(key)
+    if index is None:
+        # Outside the lock: creating an index can take a while
+        index = factory()
+        if index is None:
+            return None
+        with _cache_lock:
+            index = _indexes.setdefault(key, index)
+    return index
+
+def entry_size(entry: Dict) -> int:
+    """Upper bound on the bytes ``entry`` adds to an upsert request body
+
+    Values are costed per float rather than serialized, which would take
+    as long as the request itself.
+    """
+    return (len(json.dumps({'id': entry['id'], 'metadata': entry.get('metadata') or {}}))
+            + FLOAT_JSON_BYTES * len(entry['values']) + 16)
+
+def pack_batches(entries: Iterable[Dict], max_vectors: int = MAX_BATCH_VECTORS,
+                 max_bytes: int = DEFAULT_BATCH_BYTES) -> Iterator[List[Dict]]:
+    """Group entries into batches within both the vector and byte caps
+
+    An entry too large for any batch is sent alone and left for Pinecone
+    to reject, so the error names the vector.
+    """
+    batch, size = [], 0
+    for entry in entries:
+        nbytes = entry_size(entry)
+        if batch and (len(batch) >= max_vectors or size + nbytes > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += nbytes
+    if batch:
+        yield batch
+
+class BulkUpsertWriter:
+    """Upserts entries to a Pinecone index with up to ``workers`` requests in flight
+
+    Uses the client's own thread pool (``async_req``), so the index must be
+    opened with ``pool_threads >= workers``; requests share its urllib3
+    connection pool and keep-alive connections.
+    """
+
+    def __init__(self, pinecone_index, namespace: Optional[str] = None,
+                 workers: int = DEFAULT_UPSERT_WORKERS,
+                 max_vectors: int = MAX_BATCH_VECTORS,
+                 max_bytes: int = DEFAULT_BATCH_BYTES):
+        self.pinecone_index = pinecone_index
+        self.namespace = namespace
+        self.workers = max(1, workers)
+        self.max_vectors = min(max_vectors, MAX_BATCH_VECTORS)
+        self.max_bytes = min(max_bytes, MAX_REQUEST_BYTES)
+        self.requests = 0
+        self.upserted = 0
+        self._lock = threading.Lock()
+
+    def _send(self, batch: List[Dict]):
+        kwargs = {'namespace': self.namespace} if self.namespace else {}
+        return self.pinecone_index.upsert(vectors=batch, async_req=True, _check_type=False, **kwargs)
+
+    def write(self, entries: Iterable[Dict]) -> int:
+        """Upsert every entry and return how many Pinecone acknowledged
+
+        At most ``workers`` batches are pending at a time; the first failed
+        request is re-raised once the others in flight have settled.
+        """
+        pending = deque()
+        upserted = 0
+        requests = 0
+        error = None
+
+        def settle():
+            nonlocal upserted, error
+            try:
+                upserted += pending.popleft().get().upserted_count
+            except Exception as e:
+                error = error or e
+
+        for batch in pack_batches(entries, self.max_vectors, self.max_bytes):
+            if error is not None:
+                break
+            if len(pending) >= self.workers:
+                settle()
+            pending.append(self._send(batch))
+            requests += 1
+        while pending:
+            settle()
+
+        with self._lock:
+            self.requests += requests
+            self.upserted += upserted
+        logger.debug(f"Upserted {upserted} vectors in {requests} requests")
+        if error is not None:
+            raise error
+        return upserted
+
+class BulkPineconeVectorStore(PineconeVectorStore):
+    """PineconeVectorStore whose ``add`` goes through a BulkUpsertWriter"""
+
+    _writer: BulkUpsertWriter = PrivateAttr()
+
+    def __init__(self, pinecone_index, workers: int = DEFAULT_UPSERT_WORKERS,
+                 max_vectors: int = MAX_BATCH_VECTORS,
+                 max_bytes: int = DEFAULT_BATCH_BYTES, **kwargs):
+        super().__init__(pinecone_index=pinecone_index, **kwargs)
+        self._writer = BulkUpsertWriter(pinecone_index, self.namespace, workers, max_vectors, max_bytes)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BulkPineconeVectorStore"
+
+    @property
+    def writer(self) -> BulkUpsertWriter:
+        return self._writer
+
+    def _metadata(self, node: BaseNode) -> Dict:
+        # node_to_metadata_dict serializes the whole node and then drops the
+        # embedding; a shallow copy without it skips a pydantic pass per float
+        return node_to_metadata_dict(
+            node.copy(update={'embedding': None}),
+            remove_text=self.remove_text_from_metadata, flat_metadata=self.flat_metadata
+        )
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        entries = [
+            {'id': node.node_id, 'values': node.get_embedding(), 'metadata': self._metadata(node)}
+            for node in nodes
+        ]
+        self._writer.write(entries)
+        return [node.node_id for node in nodes]
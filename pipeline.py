@@ -0,0 +1,319 @@
+"""
+Streaming ingestion: parse -> clean -> chunk -> embed -> upsert
+Stages run concurrently on worker threads joined by bounded queues, so
+network-bound embedding overlaps CPU-bound parsing and memory stays flat
+"""
+import logging
+import queue
+import threading
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from llama_index.core.indices.utils import embed_nodes
+
+from email_processor_simple import PARALLEL_PARSE_THRESHOLD, parse_pool_size
+from progress import ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_STAGE_WORKERS = {'clean': 1, 'chunk': 2, 'embed': 4, 'upsert': 1}
+
+# Marks the end of a stage's input
+_DONE = object()
+
+class Stage:
+    """One pipeline step: ``fn`` maps an input batch to an output batch
+
+    ``fn`` may return None to drop a batch. ``count`` measures a batch for
+    the throughput counters (number of emails, nodes, ...).
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1,
+                 count: Callable = len):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.count = count
+        self.items = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, output, seconds: float):
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter() - seconds
+            self.batches += 1
+            self.busy_seconds += seconds
+            if output is not None:
+                self.items += self.count(output)
+
+    def stats(self) -> Dict:
+        wall = (self.finished or time.perf_counter()) - self.started if self.started else 0.0
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'batches': self.batches,
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'wall_seconds': round(wall, 3),
+            'items_per_second': round(self.items / wall, 1) if wall else 0.0,
+            # Near 1.0 means the stage is the bottleneck at this worker count
+            'utilization': round(self.busy_seconds / (wall * self.workers), 2) if wall else 0.0
+        }
+
+class Pipeline:
+    """Runs a batch source through stages connected by bounded queues
+
+    Each queue holds at most ``queue_size`` batches, so a fast stage blocks
+    instead of buffering the corpus in front of a slow one. The first
+    exception raised in any stage stops the pipeline and is re-raised by
+    ``run``.
+    """
+
+    def __init__(self, source: Stage, batches: Iterable, stages: List[Stage],
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.source = source
+        self.batches = batches
+        self.stages = stages
+        self.queue_size = queue_size
+        self._abort = threading.Event()
+        self._error = None
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        """Blocking put that gives up once the pipeline is aborting"""
+        while not self._abort.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source: queue.Queue):
+        while not self._abort.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, stage: Stage, error: BaseException):
+        logger.error(f"Pipeline stage '{stage.name}' failed: {str(error)}", exc_info=error)
+        if self._error is None:
+            self._error = error
+        self._abort.set()
+
+    def _run_source(self, output: queue.Queue, consumers: int):
+        iterator = iter(self.batches)
+        try:
+            while not self._abort.is_set():
+                started = time.perf_counter()
+                batch = next(iterator, _DONE)
+                if batch is _DONE:
+                    break
+                self.source.record(batch, time.perf_counter() - started)
+                if not self._put(output, batch):
+                    break
+        except BaseException as e:
+            self._fail(self.source, e)
+        finally:
+            # Lets a generator source release resources such as a process pool
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            self.source.finished = time.perf_counter()
+            for _ in range(consumers):
+                self._put(output, _DONE)
+
+    def _run_worker(self, stage: Stage, source: queue.Queue, output: Optional[queue.Queue],
+                    consumers: int, remaining: List[int], lock: threading.Lock):
+        try:
+            while True:
+                batch = self._get(source)
+                if batch is _DONE:
+                    break
+                started = time.perf_counter()
+                result = stage.fn(batch)
+                stage.record(result, time.perf_counter() - started)
+                if result is not None and output is not None:
+                    if not self._put(output, result):
+                        break
+        except BaseException as e:
+            self._fail(stage, e)
+        finally:
+            # The last worker of a stage to finish tells the next stage
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                stage.finished = time.perf_counter()
+                if output is not None:
+                    for _ in range(consumers):
+                        self._put(output, _DONE)
+
+    def run(self) -> List[Dict]:
+        """Run to completion and return per-stage counters"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(
+            target=self._run_source, args=(queues[0], self.stages[0].workers),
+            name=f"pipeline-{self.source.name}", daemon=True
+        )]
+        for position, stage in enumerate(self.stages):
+            is_last = position == len(self.stages) - 1
+            output = None if is_last else queues[position + 1]
+            consumers = 0 if is_last else self.stages[position + 1].workers
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_worker,
+                    args=(stage, queues[position], output, consumers, remaining, lock),
+                    name=f"pipeline-{stage.name}-{worker}", daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+        return [self.source.stats()] + [stage.stats() for stage in self.stages]
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def run_ingestion_pipeline(files, processor, vector_manager, incremental: bool = True,
+                           batch_size: int = DEFAULT_BATCH_SIZE,
+                           workers: Optional[Dict[str, int]] = None,
+                           parse_workers: Optional[int] = None,
+                           queue_size: int = DEFAULT_QUEUE_SIZE,
+                           reporter: Optional[ProgressReporter] = None) -> Optional[Dict]:
+    """Parse ``files`` and index them into ``vector_manager``'s backend, streaming
+
+    ``workers`` overrides the thread count per stage (keys 'clean', 'chunk',
+    'embed', 'upsert'); parsing uses a process pool of ``parse_workers``.
+    Only the batches in flight are held in memory. Returns a summary with
+    per-stage counters, or None if the backend is unavailable.
+    """
+    reporter = reporter or ProgressReporter()
+    stage_workers = dict(DEFAULT_STAGE_WORKERS, **(workers or {}))
+
+    if not vector_manager.has_embedding_key():
+        reporter.error("⚠️ OPENAI_API_KEY not found in the environment or .streamlit/secrets.toml")
+        return None
+    connection = vector_manager.connect_vector_store()
+    if not connection:
+        return None
+    vector_store, index_ops = connection
+    if vector_manager.backend == 'local':
+        # LocalVectorStore is not safe for concurrent writers
+        stage_workers['upsert'] = 1
+
+    total = len(files)
+    summary = {'emails': 0, 'parse_errors': 0, 'skipped': 0, 'duplicates': 0, 'stale_chunks': 0}
+    summary_lock = threading.Lock()
+    seen_hashes = {}
+    parallel = parse_workers != 1 and (parse_workers is not None or total >= PARALLEL_PARSE_THRESHOLD)
+    # Reported as the parse stage's workers, so utilization is per process
+    parse_pool = parse_pool_size(parse_workers) if parallel else 1
+
+    def parse_batches():
+        results = processor.iter_parse_eml_files(files, parallel=parallel, max_workers=parse_workers)
+        reporter.start(total, label="ingest")
+        done = 0
+        for batch in batched(results, batch_size):
+            for email_data, error in batch:
+                if error:
+                    summary['parse_errors'] += 1
+                    reporter.warning(f"⚠️ Error processing {email_data['filename']}: {error}")
+            done += len(batch)
+            reporter.advance(done)
+            yield [email_data for email_data, _ in batch]
+        reporter.finish()
+
+    def clean(emails: List[Dict]):
+        documents = []
+        built = vector_manager.process_emails_to_documents(emails)
+        # Copies sharing a Message-ID (e.g. list mail with different footers)
+        # would produce the same chunk IDs; the last copy wins, as in
+        # create_vector_store
+        latest = {document.doc_id: document for document in built}
+        with summary_lock:
+            summary['emails'] += len(emails)
+            summary['duplicates'] += len(built) - len(latest)
+            for document in latest.values():
+                content_hash = document.metadata.get('content_hash')
+                # Same email repeated in the input; the first copy is indexed
+                if seen_hashes.get(document.doc_id) == content_hash:
+                    summary['duplicates'] += 1
+                    continue
+                seen_hashes[document.doc_id] = content_hash
+                documents.append(document)
+        if not documents:
+            return None
+
+        try:
+            indexed = vector_manager.fetch_indexed_hashes(index_ops, [doc.doc_id for doc in documents])
+        except Exception as e:
+            logger.warning(f"Could not diff batch against index, embedding it: {str(e)}")
+            indexed = {}
+        if incremental:
+            fresh = vector_manager.select_new_documents(documents, indexed)
+            with summary_lock:
+                summary['skipped'] += len(documents) - len(fresh)
+            documents = fresh
+        if not documents:
+            return None
+        return {
+            'documents': documents,
+            'reindexed': [doc.doc_id for doc in documents if doc.doc_id in indexed]
+        }
+
+    def chunk(batch: Dict):
+        batch['nodes'] = vector_manager.node_parser.get_nodes_from_documents(batch.pop('documents'))
+        return batch
+
+    def embed(batch: Dict):
+        embeddings = embed_nodes(batch['nodes'], vector_manager.embedding_model)
+        for node in batch['nodes']:
+            node.embedding = embeddings[node.node_id]
+        return batch
+
+    def upsert(batch: Dict):
+        vector_store.add(batch['nodes'])
+        # A re-indexed email may now have fewer chunks than the stored copy
+        if batch['reindexed']:
+            removed = vector_manager.delete_stale_chunks(index_ops, batch['nodes'], batch['reindexed'])
+            with summary_lock:
+                summary['stale_chunks'] += removed
+        return batch
+
+    count_nodes = lambda batch: len(batch['nodes'])
+    pipeline = Pipeline(
+        Stage('parse', None, workers=parse_pool),
+        parse_batches(),
+        [
+            Stage('clean', clean, stage_workers['clean'], count=lambda batch: len(batch['documents'])),
+            Stage('chunk', chunk, stage_workers['chunk'], count=count_nodes),
+            Stage('embed', embed, stage_workers['embed'], count=count_nodes),
+            Stage('upsert', upsert, stage_workers['upsert'], count=count_nodes),
+        ],
+        queue_size=queue_size
+    )
+    summary['stages'] = pipeline.run()
+    index_ops.persist()
+    summary['vector_store'] = vector_store
+
+    logger.info(f"Ingestion pipeline finished: {summary['emails']} emails, stages {summary['stages']}")
+    return summary
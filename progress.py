@@ -0,0 +1,151 @@
+"""
+Progress and status reporting for the ingestion pipeline
+Lets parsing and indexing run under Streamlit, in a terminal or silently
+"""
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional, TextIO
+
+class ProgressReporter:
+    """Receives progress and status updates and discards them
+
+    Subclasses decide where updates go. ``start``/``advance``/``finish``
+    track one counted task at a time; ``stage`` wraps an uncounted step.
+    """
+
+    def start(self, total: int, label: str = ''):
+        pass
+
+    def advance(self, done: int, message: str = ''):
+        """Report that ``done`` items of the current task are complete"""
+        pass
+
+    def finish(self):
+        pass
+
+    @contextmanager
+    def stage(self, label: str):
+        yield
+
+    def info(self, message: str):
+        pass
+
+    def success(self, message: str):
+        pass
+
+    def warning(self, message: str):
+        pass
+
+    def error(self, message: str):
+        pass
+
+class StreamlitReporter(ProgressReporter):
+    """Progress bar, spinner and message boxes in the running Streamlit page"""
+
+    def __init__(self):
+        import streamlit as st
+        self.st = st
+        self._bar = None
+        self._status = None
+        self._total = 0
+
+    def start(self, total: int, label: str = ''):
+        self._total = total
+        self._bar = self.st.progress(0)
+        self._status = self.st.empty()
+
+    def advance(self, done: int, message: str = ''):
+        if self._bar is None:
+            return
+        self._bar.progress(min(done / max(self._total, 1), 1.0))
+        self._status.text(message or f"Processing: {done}/{self._total}")
+
+    def finish(self):
+        if self._bar is not None:
+            self._bar.empty()
+            self._status.empty()
+        self._bar = None
+        self._status = None
+
+    @contextmanager
+    def stage(self, label: str):
+        with self.st.spinner(label):
+            yield
+
+    def info(self, message: str):
+        self.st.info(message)
+
+    def success(self, message: str):
+        self.st.success(message)
+
+    def warning(self, message: str):
+        self.st.warning(message)
+
+    def error(self, message: str):
+        self.st.error(message)
+
+class ConsoleReporter(ProgressReporter):
+    """Line-oriented progress with items per second, for terminals and cron logs
+
+    Progress lines are throttled to one every ``interval`` seconds so that
+    log files stay readable on long runs.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, interval: float = 2.0):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self._label = ''
+        self._total = 0
+        self._done = 0
+        self._started = 0.0
+        self._last_print = 0.0
+        self.warnings = 0
+        self.errors = 0
+
+    def _print(self, line: str):
+        print(line, file=self.stream, flush=True)
+
+    def start(self, total: int, label: str = ''):
+        self._label = label or 'progress'
+        self._total = total
+        self._done = 0
+        self._started = self._last_print = time.perf_counter()
+
+    def advance(self, done: int, message: str = ''):
+        self._done = done
+        now = time.perf_counter()
+        if now - self._last_print >= self.interval:
+            self._last_print = now
+            self._print(self._progress_line(now))
+
+    def _progress_line(self, now: float) -> str:
+        elapsed = max(now - self._started, 1e-9)
+        return (f"{self._label}: {self._done}/{self._total} "
+                f"({self._done / elapsed:.1f}/s, {elapsed:.1f}s)")
+
+    def finish(self):
+        if self._total:
+            self._print(self._progress_line(time.perf_counter()))
+        self._total = 0
+
+    @contextmanager
+    def stage(self, label: str):
+        self._print(label)
+        started = time.perf_counter()
+        yield
+        self._print(f"{label} done in {time.perf_counter() - started:.1f}s")
+
+    def info(self, message: str):
+        self._print(message)
+
+    def success(self, message: str):
+        self._print(message)
+
+    def warning(self, message: str):
+        self.warnings += 1
+        self._print(f"WARNING: {message}")
+
+    def error(self, message: str):
+        self.errors += 1
+        self._print(f"ERROR: {message}")
@@ -1,12 +1,33 @@
 from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+from context_builder import build_budgeted_context, DEFAULT_CONTEXT_TOKEN_BUDGET
+from style_profiles import format_style_profile, PROFILE_EXAMPLE_COUNT
+from sender_index import SenderIndex
+from retrieval_filters import MIN_FILTERED_RESULTS
+from diversity import DIVERSE_EXAMPLE_COUNT, MMR_CANDIDATE_FACTOR, MMRPostprocessor
+from hybrid_retriever import HybridRetriever
+from email_chunker import merge_chunks, parent_id
 from llama_index.llms.openai import OpenAI
 import streamlit as st
-from typing import Dict, Optional
+from typing import Dict, Iterator, Optional
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _logged_stream(tokens: Iterator[str], label: str) -> Iterator[str]:
+    """Pass streamed text through, logging completion or failure"""
+    chars = 0
+    try:
+        for token in tokens:
+            chars += len(token)
+            yield token
+    except Exception as e:
+        logger.error(f"Error while streaming {label} response: {str(e)}", exc_info=True)
+        raise
+    logger.info(f"Streamed {label} response complete ({chars} chars)")
+
 class ResponseGenerator:
     def __init__(self):
         logger.info("Initializing ResponseGenerator")
@@ -25,6 +46,18 @@ class ResponseGenerator:
         )
         logger.info("ResponseGenerator initialized successfully with model: gpt-5")
     
+    def _build_retriever(self, vector_index, text_index, parsed_emails, top_k: int,
+                         filters: Optional[MetadataFilters]):
+        """Vector retriever, fused with keyword search when a text index is given"""
+        vector_retriever = None
+        if vector_index is not None:
+            vector_retriever = vector_index.as_retriever(similarity_top_k=top_k, filters=filters)
+        if text_index is None or parsed_emails is None:
+            if vector_retriever is None:
+                raise ValueError("Either a vector index or a text index is required for RAG")
+            return vector_retriever
+        return HybridRetriever(text_index, parsed_emails, vector_retriever, top_k=top_k, filters=filters)
+    
     def generate_response(self, 
                          incoming_email: str, 
                          sender_email: str,
@@ -32,18 +65,45 @@ class ResponseGenerator:
                          response_style: str = "professional",
                          message_type: str = "general",
                          is_internal: bool = False,
-                         user_email: Optional[str] = None) -> Dict:
-        """Generate personalized email response"""
+                         user_email: Optional[str] = None,
+                         stream: bool = False,
+                         style_profile: Optional[Dict] = None,
+                         filters: Optional[MetadataFilters] = None,
+                         text_index=None,
+                         parsed_emails=None) -> Dict:
+        """Generate personalized email response
+        
+        With ``stream`` the result carries a ``response_gen`` iterator of text
+        tokens instead of the finished ``response``. A precomputed
+        ``style_profile`` stands in for most of the retrieved examples, so
+        only PROFILE_EXAMPLE_COUNT are used. ``filters`` (see
+        retrieval_filters) restrict retrieval inside the index; if they
+        match too few emails the rest are retrieved unfiltered. Examples
+        are picked by MMR from MMR_CANDIDATE_FACTOR times as many
+        candidates, so near-identical thread replies count once. Given the
+        ``text_index`` (a FullTextIndex) over ``parsed_emails``, keyword
+        matches are fused with the vector results, and ``vector_index`` may
+        be None to retrieve by keywords alone.
+        """
         logger.info(f"Generating embedding-based response for {sender_email}")
         logger.info(f"Message type: {message_type}, Internal: {is_internal}, User: {user_email}")
         
-        # Increase context retrieval for better style learning (more for larger corpus)
-        query_engine = vector_index.as_query_engine(
+        top_k = PROFILE_EXAMPLE_COUNT if style_profile else DIVERSE_EXAMPLE_COUNT
+        candidate_k = top_k * MMR_CANDIDATE_FACTOR
+        retriever = self._build_retriever(vector_index, text_index, parsed_emails, candidate_k, filters)
+        query_engine = RetrieverQueryEngine.from_args(
+            retriever,
             llm=self.llm,
-            similarity_top_k=15,  # Increased from 10 for larger corpus
             response_mode="compact",  # Ensures all context is used
+            streaming=stream,
             verbose=True  # For debugging what's retrieved
         )
+        if text_index is None:
+            mode = 'RAG with embeddings'
+        elif vector_index is None:
+            mode = 'Keyword RAG (no embeddings)'
+        else:
+            mode = 'Hybrid RAG (BM25 + embeddings)'
         
         prompt = self.build_response_prompt(
             incoming_email, 
@@ -51,20 +111,51 @@ class ResponseGenerator:
             response_style,
             message_type,
             is_internal,
-            user_email
+            user_email,
+            style_profile=style_profile,
+            example_count=top_k
         )
         
+        # Retrieval only embeds the email itself; the instructions above are
+        # identical on every request and would just blur the query vector
+        retrieval_query = self.build_retrieval_query(incoming_email, sender_email)
+        
         try:
-            logger.debug(f"Querying with prompt length: {len(prompt)}")
-            response = query_engine.query(prompt)
-            logger.info("Response generated successfully via embeddings")
+            logger.debug(f"Querying with prompt length: {len(prompt)}, retrieval query length: {len(retrieval_query)}")
+            query_bundle = QueryBundle(query_str=prompt, custom_embedding_strs=[retrieval_query])
+            # Chunks of the same email count as one example
+            nodes = merge_chunks(query_engine.retrieve(query_bundle))
+            timings = dict(getattr(retriever, 'last_timings', {}))
+            if filters is not None and len(nodes) < min(top_k, MIN_FILTERED_RESULTS):
+                logger.info(f"Filters matched {len(nodes)} emails, topping up with unfiltered retrieval")
+                seen = {parent_id(node.node) for node in nodes}
+                unfiltered = merge_chunks(self._build_retriever(
+                    vector_index, text_index, parsed_emails, candidate_k, None
+                ).retrieve(query_bundle))
+                nodes += [node for node in unfiltered if parent_id(node.node) not in seen][:candidate_k - len(nodes)]
+            nodes = MMRPostprocessor(top_n=top_k).postprocess_nodes(nodes, query_bundle)
+            response = query_engine.synthesize(query_bundle, nodes)
+            if stream:
+                logger.info(f"Streaming response via {mode}")
+                return {
+                    'success': True,
+                    'response': None,
+                    'response_gen': _logged_stream(response.response_gen, 'RAG'),
+                    'sources': [node.metadata for node in response.source_nodes],
+                    'confidence': 'high',
+                    'mode': mode,
+                    'retrieval_timings': timings
+                }
+            
+            logger.info(f"Response generated successfully via {mode}")
             
             return {
                 'success': True,
                 'response': response.response,
                 'sources': [node.metadata for node in response.source_nodes],
                 'confidence': 'high',
-                'mode': 'RAG with embeddings'
+                'mode': mode,
+                'retrieval_timings': timings
             }
         except Exception as e:
             logger.error(f"Error in generate_response: {str(e)}", exc_info=True)
@@ -74,13 +165,19 @@ class ResponseGenerator:
                 'response': None
             }
     
+    def build_retrieval_query(self, incoming_email: str, sender_email: str) -> str:
+        """Text embedded to find similar past emails"""
+        return f"From: {sender_email}\n{incoming_email.strip()}"
+    
     def build_response_prompt(self, 
                             incoming_email: str, 
                             sender_email: str,
                             response_style: str,
                             message_type: str = "general",
                             is_internal: bool = False,
-                            user_email: Optional[str] = None) -> str:
+                            user_email: Optional[str] = None,
+                            style_profile: Optional[Dict] = None,
+                            example_count: int = DIVERSE_EXAMPLE_COUNT) -> str:
         """Build contextually appropriate prompt"""
         
         style_instructions = {
@@ -116,12 +213,23 @@ class ResponseGenerator:
         
         context_info.append(f"Message type: {message_type_context.get(message_type, 'general business email')}")
         
+        if style_profile:
+            overview = (f"YOU HAVE BEEN PROVIDED WITH A STYLE PROFILE OF THE AUTHOR AND {example_count} EMAIL EXAMPLES. "
+                        "USE BOTH AND COPY THE STYLE EXACTLY.")
+            profile_section = f"""
+        === AUTHOR STYLE PROFILE (measured across their emails) ===
+{format_style_profile(style_profile)}
+        """
+        else:
+            overview = f"YOU HAVE BEEN PROVIDED WITH {example_count}+ EMAIL EXAMPLES. STUDY THEM ALL AND COPY THE STYLE EXACTLY."
+            profile_section = ""
+        
         return f"""
-        YOU HAVE BEEN PROVIDED WITH 15+ EMAIL EXAMPLES. STUDY THEM ALL AND COPY THE STYLE EXACTLY.
+        {overview}
         
         === CONTEXT ===
         {' | '.join(context_info)}
-        
+        {profile_section}        
         === Email Requiring Response ===
         From: {sender_email}
         Content: {incoming_email}
@@ -164,26 +272,46 @@ class ResponseGenerator:
                                 parsed_emails: list,
                                 response_style: str = "professional",
                                 message_type: str = "general",
-                                is_internal: bool = False) -> Dict:
-        """Generate response without using embeddings - direct context"""
+                                is_internal: bool = False,
+                                stream: bool = False,
+                                context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+                                style_profile: Optional[Dict] = None,
+                                sender_index: Optional[SenderIndex] = None) -> Dict:
+        """Generate response without using embeddings - direct context
+        
+        Example emails are added until ``context_token_budget`` tokens are
+        used; the result's ``context_tokens`` reports the spend per source.
+        """
         logger.info(f"Generating direct response for {sender_email} (no embeddings)")
         logger.debug(f"Available emails: {len(parsed_emails)}")
         
         try:
+            # Over-fetch; the budget decides how many actually fit
             relevant_emails = self.find_relevant_emails_direct(
                 sender_email, 
                 parsed_emails,
-                limit=10  # Increased for larger corpus
+                limit=20,
+                sender_index=sender_index
             )
             
-            context = self.build_context_from_emails(relevant_emails)
-            
+            context, context_usage, used_emails = build_budgeted_context(
+                relevant_emails,
+                sender_email=sender_email,
+                token_budget=context_token_budget,
+                max_emails=PROFILE_EXAMPLE_COUNT if style_profile else None
+            )
+            profile_section = ""
+            if style_profile:
+                profile_section = f"""
+            === AUTHOR STYLE PROFILE (measured across their emails) ===
+{format_style_profile(style_profile)}
+            """
             prompt = f"""
             CRITICAL INSTRUCTION: You must EXACTLY mimic the writing style from the email examples below.
             
             === EMAIL EXAMPLES - STUDY AND COPY THIS EXACT STYLE ===
             {context}
-            
+            {profile_section}
             === New Email Requiring Response ===
             From: {sender_email}
             Content: {incoming_email}
@@ -209,13 +337,27 @@ class ResponseGenerator:
             """
             
             logger.debug(f"Sending prompt to LLM, length: {len(prompt)}")
+            if stream:
+                return {
+                    'success': True,
+                    'response': None,
+                    'response_gen': _logged_stream(
+                        (chunk.delta or '' for chunk in self.llm.stream_complete(prompt)), 'direct'
+                    ),
+                    'sources': used_emails,
+                    'context_tokens': context_usage,
+                    'confidence': 'medium',
+                    'mode': 'direct'
+                }
+            
             response = self.llm.complete(prompt)
             logger.info("Direct response generated successfully")
             
             return {
                 'success': True,
                 'response': response.text,
-                'sources': relevant_emails[:3] if relevant_emails else [],
+                'sources': used_emails,
+                'context_tokens': context_usage,
                 'confidence': 'medium',
                 'mode': 'direct'
             }
@@ -227,38 +369,39 @@ class ResponseGenerator:
                 'response': None
             }
     
-    def find_relevant_emails_direct(self, sender_email: str, parsed_emails: list, limit: int = 10) -> list:
-        """Find relevant emails without using embeddings"""
+    def find_relevant_emails_direct(self, sender_email: str, parsed_emails: list, limit: int = 10,
+                                    sender_index: Optional[SenderIndex] = None) -> list:
+        """Find relevant emails without using embeddings
+        
+        Pass the ``sender_index`` built at ingestion to avoid rebuilding it;
+        a missing or stale one is rebuilt from ``parsed_emails``.
+        """
         logger.debug(f"Finding relevant emails for {sender_email}")
-        relevant = []
+        if sender_index is None or not sender_index.indexes(parsed_emails):
+            sender_index = SenderIndex(parsed_emails)
         
         # First try to find emails from the same sender
-        for email in parsed_emails:
-            if sender_email.lower() in email.get('from', '').lower():
-                relevant.append({
-                    'filename': email.get('filename', 'Unknown'),
-                    'sender': email.get('from', ''),
-                    'subject': email.get('subject', ''),
-                    'body_preview': email.get('body', ''),  # Use FULL body for style learning
-                    'date': email.get('date', '')
-                })
+        positions = sender_index.lookup(sender_email)[:limit]
         
         # If no emails from sender found, use all emails for style reference
-        if not relevant:
+        if not positions:
             logger.info(f"No emails from {sender_email} found, using all emails for style reference")
-            for email in parsed_emails:
-                relevant.append({
-                    'filename': email.get('filename', 'Unknown'),
-                    'sender': email.get('from', ''),
-                    'subject': email.get('subject', ''),
-                    'body_preview': email.get('body', ''),  # Use FULL body for style learning
-                    'date': email.get('date', '')
-                })
-        
-        relevant = sorted(relevant, key=lambda x: x.get('date', ''), reverse=True)
-        
-        logger.debug(f"Found {len(relevant)} relevant emails, returning top {limit}")
-        return relevant[:limit]
+            positions = sender_index.recent(limit)
+        
+        relevant = []
+        for pos in positions:
+            email = parsed_emails[pos]
+            relevant.append({
+                'filename': email.get('filename', 'Unknown'),
+                'sender': email.get('from', ''),
+                'subject': email.get('subject', ''),
+                'body_preview': email.get('body', ''),  # Use FULL body for style learning
+                'date': email.get('date', ''),
+                'date_ts': email.get('date_ts')
+            })
+        
+        logger.debug(f"Returning {len(relevant)} relevant emails (limit {limit})")
+        return relevant
     
     def build_context_from_emails(self, emails: list) -> str:
         """Build context string from email list"""
@@ -284,7 +427,8 @@ Email {idx}:
                                   sender_email: str,
                                   response_style: str = "professional",
                                   message_type: str = "general",
-                                  is_internal: bool = False) -> Dict:
+                                  is_internal: bool = False,
+                                  stream: bool = False) -> Dict:
         """Generate a baseline response with NO context or style mimicking"""
         logger.info(f"=== GENERATING BASELINE RESPONSE (NO EMBEDDINGS) ===")
         logger.info(f"This is a control response without any style mimicking from the database")
@@ -314,6 +458,18 @@ Email {idx}:
             """
             
             logger.debug(f"Baseline prompt length: {len(prompt)}")
+            if stream:
+                return {
+                    'success': True,
+                    'response': None,
+                    'response_gen': _logged_stream(
+                        (chunk.delta or '' for chunk in self.llm.stream_complete(prompt)), 'baseline'
+                    ),
+                    'sources': [],
+                    'confidence': 'baseline',
+                    'mode': 'BASELINE (No Embeddings/Context)'
+                }
+            
             response = self.llm.complete(prompt)
             logger.info("Baseline response generated successfully")
             
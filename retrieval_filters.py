@@ -0,0 +1,82 @@
+"""
+Metadata filters that narrow vector retrieval to the emails that matter
+Applied inside the index, so a small top-k is not spent on other people's mail
+"""
+import logging
+import time
+from typing import Dict, Optional
+
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+
+from style_profiles import sender_address
+
+logger = logging.getLogger(__name__)
+
+SENDER_EMAIL_KEY = 'sender_email'
+SENDER_DOMAIN_KEY = 'sender_domain'
+DATE_TS_KEY = 'date_ts'
+# Stored on every vector for filtering only, never embedded or prompted
+FILTER_METADATA_KEYS = [SENDER_EMAIL_KEY, SENDER_DOMAIN_KEY, DATE_TS_KEY]
+
+# Where the examples for a response come from
+RETRIEVAL_SCOPES = {
+    'mine': "Emails I wrote",
+    'sender': "Emails from this sender",
+    'domain': "Emails from this sender's domain",
+    'all': "All emails",
+}
+
+# Fewer filtered hits than this and retrieval is topped up unfiltered
+MIN_FILTERED_RESULTS = 3
+
+def address_domain(address: str) -> str:
+    return address.rsplit('@', 1)[1] if '@' in address else ''
+
+def filter_metadata(email: Dict) -> Dict:
+    """Filterable fields for an email's vectors
+
+    ``date_ts`` is left out when the date did not parse, so date filters
+    exclude the email instead of matching a placeholder.
+    """
+    address = sender_address(email.get('from', ''))
+    metadata = {SENDER_EMAIL_KEY: address, SENDER_DOMAIN_KEY: address_domain(address)}
+    if email.get('date_ts') is not None:
+        metadata[DATE_TS_KEY] = int(email['date_ts'])
+    return metadata
+
+def build_email_filters(sender: Optional[str] = None, domain: Optional[str] = None,
+                        direction: Optional[str] = None, user_email: Optional[str] = None,
+                        since_ts: Optional[int] = None, until_ts: Optional[int] = None) -> Optional[MetadataFilters]:
+    """AND of the given conditions, or None when there are none
+
+    ``direction`` is 'sent' (written by ``user_email``) or 'received'
+    (written by anyone else); it is ignored without a ``user_email``.
+    """
+    filters = []
+    if sender:
+        filters.append(MetadataFilter(key=SENDER_EMAIL_KEY, value=sender_address(sender)))
+    if domain:
+        filters.append(MetadataFilter(key=SENDER_DOMAIN_KEY, value=domain.strip().lstrip('@').lower()))
+    if direction and user_email:
+        operator = FilterOperator.EQ if direction == 'sent' else FilterOperator.NE
+        filters.append(MetadataFilter(key=SENDER_EMAIL_KEY, value=sender_address(user_email), operator=operator))
+    elif direction:
+        logger.warning(f"Ignoring direction '{direction}' filter: user email unknown")
+    if since_ts is not None:
+        filters.append(MetadataFilter(key=DATE_TS_KEY, value=int(since_ts), operator=FilterOperator.GTE))
+    if until_ts is not None:
+        filters.append(MetadataFilter(key=DATE_TS_KEY, value=int(until_ts), operator=FilterOperator.LTE))
+    return MetadataFilters(filters=filters) if filters else None
+
+def scope_filters(scope: str, sender_email: str, user_email: Optional[str] = None,
+                  days: Optional[int] = None, now: Optional[float] = None) -> Optional[MetadataFilters]:
+    """Filters for one of RETRIEVAL_SCOPES, optionally limited to the last ``days``"""
+    since_ts = int((now or time.time()) - days * 86400) if days else None
+    address = sender_address(sender_email or '')
+    if scope == 'mine':
+        return build_email_filters(direction='sent', user_email=user_email, since_ts=since_ts)
+    if scope == 'sender':
+        return build_email_filters(sender=address or None, since_ts=since_ts)
+    if scope == 'domain':
+        return build_email_filters(domain=address_domain(address) or None, since_ts=since_ts)
+    return build_email_filters(since_ts=since_ts)
@@ -0,0 +1,180 @@
+"""
+Full-text search over parsed emails using SQLite FTS5
+Built once at ingestion so knowledge base searches are index lookups, not row scans
+"""
+import logging
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from email_corpus import EmailCorpus, sender_column
+from style_profiles import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+# Query prefixes that restrict a term to one column
+FIELD_ALIASES = {
+    'subject': 'subject',
+    'from': 'sender',
+    'sender': 'sender',
+    'body': 'body',
+}
+# bm25 weight per column, in table order: a subject hit outranks a body hit
+COLUMN_WEIGHTS = (3.0, 2.0, 1.0)
+DEFAULT_PAGE_SIZE = 25
+
+# field:"quoted phrase", field:term, "quoted phrase" or a bare term
+QUERY_TOKEN = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+# Words in free text, keeping codes like ABC-1234 or v2.1 in one piece
+KEYWORD_TOKEN = re.compile(r"\w+(?:[-_./]\w+)*")
+MAX_KEYWORD_TERMS = 32
+
+def fts5_available() -> bool:
+    """Whether this Python's SQLite was built with FTS5"""
+    try:
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def parse_query(query: str) -> Optional[str]:
+    """Translate search box input into an FTS5 MATCH expression
+
+    Supports ``from:``, ``subject:`` and ``body:`` filters, quoted phrases
+    and a trailing ``*`` for prefix matches. Every term is quoted, so
+    punctuation in user input can never be read as FTS5 syntax. Returns
+    None when nothing searchable is left.
+    """
+    clauses = []
+    for field, phrase, word in QUERY_TOKEN.findall(query or ''):
+        column = FIELD_ALIASES.get(field.lower()) if field else None
+        if field and column is None:
+            # Not a known field, e.g. a time like 10:30; search it verbatim
+            word = f"{field}:{phrase or word}"
+            phrase = ''
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith('*')
+        term = term.rstrip('*')
+        if not re.search(r'\w', term):
+            continue
+        clause = _quote(term) + ('*' if prefix else '')
+        clauses.append(f"{column} : {clause}" if column else clause)
+    return ' AND '.join(clauses) if clauses else None
+
+def is_identifier(term: str) -> bool:
+    """Ticket numbers, product codes and the like: digits, inner caps or joiners"""
+    return (any(char.isdigit() for char in term) or any(char in '-_./' for char in term)
+            or (term[1:] != term[1:].lower()))
+
+def keyword_terms(text: str, max_terms: int = MAX_KEYWORD_TERMS) -> List[str]:
+    """Distinctive lowercased terms of free text, identifiers first, then the longest words"""
+    terms = {}
+    for term in KEYWORD_TOKEN.findall(text or ''):
+        if len(term) < 3 or term.lower() in STOPWORDS:
+            continue
+        terms.setdefault(term.lower(), is_identifier(term))
+    return sorted(terms, key=lambda term: (not terms[term], -len(term)))[:max_terms]
+
+def keyword_expression(text: str, max_terms: int = MAX_KEYWORD_TERMS) -> Optional[str]:
+    """FTS5 expression matching any of keyword_terms()
+
+    For ranking emails against a whole email rather than a typed query;
+    bm25 weighs the terms by rarity. Returns None when nothing searchable
+    is left.
+    """
+    ranked = keyword_terms(text, max_terms)
+    return ' OR '.join(_quote(term) for term in ranked) if ranked else None
+
+class FullTextIndex:
+    """In-memory FTS5 index over subject, sender and body
+
+    Row IDs are positions in the parsed email list, so hits map straight
+    back to emails. Results are ranked with bm25, subject matches weighted
+    above sender and body matches.
+    """
+
+    def __init__(self, parsed_emails: Union[EmailCorpus, List[Dict]]):
+        self.size = len(parsed_emails)
+        # Streamlit reruns scripts on different threads
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE emails USING fts5("
+            " subject, sender, body,"
+            " tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+        if isinstance(parsed_emails, EmailCorpus):
+            subjects = parsed_emails.column('subject')
+            bodies = parsed_emails.column('body')
+        else:
+            subjects = [email.get('subject', '') for email in parsed_emails]
+            bodies = [email.get('body', '') for email in parsed_emails]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO emails (rowid, subject, sender, body) VALUES (?, ?, ?, ?)",
+                zip(range(self.size), subjects, sender_column(parsed_emails), bodies)
+            )
+            # Merge index segments now rather than on the first searches
+            self.conn.execute("INSERT INTO emails (emails) VALUES ('optimize')")
+        logger.info(f"Full-text index built over {self.size} emails")
+
+    def search(self, query: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0) -> Dict:
+        """Ranked page of matches for a search box query
+
+        Returns ``total`` (matches across all pages) and ``hits``, each with
+        the email ``position``, its bm25 ``score`` (higher is better) and a
+        ``snippet`` of the body around the match.
+        """
+        expression = parse_query(query)
+        if expression is None:
+            return {'total': 0, 'hits': []}
+
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        try:
+            with self._lock:
+                total = self.conn.execute(
+                    "SELECT COUNT(*) FROM emails WHERE emails MATCH ?", (expression,)
+                ).fetchone()[0]
+                rows = self.conn.execute(
+                    f"SELECT rowid, bm25(emails, {weights}) AS score,"
+                    f" snippet(emails, 2, '**', '**', '…', 16)"
+                    f" FROM emails WHERE emails MATCH ? ORDER BY score LIMIT ? OFFSET ?",
+                    (expression, limit, offset)
+                ).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Search for {query!r} failed: {str(e)}")
+            return {'total': 0, 'hits': []}
+
+        # bm25() is negative, lower meaning more relevant
+        hits = [{'position': rowid, 'score': -score, 'snippet': snippet} for rowid, score, snippet in rows]
+        return {'total': total, 'hits': hits}
+
+    def rank(self, text: str, limit: int = DEFAULT_PAGE_SIZE) -> List[Tuple[int, float]]:
+        """``(position, score)`` of the emails best matching free text, best first"""
+        expression = keyword_expression(text)
+        if expression is None:
+            return []
+
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        try:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT rowid, bm25(emails, {weights}) AS score"
+                    f" FROM emails WHERE emails MATCH ? ORDER BY score LIMIT ?",
+                    (expression, limit)
+                ).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Keyword ranking failed: {str(e)}")
+            return []
+        return [(rowid, -score) for rowid, score in rows]
+
+    def close(self):
+        self.conn.close()
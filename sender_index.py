@@ -0,0 +1,123 @@
+"""
+Sender lookup index over parsed emails, built once at ingestion
+Maps addresses, display names and domains to email positions, newest first
+"""
+import logging
+from collections import defaultdict
+from email.utils import getaddresses
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from email_corpus import EmailCorpus, sender_column
+from email_text import parse_date_header
+
+logger = logging.getLogger(__name__)
+
+def email_timestamps(parsed_emails: List[Dict]) -> np.ndarray:
+    """``date_ts`` of each email as float64, NaN where the date did not parse
+
+    Emails parsed before ``date_ts`` existed have their header parsed here.
+    """
+    if isinstance(parsed_emails, EmailCorpus):
+        return np.where(parsed_emails.dated(), parsed_emails.date_ts, np.nan)
+    return np.array([
+        email['date_ts'] if 'date_ts' in email else parse_date_header(email.get('date', ''))[0]
+        for email in parsed_emails
+    ], dtype=np.float64)
+
+def normalize_name(name: str) -> str:
+    return ' '.join(name.replace('"', '').split()).lower()
+
+def sender_keys(sender: str) -> List[tuple]:
+    """(address, domain, display name) for each mailbox in a From header"""
+    keys = []
+    for name, address in getaddresses([sender]):
+        address = address.strip().lower()
+        domain = address.rsplit('@', 1)[1] if '@' in address else None
+        keys.append((address if domain else None, domain, normalize_name(name) or None))
+    return keys
+
+class SenderIndex:
+    """Inverted index from sender keys to positions in the parsed email list
+
+    Every posting list is sorted newest first, so the most recent ``k``
+    emails for a sender are a slice rather than a scan and sort of the
+    whole corpus. Emails whose date does not parse sort last.
+    """
+
+    def __init__(self, parsed_emails: List[Dict]):
+        self.parsed_emails = parsed_emails
+        self.size = len(parsed_emails)
+        self._by_address = defaultdict(list)
+        self._by_name = defaultdict(list)
+        self._by_domain = defaultdict(list)
+
+        timestamps = email_timestamps(parsed_emails)
+        undated = np.isnan(timestamps)
+        # lexsort's last key is the primary one: dated first, newest first,
+        # then upload order
+        self._recency = np.lexsort(
+            (np.arange(self.size), -np.nan_to_num(timestamps), undated)
+        ).tolist()
+
+        senders = sender_column(parsed_emails)
+        # Each distinct From header is parsed once, however many emails share it
+        parsed_senders = {}
+
+        # Walking positions in recency order keeps every posting list sorted
+        for pos in self._recency:
+            sender = senders[pos]
+            if sender not in parsed_senders:
+                parsed_senders[sender] = sender_keys(sender)
+            for address, domain, name in parsed_senders[sender]:
+                if address:
+                    self._add(self._by_address, address, pos)
+                    self._add(self._by_domain, domain, pos)
+                if name:
+                    self._add(self._by_name, name, pos)
+
+        logger.info(
+            f"Sender index: {self.size} emails, {len(self._by_address)} addresses, "
+            f"{len(self._by_domain)} domains"
+        )
+
+    def indexes(self, parsed_emails: List[Dict]) -> bool:
+        """Whether this index was built over ``parsed_emails`` as it is now
+
+        Compares the corpus object itself: another upload of the same size
+        is a different corpus.
+        """
+        return parsed_emails is self.parsed_emails and len(parsed_emails) == self.size
+
+    @staticmethod
+    def _add(postings: Dict[str, List[int]], key: str, pos: int):
+        # One email can list the same sender twice; keep positions unique
+        entries = postings[key]
+        if not entries or entries[-1] != pos:
+            entries.append(pos)
+
+    def lookup(self, sender: str) -> List[int]:
+        """Positions of emails from ``sender``, newest first
+
+        ``sender`` may be a bare address, a full From header, a display name
+        or a domain (with or without a leading ``@``).
+        """
+        query = (sender or '').strip()
+        if not query:
+            return []
+
+        parsed = getaddresses([query])
+        name, address = parsed[0] if parsed else ('', '')
+        address = address.strip().lower()
+        if address in self._by_address:
+            return self._by_address[address]
+        # A bare name does not parse as a header, so fall back to the raw query
+        for candidate in (name, query):
+            if candidate and normalize_name(candidate) in self._by_name:
+                return self._by_name[normalize_name(candidate)]
+        return self._by_domain.get(query.lower().lstrip('@'), [])
+
+    def recent(self, limit: Optional[int] = None) -> List[int]:
+        """Positions of all emails, newest first"""
+        return self._recency if limit is None else self._recency[:limit]
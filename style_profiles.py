@@ -0,0 +1,226 @@
+"""
+Per-author writing style profiles extracted once at ingestion
+A compact profile plus a few examples replaces stuffing 10-15 full emails into every prompt
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from email_text import clean_body
+from parse_cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STYLE_PROFILE_PATH = os.path.join(DEFAULT_CACHE_DIR, 'style_profiles.json')
+STYLE_PROFILE_VERSION = 1
+
+# Few enough examples that the profile has to carry the style
+PROFILE_EXAMPLE_COUNT = 3
+
+GREETING_WORDS = {
+    'hi', 'hello', 'hey', 'dear', 'greetings', 'good', 'morning', 'afternoon',
+    'evening', 'hiya', 'howdy', 'team', 'all', 'everyone', 'folks'
+}
+
+STOPWORDS = {
+    'the', 'a', 'an', 'and', 'or', 'but', 'if', 'of', 'to', 'in', 'on', 'at', 'for',
+    'with', 'is', 'are', 'was', 'were', 'be', 'been', 'it', 'this', 'that', 'i', 'you',
+    'we', 'they', 'he', 'she', 'my', 'your', 'our', 'as', 'by', 'from', 'not', 'have',
+    'has', 'had', 'do', 'will', 'would', 'can', 'could', 'so', 'me', 'us', 'them',
+    'its', 'am', 'there', 'their', 'what', 'which', 'all', 'any', 'also', 'just'
+}
+
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z'\-]*")
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)?%?')
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+def sender_address(sender: str) -> str:
+    """Bare lowercase address from a From header"""
+    if '<' in sender and '>' in sender:
+        sender = sender.split('<')[1].split('>')[0]
+    return sender.strip().lower()
+
+def extract_greeting(body: str) -> Optional[str]:
+    """First line, if it reads like a salutation"""
+    lines = [line.strip() for line in body.splitlines() if line.strip()]
+    if not lines:
+        return None
+    first = lines[0]
+    words = first.split()
+    if len(words) > 6:
+        return None
+    if first.endswith((',', '!', ':')) or words[0].lower().strip(',!:') in GREETING_WORDS:
+        return first
+    return None
+
+def extract_signoff(body: str) -> Optional[str]:
+    """Closing phrase and the name lines under it, e.g. "Regards,\\nSpock" """
+    lines = [line.strip() for line in body.splitlines() if line.strip()]
+    # Closings sit within the last few lines and end with a comma
+    for idx in range(len(lines) - 1, max(len(lines) - 5, 0) - 1, -1):
+        line = lines[idx]
+        if line.endswith(',') and len(line.split()) <= 6 and idx > 0:
+            return '\n'.join(lines[idx:])
+    return None
+
+def _percentiles(values: List[int]) -> Dict:
+    if not values:
+        return {'mean': 0, 'median': 0, 'p90': 0}
+    ordered = sorted(values)
+    return {
+        'mean': round(sum(ordered) / len(ordered), 1),
+        'median': ordered[len(ordered) // 2],
+        'p90': ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+    }
+
+def build_style_profile(bodies: List[str], max_phrases: int = 8) -> Dict:
+    """Summarize greeting, sign-off, phrasing, rhythm and number use across bodies"""
+    greetings = Counter()
+    signoffs = Counter()
+    phrase_docs = Counter()
+    word_counts = Counter()
+    sentence_lengths = []
+    email_lengths = []
+    total_words = 0
+    numbers = 0
+    percents = 0
+
+    for raw_body in bodies:
+        body = clean_body(raw_body)
+        if not body:
+            continue
+
+        greeting = extract_greeting(body)
+        if greeting:
+            greetings[greeting] += 1
+        signoff = extract_signoff(body)
+        if signoff:
+            signoffs[signoff] += 1
+
+        words = [word.lower() for word in WORD_PATTERN.findall(body)]
+        total_words += len(words)
+        email_lengths.append(len(words))
+        word_counts.update(word for word in words if word not in STOPWORDS and len(word) > 3)
+
+        for sentence in SENTENCE_SPLIT.split(body.replace('\n', ' ')):
+            length = len(sentence.split())
+            if length:
+                sentence_lengths.append(length)
+
+        found_numbers = NUMBER_PATTERN.findall(body)
+        numbers += len(found_numbers)
+        percents += sum(1 for number in found_numbers if number.endswith('%'))
+
+        # Count each phrase once per email, so a catchphrase must recur
+        # across messages rather than within one
+        phrases = set()
+        for n in (3, 4):
+            for start in range(len(words) - n + 1):
+                gram = words[start:start + n]
+                if all(word in STOPWORDS for word in gram):
+                    continue
+                phrases.add(' '.join(gram))
+        phrase_docs.update(phrases)
+
+    min_docs = 2 if len(email_lengths) > 1 else 1
+    catchphrases = [phrase for phrase, count in phrase_docs.most_common(max_phrases * 4) if count >= min_docs]
+    # Prefer the longest phrasing of overlapping n-grams
+    distinct = []
+    for phrase in sorted(catchphrases, key=len, reverse=True):
+        if not any(phrase in kept for kept in distinct):
+            distinct.append(phrase)
+
+    return {
+        'version': STYLE_PROFILE_VERSION,
+        'email_count': len(email_lengths),
+        'greetings': [greeting for greeting, _ in greetings.most_common(3)],
+        'signoffs': [signoff for signoff, _ in signoffs.most_common(2)],
+        'catchphrases': distinct[:max_phrases],
+        'vocabulary': [word for word, _ in word_counts.most_common(12)],
+        'sentence_length': _percentiles(sentence_lengths),
+        'email_length': _percentiles(email_lengths),
+        'numbers_per_100_words': round(100 * numbers / total_words, 2) if total_words else 0.0,
+        'uses_percentages': percents > 0
+    }
+
+def profile_fingerprint(emails: List[Dict]) -> str:
+    """Identifies the set of emails a profile was built from"""
+    hashes = sorted(email.get('hash', '') for email in emails)
+    return hashlib.md5('\n'.join(hashes).encode()).hexdigest()
+
+def build_style_profiles(parsed_emails: List[Dict],
+                         cache_path: Optional[str] = DEFAULT_STYLE_PROFILE_PATH) -> Dict[str, Dict]:
+    """Profile every sender in the corpus, reusing cached profiles that are still current"""
+    by_sender = defaultdict(list)
+    for email in parsed_emails:
+        address = sender_address(email.get('from', ''))
+        if '@' in address:
+            by_sender[address].append(email)
+
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable style profile cache: {str(e)}")
+
+    profiles = {}
+    rebuilt = 0
+    for address, emails in by_sender.items():
+        fingerprint = profile_fingerprint(emails)
+        entry = cached.get(address)
+        if (entry and entry.get('fingerprint') == fingerprint
+                and entry.get('profile', {}).get('version') == STYLE_PROFILE_VERSION):
+            profiles[address] = entry['profile']
+            continue
+        profiles[address] = build_style_profile([email.get('body', '') for email in emails])
+        cached[address] = {'fingerprint': fingerprint, 'profile': profiles[address]}
+        rebuilt += 1
+
+    if cache_path and rebuilt:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            with open(cache_path, 'w') as f:
+                json.dump(cached, f)
+        except OSError as e:
+            logger.warning(f"Could not write style profile cache: {str(e)}")
+
+    logger.info(f"Style profiles: {len(profiles)} senders, {rebuilt} rebuilt")
+    return profiles
+
+def select_style_profile(profiles: Optional[Dict[str, Dict]], *addresses: Optional[str]) -> Optional[Dict]:
+    """First profile found among the given addresses"""
+    if not profiles:
+        return None
+    for address in addresses:
+        if address and sender_address(address) in profiles:
+            return profiles[sender_address(address)]
+    return None
+
+def format_style_profile(profile: Dict) -> str:
+    """Render a profile as a compact prompt section"""
+    lines = [f"Built from {profile['email_count']} emails by this author."]
+    if profile['greetings']:
+        lines.append("Typical greetings: " + " | ".join(profile['greetings']))
+    if profile['signoffs']:
+        lines.append("Typical sign-offs: " + " | ".join(s.replace('\n', ' / ') for s in profile['signoffs']))
+    if profile['catchphrases']:
+        lines.append("Recurring phrases: " + "; ".join(f'"{p}"' for p in profile['catchphrases']))
+    if profile['vocabulary']:
+        lines.append("Characteristic words: " + ", ".join(profile['vocabulary']))
+    sentence = profile['sentence_length']
+    length = profile['email_length']
+    lines.append(
+        f"Sentence length: median {sentence['median']} words (p90 {sentence['p90']}); "
+        f"email length: median {length['median']} words"
+    )
+    numeric = f"Numbers per 100 words: {profile['numbers_per_100_words']}"
+    if profile['uses_percentages']:
+        numeric += " (uses percentages)"
+    lines.append(numeric)
+    return "\n".join(f"- {line}" for line in lines)
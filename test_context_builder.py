@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Test that the direct-mode context stays within its token budget and matches the emails returned"""
+
+from llama_index.core.utils import set_global_tokenizer
+
+from context_builder import build_budgeted_context
+from email_text import count_tokens
+
+# Whitespace words, and single characters, where every separator counts
+TOKENIZERS = {'words': str.split, 'characters': list}
+
+def make_emails():
+    emails = []
+    for i in range(12):
+        sender = 'Spock <spock@enterprise.starfleet>' if i % 3 == 0 else f"Crew {i} <crew{i}@enterprise.starfleet>"
+        body = f"Report {i}. " + "The warp core readings remain within tolerance. " * (5 + 10 * (i % 4))
+        if i % 4 == 1:
+            body += "\n\nOn Mon, 1 Jan 2024, Kirk wrote:\n> " + "Quoted history that is stripped. " * 30
+        emails.append({
+            'filename': f"email_{i:03}.eml",
+            'sender': sender,
+            'subject': f"Status report {i}",
+            'date': 'Mon, 1 Jan 2024 09:00:00 +0000',
+            'body_preview': body,
+        })
+    # One without a body ranks after everything else
+    emails.insert(2, {'filename': 'empty.eml', 'sender': 'crew@enterprise.starfleet', 'subject': 'Empty',
+                      'date': '', 'body_preview': ''})
+    return emails
+
+def entries(context):
+    # Each entry opens with a blank line and "Email <n>:"
+    return context.split('\nEmail ')[1:]
+
+def test_budget_respected():
+    emails = make_emails()
+    for name, tokenizer in TOKENIZERS.items():
+        set_global_tokenizer(tokenizer)
+        scale = 1 if name == 'words' else 6
+        for budget in (100, 250, 600, 2000, 100_000):
+            budget *= scale
+            context, usage, used = build_budgeted_context(
+                emails, sender_email='spock@enterprise.starfleet', token_budget=budget,
+                max_tokens_per_email=150 * scale
+            )
+            assert usage['budget'] == budget
+            assert usage['used'] <= budget, (name, budget, usage['used'])
+            # The reported spend is what the rendered context actually costs
+            assert count_tokens(context) == usage['used'], (name, budget, count_tokens(context), usage['used'])
+            assert usage['used'] == sum(source['tokens'] for source in usage['sources']) + (
+                count_tokens('\n') * (len(used) - 1) if used else 0)
+            assert usage['skipped'] == len(emails) - len(used)
+            # No body is longer than the per-email cap
+            for entry in entries(context):
+                body = entry.split('- Content: ', 1)[1].rsplit('\n---', 1)[0]
+                assert count_tokens(body) <= 150 * scale, (name, budget, count_tokens(body))
+        print(f"✅ budget respected ({name})")
+
+def test_returned_emails_match_context():
+    set_global_tokenizer(str.split)
+    emails = make_emails()
+    context, usage, used = build_budgeted_context(emails, sender_email='spock@enterprise.starfleet',
+                                                  token_budget=800, max_tokens_per_email=120)
+    rendered = entries(context)
+    assert 1 < len(used) < len(emails)
+    assert len(used) == len(rendered) == len(usage['sources'])
+    for number, (email, entry, source) in enumerate(zip(used, rendered, usage['sources']), 1):
+        assert entry.startswith(f"{number}:\n- From: {email['sender']}\n- Subject: {email['subject']}\n")
+        assert source['filename'] == email['filename'] and source['sender'] == email['sender']
+        assert source['tokens'] == count_tokens('\nEmail ' + entry.rstrip('\n'))
+    # Spock's emails come first, in input order
+    spock = [email['filename'] for email in emails if email['sender'].startswith('Spock')]
+    assert [email['filename'] for email in used[:len(spock)]] == spock
+    # Quoted history is stripped before it costs anything
+    assert 'Quoted history' not in context
+    assert any(source['trimmed'] for source in usage['sources'])
+
+    # A cap on the number of examples
+    _, usage, used = build_budgeted_context(emails, token_budget=100_000, max_emails=3)
+    assert len(used) == len(usage['sources']) == 3
+    assert [email['filename'] for email in used] == ['email_000.eml', 'email_001.eml', 'email_002.eml']
+
+    context, usage, used = build_budgeted_context([])
+    assert used == [] and usage['used'] == 0 and context
+    print("✅ returned emails match the context")
+
+if __name__ == "__main__":
+    test_budget_respected()
+    test_returned_emails_match_context()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Test email chunking: token budgets, quoted replies, signatures and merging chunks back"""
+
+import os
+
+from llama_index.core.schema import Document, NodeWithScore
+from llama_index.core.utils import set_global_tokenizer
+
+from email_chunker import (
+    CHUNK_COUNT_KEY,
+    CHUNK_INDEX_KEY,
+    ELIDED_SEPARATOR,
+    PARENT_ID_KEY,
+    EmailNodeParser,
+    merge_chunks,
+)
+from email_text import count_tokens
+
+# Offline: whitespace tokens instead of tiktoken's downloaded vocabulary
+set_global_tokenizer(str.split)
+
+REPORT = '\n\n'.join(
+    [f"Paragraph {i}. The plasma injectors were recalibrated during shift {i}." for i in range(8)]
+    # One paragraph longer than any budget used here, split by sentence
+    + [' '.join(f"Sensor sweep {i} of the nebula found no anomalies." for i in range(20))]
+    + [f"Closing note {i} on the maintenance schedule." for i in range(3)]
+)
+
+QUOTED_REPLY = (
+    "Captain,\n\nThe repairs are complete. " + "All systems report nominal status. " * 8 + "\n\n"
+    "I recommend we resume our course at warp six.\n\n"
+    "--\nSpock\nScience Officer\n\n"
+    "On Mon, 1 Jan 2024, Kirk <kirk@enterprise.starfleet> wrote:\n"
+    "> How long until the repairs are done? " + "We are falling behind schedule. " * 8 + "\n"
+    "> Starfleet is waiting for our report.\n"
+)
+
+def normalized(text):
+    return ' '.join(text.split())
+
+def test_short_email_unchanged():
+    parser = EmailNodeParser(chunk_size=200)
+    text = "Captain,\n\nThe repairs are complete.\n\n--\nSpock\n"
+    # Under the budget the text is kept verbatim, signature included
+    assert parser.split_email(text, 200) == [text.strip()]
+    print("✅ short email unchanged")
+
+def test_budget_and_reassembly():
+    parser = EmailNodeParser(chunk_size=40, min_chunk_size=10)
+    for budget in (15, 25, 40):
+        chunks = parser.split_email(REPORT, budget)
+        assert len(chunks) > 1
+        sizes = [count_tokens(chunk) for chunk in chunks]
+        assert max(sizes) <= budget, (budget, sizes)
+        # Nothing is lost, duplicated or reordered
+        assert normalized(' '.join(chunks)) == normalized(REPORT)
+        # Paragraphs that fit are never cut in half
+        for i in range(8):
+            paragraph = f"Paragraph {i}. The plasma injectors were recalibrated during shift {i}."
+            assert any(paragraph in chunk for chunk in chunks), (budget, paragraph)
+    print("✅ budget and reassembly")
+
+def test_quoted_reply():
+    parser = EmailNodeParser(chunk_size=60, min_chunk_size=10)
+    chunks = parser.split_email(QUOTED_REPLY, 60)
+    assert all(count_tokens(chunk) <= 60 for chunk in chunks)
+    # The quoted history starts its own chunk instead of sharing one with the reply
+    quoted = [chunk for chunk in chunks if 'wrote:' in chunk]
+    assert len(quoted) == 1 and quoted[0].startswith('On Mon, 1 Jan 2024'), chunks
+    assert not any('> ' in chunk for chunk in chunks[:chunks.index(quoted[0])])
+    # The signature block is dropped; everything else survives in order
+    assert not any('Science Officer' in chunk for chunk in chunks)
+    without_signature = QUOTED_REPLY.replace("--\nSpock\nScience Officer\n\n", '')
+    assert normalized(' '.join(chunks)) == normalized(without_signature)
+    print("✅ quoted reply")
+
+def test_chunk_tokens_setting():
+    os.environ['OPENAI_API_KEY'] = 'test-key'
+    os.environ['CHUNK_TOKENS'] = '80'
+    try:
+        from vector_manager import configured_node_parser
+        parser = configured_node_parser()
+    finally:
+        del os.environ['CHUNK_TOKENS']
+    assert parser.chunk_size == 80
+
+    document = Document(text=REPORT, metadata={'subject': 'Maintenance report', 'sender_email': 'scotty@enterprise'})
+    nodes = parser.get_nodes_from_documents([document])
+    budget = parser._budget(document)
+    assert 0 < budget < 80 and len(nodes) > 1
+    # Chunk text plus the metadata sent with it stays within CHUNK_TOKENS
+    for index, node in enumerate(nodes):
+        assert count_tokens(node.get_content()) <= budget
+        assert node.metadata[PARENT_ID_KEY] == document.doc_id
+        assert node.metadata[CHUNK_INDEX_KEY] == index
+        assert node.metadata[CHUNK_COUNT_KEY] == len(nodes)
+        assert node.metadata['subject'] == 'Maintenance report'
+    assert normalized(' '.join(node.get_content() for node in nodes)) == normalized(REPORT)
+    print("✅ CHUNK_TOKENS budget")
+
+def test_merge_chunks():
+    parser = EmailNodeParser(chunk_size=40, min_chunk_size=10)
+    report = parser.get_nodes_from_documents([Document(text=REPORT, doc_id='report')])
+    other = parser.get_nodes_from_documents([Document(text="Short note.", doc_id='note')])
+    assert len(report) >= 4 and len(other) == 1
+
+    retrieved = [
+        NodeWithScore(node=report[3], score=0.5),
+        NodeWithScore(node=other[0], score=0.7),
+        NodeWithScore(node=report[0], score=0.9),
+        NodeWithScore(node=report[1], score=0.2),
+    ]
+    merged = merge_chunks(retrieved)
+    assert [node.node.metadata.get(PARENT_ID_KEY) for node in merged] == ['report', 'note']
+    # The email takes its best chunk's score and joins chunks in document order
+    assert merged[0].score == 0.9 and merged[1].score == 0.7
+    texts = [report[i].get_content() for i in (0, 1, 3)]
+    assert merged[0].node.get_content() == texts[0] + '\n\n' + texts[1] + ELIDED_SEPARATOR + texts[2]
+    assert merged[0].node.node_id == report[0].node_id
+    # The retrieved nodes themselves are left alone
+    assert report[0].get_content() == texts[0]
+    assert merged[1].node.get_content() == "Short note."
+    print("✅ merge chunks")
+
+if __name__ == "__main__":
+    test_short_email_unchanged()
+    test_budget_and_reassembly()
+    test_quoted_reply()
+    test_chunk_tokens_setting()
+    test_merge_chunks()
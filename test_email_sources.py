@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Test that a corrupt ZIP member is reported without stopping the other emails"""
+
+import io
+import zipfile
+
+from email_processor_simple import EmailProcessor
+from email_sources import close_email_files, iter_eml_from_zip
+from progress import ConsoleReporter
+
+def corrupt_zip() -> io.BytesIO:
+    # Three sample emails, the second with its compressed data scrambled
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for number in (1, 2, 3):
+            with open(f'sampleEmails/email_00{number}.eml', 'rb') as f:
+                archive.writestr(f'email_00{number}.eml', f.read())
+    data = bytearray(buffer.getvalue())
+    info = zipfile.ZipFile(io.BytesIO(bytes(data))).infolist()[1]
+    start = info.header_offset + 30 + len(info.filename) + len(info.extra)
+    for offset in range(start + 2, start + 40):
+        data[offset] ^= 0xFF
+    return io.BytesIO(bytes(data))
+
+def test_corrupt_member():
+    archive = zipfile.ZipFile(corrupt_zip())
+    files = list(iter_eml_from_zip(archive))
+    reporter = ConsoleReporter()
+    for parallel in (False, True):
+        parsed = EmailProcessor(reporter=reporter).parse_eml_files(files, parallel=parallel, max_workers=2)
+        assert [email['filename'] for email in parsed] == ['email_001.eml', 'email_002.eml', 'email_003.eml']
+        assert parsed[1]['subject'] == 'Error: email_002.eml', parsed[1]
+        assert not parsed[0]['subject'].startswith('Error') and not parsed[2]['subject'].startswith('Error')
+    assert reporter.warnings == 2
+
+    close_email_files(files)
+    assert archive.fp is None
+    print("✅ corrupt member")
+
+if __name__ == "__main__":
+    test_corrupt_member()
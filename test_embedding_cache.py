@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Test the embedding cache's LRU eviction and concurrent writers sharing one directory"""
+
+import multiprocessing
+import tempfile
+
+import numpy as np
+
+from embedding_cache import EmbeddingCacheStore, shared_store
+
+# Full-size vectors keep each write long enough for writers to overlap
+DIM = 1536
+
+def vector_for(key):
+    # Every key has its own recognisable vector, so a slot mix-up shows
+    seed = sum(key.encode())
+    return list(np.random.default_rng(seed).uniform(-1, 1, DIM).astype(np.float16).astype(np.float32))
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as path:
+        store = EmbeddingCacheStore(path, max_entries=4)
+        store.put_many({key: vector_for(key) for key in ['a', 'b', 'c', 'd']})
+        # Touch 'a' so 'b' is the least recently used
+        assert list(store.get_many(['a'])) == ['a']
+        store.put_many({'e': vector_for('e')})
+
+        found = store.get_many(['a', 'b', 'c', 'd', 'e'])
+        assert sorted(found) == ['a', 'c', 'd', 'e'], sorted(found)
+        assert store.evictions == 1 and len(store) == 4
+        for key, vector in found.items():
+            assert np.allclose(vector, vector_for(key)), key
+
+        # A second store on the same directory sees the same entries
+        reopened = EmbeddingCacheStore(path, max_entries=4)
+        assert sorted(reopened.get_many(['a', 'b', 'c', 'd', 'e'])) == ['a', 'c', 'd', 'e']
+    print("✅ eviction")
+
+def write_entries(path, prefix, barrier, batches=100):
+    # Runs in its own process with its own store, as ingestion and the app do
+    store = EmbeddingCacheStore(path, max_entries=64)
+    barrier.wait()
+    for batch in range(batches):
+        keys = [f"{prefix}-{batch}-{i}" for i in range(5)]
+        store.put_many({key: vector_for(key) for key in keys})
+        store.get_many(keys[:2])
+
+def test_concurrent_writers():
+    with tempfile.TemporaryDirectory() as path:
+        # More keys than slots, so the writers also evict each other's entries
+        barrier = multiprocessing.Barrier(6)
+        workers = [multiprocessing.Process(target=write_entries, args=(path, name, barrier)) for name in 'uvwxyz']
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert all(worker.exitcode == 0 for worker in workers), [worker.exitcode for worker in workers]
+
+        store = EmbeddingCacheStore(path, max_entries=64)
+        rows = store.conn.execute("SELECT key, slot FROM entries").fetchall()
+        assert len(rows) == 64 and len({slot for _, slot in rows}) == 64, rows
+        found = store.get_many([key for key, _ in rows])
+        wrong = [key for key, vector in found.items() if not np.allclose(vector, vector_for(key))]
+        assert not wrong, f"{len(wrong)} keys map to another text's vector"
+    print("✅ concurrent writers")
+
+def test_shared_store():
+    with tempfile.TemporaryDirectory() as path:
+        assert shared_store(path) is shared_store(path + '/')
+    print("✅ shared store")
+
+if __name__ == "__main__":
+    test_eviction()
+    test_concurrent_writers()
+    test_shared_store()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Test the embedding executor against a fake client that answers 429 when overloaded"""
+
+import asyncio
+import hashlib
+
+from embedding_executor import EmbeddingExecutor, ScheduledEmbedding
+
+class StatusError(Exception):
+    """Shaped like openai's APIStatusError: a status code and response headers"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.response = type('Response', (), {'headers': headers})()
+
+def fake_vector(text):
+    return [byte / 255.0 for byte in hashlib.sha256(text.encode()).digest()[:4]]
+
+class FakeClient:
+    """Accepts ``capacity`` concurrent requests and rejects the rest with 429"""
+
+    def __init__(self, capacity, latency=0.01, retry_after=0.02):
+        self.capacity = capacity
+        self.latency = latency
+        self.retry_after = retry_after
+        self.executor = None
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self.rejected = 0
+        self.concurrency_seen = []
+
+    async def __call__(self, texts):
+        self.calls += 1
+        self.concurrency_seen.append(self.executor.concurrency)
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise StatusError(429, self.retry_after)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return [fake_vector(text) for text in texts]
+        finally:
+            self.in_flight -= 1
+
+def make_executor(client, **kwargs):
+    executor = EmbeddingExecutor(client, batch_size=5, max_concurrency=8, base_delay=0.01,
+                                 token_counter=len, **kwargs)
+    client.executor = executor
+    return executor
+
+def test_backoff_on_429():
+    client = FakeClient(capacity=2)
+    executor = make_executor(client)
+    texts = [f"email {i}" for i in range(200)]
+    try:
+        vectors = executor.embed(texts)
+    finally:
+        executor.close()
+
+    # Every batch eventually succeeds, and vectors come back in input order
+    assert vectors == [fake_vector(text) for text in texts]
+    assert executor.stats['requests'] == 40 and executor.stats['texts'] == 200
+    assert client.peak <= client.capacity
+
+    # The 429s halved the concurrency instead of retrying at full width
+    assert client.rejected > 0 and executor.stats['rate_limited'] == client.rejected
+    assert executor.stats['retries'] == client.rejected
+    assert min(client.concurrency_seen) <= executor.max_concurrency / 2, min(client.concurrency_seen)
+    assert 1.0 <= executor.concurrency <= executor.max_concurrency
+    # Once settled, most requests are accepted
+    assert client.rejected < client.calls / 2, (client.rejected, client.calls)
+    print(f"✅ backoff on 429 ({client.rejected} rejected of {client.calls} calls, "
+          f"concurrency down to {min(client.concurrency_seen):.1f})")
+
+def test_concurrency_recovers():
+    client = FakeClient(capacity=1)
+    executor = make_executor(client)
+    try:
+        executor.embed([f"first {i}" for i in range(100)])
+        after_overload = executor.concurrency
+        # A server with room again: successes grow the window back additively
+        client.capacity = 100
+        executor.embed([f"second {i}" for i in range(400)])
+    finally:
+        executor.close()
+    assert after_overload < executor.max_concurrency
+    assert executor.concurrency > after_overload + 1, (after_overload, executor.concurrency)
+    print(f"✅ concurrency recovers ({after_overload:.1f} -> {executor.concurrency:.1f})")
+
+def test_errors_propagate():
+    async def bad_request(texts):
+        raise StatusError(400)
+
+    executor = EmbeddingExecutor(bad_request, batch_size=5, base_delay=0.01, token_counter=len)
+    try:
+        executor.embed(["hello"])
+        raise AssertionError("expected the 400 to be raised")
+    except StatusError as e:
+        assert e.status_code == 400
+    # Not retryable, so it was tried once
+    assert executor.stats['retries'] == 0
+    executor.close()
+
+    # A 429 that never clears gives up after max_retries
+    client = FakeClient(capacity=0, retry_after=0.001)
+    executor = make_executor(client, max_retries=3)
+    try:
+        executor.embed(["hello"])
+        raise AssertionError("expected the 429 to be raised")
+    except StatusError as e:
+        assert e.status_code == 429
+    finally:
+        executor.close()
+    assert client.calls == 4 and executor.stats['retries'] == 3
+    print("✅ errors propagate")
+
+def test_scheduled_embedding():
+    client = FakeClient(capacity=3)
+    executor = make_executor(client)
+    model = ScheduledEmbedding(executor)
+    texts = [f"chunk {i}" for i in range(60)]
+    try:
+        assert model.get_text_embedding_batch(texts) == [fake_vector(text) for text in texts]
+        assert asyncio.run(model.aget_text_embedding_batch(texts)) == [fake_vector(text) for text in texts]
+        assert model.get_query_embedding("query") == fake_vector("query")
+    finally:
+        executor.close()
+    print("✅ scheduled embedding")
+
+if __name__ == "__main__":
+    test_backoff_on_429()
+    test_concurrency_recovers()
+    test_errors_propagate()
+    test_scheduled_embedding()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Test the local vector store: exact vs IVF search, persistence, upserts, deletes and filters"""
+
+import tempfile
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+)
+
+from local_vector_store import LocalVectorStore
+
+DIM = 32
+
+def make_nodes(count, seed=0, prefix='n'):
+    rng = np.random.default_rng(seed)
+    return [
+        TextNode(
+            id_=f"{prefix}{i}",
+            text=f"text {i}",
+            metadata={'sender_email': f"user{i % 5}@example.com", 'date_ts': 1_700_000_000 + i},
+            embedding=rng.normal(size=DIM).tolist(),
+        )
+        for i in range(count)
+    ]
+
+def query(store, vector, top_k=5, filters=None):
+    return store.query(VectorStoreQuery(query_embedding=list(vector), similarity_top_k=top_k, filters=filters))
+
+def test_exact_vs_ivf():
+    nodes = make_nodes(2000)
+    exact = LocalVectorStore(index_type='flat')
+    ivf = LocalVectorStore(index_type='ivf', n_probe=8)
+    # Added in batches so IVF exercises both training and incremental assignment
+    for start in range(0, len(nodes), 500):
+        exact.add(nodes[start:start + 500])
+        ivf.add(nodes[start:start + 500])
+    assert exact.count() == ivf.count() == 2000
+    assert ivf._centroids is not None and exact._centroids is None
+
+    rng = np.random.default_rng(1)
+    recall = []
+    for _ in range(20):
+        vector = rng.normal(size=DIM)
+        expected = query(exact, vector, top_k=10)
+        found = query(ivf, vector, top_k=10)
+        # Similarities are sorted and every IVF hit scores as exact search would
+        assert found.similarities == sorted(found.similarities, reverse=True)
+        scores = dict(zip(expected.ids, expected.similarities))
+        for node_id, similarity in zip(found.ids, found.similarities):
+            if node_id in scores:
+                assert abs(scores[node_id] - similarity) < 1e-5
+        recall.append(len(set(found.ids) & set(expected.ids)) / 10)
+
+    # A stored vector is its own nearest neighbour either way
+    probe = nodes[123].embedding
+    assert query(exact, probe, top_k=1).ids == ['n123']
+    assert query(ivf, probe, top_k=1).ids == ['n123']
+    assert np.mean(recall) >= 0.5, recall
+    print(f"✅ exact vs IVF (recall@10 {np.mean(recall):.2f})")
+
+def test_persist_round_trip():
+    with tempfile.TemporaryDirectory() as path:
+        for index_type in ('flat', 'ivf'):
+            store = LocalVectorStore(persist_dir=path, index_type=index_type)
+            store.add(make_nodes(300))
+            store.persist()
+
+            loaded = LocalVectorStore.from_persist_dir(path, index_type=index_type)
+            assert loaded.count() == 300
+            vector = np.random.default_rng(2).normal(size=DIM)
+            before, after = query(store, vector), query(loaded, vector)
+            assert before.ids == after.ids
+            assert np.allclose(before.similarities, after.similarities)
+            assert after.nodes[0].get_content() == before.nodes[0].get_content()
+            assert after.nodes[0].metadata == before.nodes[0].metadata
+
+            # The reloaded store keeps growing from where it was saved
+            loaded.add(make_nodes(10, seed=3, prefix='extra'))
+            assert loaded.count() == 310
+            assert query(loaded, make_nodes(10, seed=3, prefix='extra')[4].embedding, top_k=1).ids == ['extra4']
+
+        # An empty directory is an empty store
+        with tempfile.TemporaryDirectory() as empty:
+            assert LocalVectorStore.from_persist_dir(empty).count() == 0
+    print("✅ persist round trip")
+
+def test_upsert_and_delete():
+    store = LocalVectorStore(index_type='flat')
+    nodes = make_nodes(50)
+    store.add(nodes)
+
+    # Re-adding an ID replaces its vector and metadata instead of duplicating it
+    replacement = TextNode(id_='n7', text='replaced', metadata={'sender_email': 'new@example.com'},
+                           embedding=nodes[30].embedding)
+    store.add([replacement])
+    assert store.count() == 50
+    found = query(store, nodes[30].embedding, top_k=2)
+    assert set(found.ids) == {'n7', 'n30'}
+    assert store.get_metadata(['n7'])['n7']['sender_email'] == 'new@example.com'
+    assert query(store, nodes[7].embedding, top_k=1).ids != ['n7']
+
+    # The same ID twice in one call is stored once, from the last node
+    store.add([TextNode(id_='dup', text='first', embedding=nodes[1].embedding),
+               TextNode(id_='dup', text='second', embedding=nodes[2].embedding)])
+    assert store.count() == 51
+    assert set(query(store, nodes[2].embedding, top_k=2).ids) == {'dup', 'n2'}
+    assert 'dup' not in query(store, nodes[1].embedding, top_k=2).ids
+
+    store.delete_nodes(['n0', 'n1', 'missing'])
+    assert store.count() == 49
+    assert not store.get_metadata(['n0', 'n1'])
+    remaining = set(query(store, nodes[1].embedding, top_k=49).ids)
+    assert 'n0' not in remaining and 'n1' not in remaining and len(remaining) == 49
+    assert sum(len(page) for page in store.list_ids(prefix='n')) == 48
+    print("✅ upsert and delete")
+
+def test_metadata_filters():
+    store = LocalVectorStore(index_type='flat')
+    nodes = make_nodes(100)
+    store.add(nodes)
+    vector = nodes[0].embedding
+
+    sender = MetadataFilters(filters=[MetadataFilter(key='sender_email', value='user2@example.com')])
+    found = query(store, vector, top_k=100, filters=sender)
+    assert len(found.ids) == 20 and all(node.metadata['sender_email'] == 'user2@example.com' for node in found.nodes)
+
+    since = MetadataFilters(filters=[
+        MetadataFilter(key='sender_email', value='user2@example.com', operator=FilterOperator.NE),
+        MetadataFilter(key='date_ts', value=1_700_000_090, operator=FilterOperator.GTE),
+    ])
+    found = query(store, vector, top_k=100, filters=since)
+    assert sorted(found.ids) == sorted(f"n{i}" for i in range(90, 100) if i % 5 != 2)
+
+    # Keys outside the filter columns go through the per-record check
+    text = MetadataFilters(filters=[MetadataFilter(key='missing', value='x')])
+    assert query(store, vector, filters=text).ids == []
+    print("✅ metadata filters")
+
+if __name__ == "__main__":
+    test_exact_vs_ivf()
+    test_persist_round_trip()
+    test_upsert_and_delete()
+    test_metadata_filters()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Test bulk Pinecone upserts against a stub index: batching, parallel requests and failures"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from llama_index.core.schema import TextNode
+
+from pinecone_writer import (
+    MAX_BATCH_VECTORS,
+    BulkPineconeVectorStore,
+    BulkUpsertWriter,
+    entry_size,
+    pack_batches,
+)
+
+def make_entries(count, dim=8, prefix='v'):
+    return [{'id': f"{prefix}{i}", 'values': [i / 7.0] * dim, 'metadata': {'sender_email': f"user{i}@example.com"}}
+            for i in range(count)]
+
+class StubIndex:
+    """Answers ``upsert(async_req=True)`` from a thread pool, like the Pinecone client"""
+
+    def __init__(self, latency=0.01, fail_batch=None, pool_threads=8):
+        self.latency = latency
+        self.fail_batch = fail_batch
+        self.pool = ThreadPoolExecutor(pool_threads)
+        self.batches = []
+        self.vectors = {}
+        self.namespaces = set()
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _upsert(self, number, vectors):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            if number == self.fail_batch:
+                raise RuntimeError(f"batch {number} rejected")
+            return SimpleNamespace(upserted_count=len(vectors))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def upsert(self, vectors, async_req=False, _check_type=True, namespace=None):
+        assert async_req and not _check_type
+        with self.lock:
+            number = len(self.batches)
+            self.batches.append([vector['id'] for vector in vectors])
+            self.vectors.update((vector['id'], vector) for vector in vectors)
+            self.namespaces.add(namespace)
+        future = self.pool.submit(self._upsert, number, vectors)
+        # The client's ApplyResult exposes get(), not result()
+        return SimpleNamespace(get=future.result)
+
+def test_pack_batches():
+    entries = make_entries(250)
+    batches = list(pack_batches(entries, max_vectors=100))
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    assert [entry['id'] for batch in batches for entry in batch] == [entry['id'] for entry in entries]
+
+    # The byte cap splits earlier, and the estimate never undercounts
+    for entry in entries:
+        assert entry_size(entry) >= len(json.dumps(entry))
+    max_bytes = entry_size(entries[0]) * 10
+    batches = list(pack_batches(entries, max_vectors=100, max_bytes=max_bytes))
+    assert all(sum(entry_size(entry) for entry in batch) <= max_bytes for batch in batches)
+    assert sum(len(batch) for batch in batches) == 250 and len(batches) >= 25
+
+    # An entry over the byte cap goes alone rather than being dropped
+    huge = make_entries(1, dim=5000, prefix='huge')[0]
+    batches = list(pack_batches(entries[:3] + [huge] + entries[3:6], max_bytes=max_bytes))
+    assert [[entry['id'] for entry in batch] for batch in batches] == [['v0', 'v1', 'v2'], ['huge0'], ['v3', 'v4', 'v5']]
+    assert list(pack_batches([])) == []
+    print("✅ pack batches")
+
+def test_parallel_upsert():
+    index = StubIndex()
+    writer = BulkUpsertWriter(index, namespace='mail', workers=4, max_vectors=100)
+    entries = make_entries(2500)
+    start = time.perf_counter()
+    assert writer.write(entries) == 2500
+    elapsed = time.perf_counter() - start
+
+    assert len(index.batches) == 25 and all(len(batch) == 100 for batch in index.batches)
+    assert [vector_id for batch in index.batches for vector_id in batch] == [entry['id'] for entry in entries]
+    assert index.namespaces == {'mail'}
+    # Up to ``workers`` requests overlap, never more
+    assert 1 < index.peak <= 4, index.peak
+    assert elapsed < 25 * index.latency, elapsed
+    assert writer.requests == 25 and writer.upserted == 2500
+
+    # Totals accumulate across calls; caps above Pinecone's are clamped
+    writer.write(make_entries(10, prefix='extra'))
+    assert writer.requests == 26 and writer.upserted == 2510
+    assert BulkUpsertWriter(index, max_vectors=5000).max_vectors == MAX_BATCH_VECTORS
+    print(f"✅ parallel upsert (peak {index.peak} in flight)")
+
+def test_failed_batch():
+    index = StubIndex(latency=0.02, fail_batch=2)
+    writer = BulkUpsertWriter(index, workers=3, max_vectors=10)
+    try:
+        writer.write(make_entries(200))
+        raise AssertionError("expected the failed batch to be raised")
+    except RuntimeError as e:
+        assert str(e) == "batch 2 rejected"
+    # Requests already in flight settled before raising, and no new ones were sent
+    assert index.in_flight == 0
+    assert len(index.batches) < 20, len(index.batches)
+    # Acknowledged batches are still counted
+    assert writer.requests == len(index.batches)
+    assert writer.upserted == 10 * (len(index.batches) - 1)
+    print("✅ failed batch")
+
+def test_vector_store_add():
+    index = StubIndex()
+    store = BulkPineconeVectorStore(pinecone_index=index, workers=2, max_vectors=4)
+    nodes = [TextNode(id_=f"n{i}", text=f"text {i}", metadata={'subject': f"Subject {i}"}, embedding=[0.1 * i] * 8)
+             for i in range(10)]
+    assert store.add(nodes) == [node.node_id for node in nodes]
+    assert [len(batch) for batch in index.batches] == [4, 4, 2]
+    assert store.writer.upserted == 10
+    # Metadata carries the node for retrieval, without a second copy of its embedding
+    sent = index.vectors['n3']
+    assert sent['values'] == nodes[3].embedding and sent['metadata']['subject'] == 'Subject 3'
+    stored = json.loads(sent['metadata']['_node_content'])
+    assert stored['id_'] == 'n3' and stored['embedding'] is None
+    print("✅ vector store add")
+
+if __name__ == "__main__":
+    test_pack_batches()
+    test_parallel_upsert()
+    test_failed_batch()
+    test_vector_store_add()
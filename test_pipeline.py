@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Test the streaming ingestion pipeline on the local backend with a fake embedder"""
+
+import hashlib
+import os
+import random
+import tempfile
+import threading
+
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.utils import set_global_tokenizer
+
+from email_chunker import EmailNodeParser
+from email_processor_simple import EmailProcessor
+from email_sources import PathEMLFile, iter_eml_from_dir
+from pipeline import run_ingestion_pipeline
+from progress import ConsoleReporter
+
+# Offline: whitespace tokens instead of tiktoken's downloaded vocabulary
+set_global_tokenizer(str.split)
+
+# The embed stage runs several threads
+COUNT_LOCK = threading.Lock()
+
+class FakeEmbedding(MockEmbedding):
+    """Deterministic vectors per text, counting the texts it was asked for"""
+
+    texts: int = 0
+    fail_after: int = -1
+
+    def _get_vector(self, text):
+        rng = random.Random(hashlib.md5(text.encode()).hexdigest())
+        return [rng.uniform(-1, 1) for _ in range(self.embed_dim)]
+
+    def _get_text_embedding(self, text):
+        with COUNT_LOCK:
+            if self.fail_after >= 0 and self.texts >= self.fail_after:
+                raise RuntimeError("embedding service down")
+            self.texts += 1
+        return self._get_vector(text)
+
+    def _get_query_embedding(self, query):
+        return self._get_vector(query)
+
+class UnreadableFile:
+    name = 'unreadable.eml'
+
+    def read(self):
+        raise OSError("device not ready")
+
+def write_email(path, message_id, body):
+    with open(path, 'w') as f:
+        f.write(
+            f"From: Jean-Luc Picard <picard@enterprise.starfleet>\n"
+            f"To: riker@enterprise.starfleet\n"
+            f"Subject: Long report\n"
+            f"Date: Mon, 1 Jan 2024 09:00:00 +0000\n"
+            f"Message-ID: <{message_id}>\n\n{body}\n"
+        )
+
+def make_manager(index_dir, embedding=None):
+    os.environ['OPENAI_API_KEY'] = 'test-key'
+    os.environ['LOCAL_INDEX_DIR'] = index_dir
+    from vector_manager import VectorManager, chunk_id
+    manager = VectorManager(backend='local', reporter=ConsoleReporter())
+    manager.embedding_model = embedding or FakeEmbedding(embed_dim=16)
+    # Small chunks, so the long test email is split
+    manager.node_parser = EmailNodeParser(chunk_size=64, id_func=chunk_id)
+    return manager
+
+def ingest(files, manager, **kwargs):
+    processor = EmailProcessor(reporter=ConsoleReporter())
+    return run_ingestion_pipeline(files, processor, manager, batch_size=5,
+                                  reporter=ConsoleReporter(), **kwargs)
+
+def test_summary_and_rerun():
+    samples = list(iter_eml_from_dir('sampleEmails'))
+    # One email twice and one file that cannot be read
+    files = samples + [samples[0], UnreadableFile()]
+    with tempfile.TemporaryDirectory() as index_dir:
+        manager = make_manager(index_dir)
+        summary = ingest(files, manager)
+        assert summary['emails'] == len(samples) + 2, summary
+        assert summary['parse_errors'] == 1, summary
+        assert summary['duplicates'] == 1, summary
+        assert summary['skipped'] == 0 and summary['stale_chunks'] == 0, summary
+        # Sample emails and the error record are indexed once each
+        store = summary['vector_store']
+        parents = {record['parent_id'] for record in store.get_metadata(list(store._ids)).values()}
+        assert len(parents) == len(samples) + 1, len(parents)
+        embedded = manager.embedding_model.texts
+        assert embedded == store.count()
+
+        stages = {stats['stage']: stats for stats in summary['stages']}
+        assert stages['clean']['items'] == len(samples) + 1
+        assert stages['embed']['items'] == stages['upsert']['items'] == store.count()
+
+        # A second run against the persisted index embeds nothing
+        manager = make_manager(index_dir)
+        summary = ingest(files, manager)
+        assert summary['skipped'] == len(samples) + 1, summary
+        assert summary['duplicates'] == 1 and summary['parse_errors'] == 1, summary
+        assert manager.embedding_model.texts == 0
+        assert summary['vector_store'].count() == embedded
+    print("✅ summary counts and re-run")
+
+def test_stale_chunks():
+    with tempfile.TemporaryDirectory() as mail_dir, tempfile.TemporaryDirectory() as index_dir:
+        path = os.path.join(mail_dir, 'report.eml')
+        paragraphs = [f"Paragraph {i} of the report. " + "Sensor readings were nominal. " * 12 for i in range(6)]
+        write_email(path, 'report@enterprise', '\n\n'.join(paragraphs))
+        summary = ingest([PathEMLFile(path)], make_manager(index_dir))
+        chunks = summary['vector_store'].count()
+        assert chunks > 1, chunks
+
+        # The same Message-ID with a shorter body replaces every old chunk
+        write_email(path, 'report@enterprise', "Short correction.")
+        summary = ingest([PathEMLFile(path)], make_manager(index_dir))
+        assert summary['stale_chunks'] == chunks - 1, summary
+        assert summary['vector_store'].count() == 1
+    print("✅ stale chunks")
+
+def test_error_drains_queues():
+    files = list(iter_eml_from_dir('sampleEmails'))
+    with tempfile.TemporaryDirectory() as index_dir:
+        manager = make_manager(index_dir, FakeEmbedding(embed_dim=16, fail_after=3))
+        before = set(threading.enumerate())
+        outcome = {}
+
+        def run():
+            try:
+                ingest(files, manager, queue_size=1)
+            except RuntimeError as e:
+                outcome['error'] = str(e)
+
+        runner = threading.Thread(target=run, daemon=True)
+        runner.start()
+        runner.join(timeout=60)
+        assert not runner.is_alive(), "pipeline hung after a stage failed"
+        assert outcome.get('error') == "embedding service down", outcome
+        leftover = [thread.name for thread in set(threading.enumerate()) - before
+                    if thread.name.startswith('pipeline-')]
+        assert not leftover, leftover
+    print("✅ error drains queues")
+
+if __name__ == "__main__":
+    test_summary_and_rerun()
+    test_stale_chunks()
+    test_error_drains_queues()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Test retrieval scopes, date ranges and sender filters on Pinecone and the local store"""
+
+from types import SimpleNamespace
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from llama_index.vector_stores.pinecone.base import _to_pinecone_filter
+
+from local_vector_store import LocalVectorStore
+from pinecone_writer import BulkPineconeVectorStore
+from retrieval_filters import filter_metadata, scope_filters
+
+NOW = 1_700_000_000
+DAY = 86400
+USER = 'me@corp.com'
+
+# (id, From header, days ago or None when the date did not parse)
+EMAILS = [
+    ('mine-recent', 'Me <me@corp.com>', 10),
+    ('mine-old', 'me@corp.com', 100),
+    ('mine-undated', 'Me <ME@corp.com>', None),
+    ('alice-recent', 'Alice <alice@partner.org>', 5),
+    ('alice-old', '"Smith, Alice" <alice@partner.org>', 200),
+    ('bob', 'bob@partner.org', 20),
+    ('carol', 'Carol <carol@other.net>', 1),
+]
+ALL = {email_id for email_id, _, _ in EMAILS}
+
+# Scope arguments and the emails each should retrieve
+CASES = [
+    (('mine', 'alice@partner.org', USER), {'mine-recent', 'mine-old', 'mine-undated'}),
+    (('mine', 'alice@partner.org', USER, 30), {'mine-recent'}),
+    (('sender', 'Alice <Alice@Partner.org>', USER), {'alice-recent', 'alice-old'}),
+    (('sender', 'alice@partner.org', USER, 30), {'alice-recent'}),
+    (('domain', 'carol@partner.org', USER), {'alice-recent', 'alice-old', 'bob'}),
+    (('domain', 'carol@partner.org', USER, 15), {'alice-recent'}),
+    (('all', 'alice@partner.org', USER, 30), {'mine-recent', 'alice-recent', 'bob', 'carol'}),
+    (('all', 'alice@partner.org', USER), ALL),
+    # Without a known user 'mine' cannot filter and searches everything
+    (('mine', 'alice@partner.org', None), ALL),
+]
+
+def metadata(sender, days_ago):
+    date_ts = NOW - days_ago * DAY if days_ago is not None else None
+    return filter_metadata({'from': sender, 'date_ts': date_ts})
+
+def filters_for(args):
+    scope, sender, user, *days = args
+    return scope_filters(scope, sender, user, days=days[0] if days else None, now=NOW)
+
+class StubIndex:
+    """Pinecone index stand-in that evaluates the filter dicts it is queried with"""
+
+    OPERATORS = {
+        '$eq': lambda value, target: value == target,
+        '$ne': lambda value, target: value != target,
+        '$gte': lambda value, target: value is not None and value >= target,
+        '$lte': lambda value, target: value is not None and value <= target,
+    }
+
+    def __init__(self, records):
+        self.records = records
+        self.filters = []
+
+    def matches(self, record, condition):
+        if '$and' in condition:
+            return all(self.matches(record, part) for part in condition['$and'])
+        return all(
+            all(self.OPERATORS[op](record.get(key), target) for op, target in spec.items())
+            if isinstance(spec, dict) else record.get(key) == spec
+            for key, spec in condition.items()
+        )
+
+    def query(self, vector, top_k, filter, **kwargs):
+        self.filters.append(filter)
+        hits = [SimpleNamespace(id=record_id, score=1.0, values=vector,
+                                metadata={**record, 'text': record_id, 'doc_id': record_id})
+                for record_id, record in self.records.items() if self.matches(record, filter)]
+        return SimpleNamespace(matches=hits[:top_k])
+
+def query(store, filters):
+    result = store.query(VectorStoreQuery(query_embedding=[0.1] * 8, similarity_top_k=100, filters=filters))
+    return set(result.ids)
+
+def test_scope_filters():
+    mine = filters_for(('mine', 'alice@partner.org', USER, 30))
+    assert [(f.key, f.operator.value, f.value) for f in mine.filters] == [
+        ('sender_email', '==', USER), ('date_ts', '>=', NOW - 30 * DAY)
+    ]
+    sender = filters_for(('sender', '"Smith, Alice" <Alice@Partner.org>', USER))
+    assert [(f.key, f.value) for f in sender.filters] == [('sender_email', 'alice@partner.org')]
+    domain = filters_for(('domain', 'carol@partner.org', USER))
+    assert [(f.key, f.value) for f in domain.filters] == [('sender_domain', 'partner.org')]
+    assert filters_for(('all', 'alice@partner.org', USER)) is None
+    assert filters_for(('mine', 'alice@partner.org', None)) is None
+    # A sender without an address has nothing to filter on
+    assert filters_for(('domain', '', USER)) is None
+
+    # Unparsed dates are left out, so date ranges exclude those emails
+    assert 'date_ts' not in metadata('me@corp.com', None)
+    assert metadata('Me <ME@corp.com>', 3) == {
+        'sender_email': 'me@corp.com', 'sender_domain': 'corp.com', 'date_ts': NOW - 3 * DAY
+    }
+    print("✅ scope filters")
+
+def test_pinecone_translation():
+    assert _to_pinecone_filter(filters_for(('mine', 'alice@partner.org', USER))) == {
+        'sender_email': {'$eq': USER}
+    }
+    assert _to_pinecone_filter(filters_for(('sender', 'alice@partner.org', USER, 30))) == {
+        '$and': [{'sender_email': {'$eq': 'alice@partner.org'}}, {'date_ts': {'$gte': NOW - 30 * DAY}}]
+    }
+    assert _to_pinecone_filter(filters_for(('all', 'alice@partner.org', USER, 7))) == {
+        'date_ts': {'$gte': NOW - 7 * DAY}
+    }
+
+    # Queried through the vector store, the index sees those dicts and returns the scoped emails
+    index = StubIndex({email_id: metadata(sender, days) for email_id, sender, days in EMAILS})
+    store = BulkPineconeVectorStore(pinecone_index=index)
+    for args, expected in CASES:
+        assert query(store, filters_for(args)) == expected, args
+    assert index.filters[0] == {'sender_email': {'$eq': USER}}
+    assert index.filters[-1] == {}
+    print("✅ Pinecone filter translation")
+
+def test_local_store():
+    rng = np.random.default_rng(0)
+    store = LocalVectorStore(index_type='flat')
+    store.add([
+        TextNode(id_=email_id, text=email_id, metadata=metadata(sender, days),
+                 embedding=rng.normal(size=8).tolist())
+        for email_id, sender, days in EMAILS
+    ])
+    for args, expected in CASES:
+        assert query(store, filters_for(args)) == expected, args
+    print("✅ local store filters")
+
+if __name__ == "__main__":
+    test_scope_filters()
+    test_pinecone_translation()
+    test_local_store()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Test search box query parsing, FTS5 search over the sample emails and keyword-only RAG"""
+
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.utils import set_global_tokenizer
+
+from email_corpus import EmailCorpus
+from email_processor_simple import EmailProcessor
+from email_sources import iter_eml_from_dir
+from progress import ConsoleReporter
+from search_index import FullTextIndex, fts5_available, keyword_expression, parse_query
+
+# Offline: whitespace tokens instead of tiktoken's downloaded vocabulary
+set_global_tokenizer(str.split)
+
+def sample_corpus() -> EmailCorpus:
+    files = list(iter_eml_from_dir('sampleEmails'))
+    return EmailCorpus.from_records(EmailProcessor(reporter=ConsoleReporter()).parse_eml_files(files))
+
+def test_parse_query():
+    assert parse_query('warp drive') == '"warp" AND "drive"'
+    # Field prefixes map to columns, case-insensitively
+    assert parse_query('from:spock') == 'sender : "spock"'
+    assert parse_query('Subject:warp body:efficiency') == 'subject : "warp" AND body : "efficiency"'
+    # Quoted phrases stay together, with or without a field
+    assert parse_query('"neutral zone"') == '"neutral zone"'
+    assert parse_query('subject:"neutral zone" romulan') == 'subject : "neutral zone" AND "romulan"'
+    # A trailing * is a prefix match; inside a phrase it is dropped
+    assert parse_query('calibrat*') == '"calibrat"*'
+    assert parse_query('"calibrat*"') == '"calibrat"'
+    # Unknown fields are searched verbatim rather than as FTS5 columns
+    assert parse_query('10:30') == '"10:30"'
+    assert parse_query('cc:riker') == '"cc:riker"'
+    # FTS5 operators and punctuation are quoted, never interpreted
+    assert parse_query('warp AND NOT drive') == '"warp" AND "AND" AND "NOT" AND "drive"'
+    assert parse_query('NEAR(warp drive)') == '"NEAR(warp" AND "drive)"'
+    # A stray quote is doubled inside the quoted term
+    assert parse_query('say "hi') == '"say" AND """hi"'
+    assert parse_query('col:^x') == '"col:^x"'
+    # Nothing searchable
+    assert parse_query('') is None and parse_query(None) is None
+    assert parse_query('* - "" ()') is None
+    print("✅ parse_query")
+
+def test_search_samples():
+    assert fts5_available(), "SQLite without FTS5"
+    corpus = sample_corpus()
+    index = FullTextIndex(corpus)
+
+    results = index.search('warp')
+    subjects = [corpus[hit['position']]['subject'] for hit in results['hits']]
+    assert results['total'] >= 1 and 'Warp Drive Efficiency Optimization Proposal' in subjects
+    # Subject matches are weighted above body-only ones
+    assert subjects[0] == 'Warp Drive Efficiency Optimization Proposal', subjects
+
+    assert index.search('subject:"neutral zone"')['total'] == 1
+    assert index.search('from:spock')['total'] == len(corpus)
+    assert index.search('from:picard')['total'] == 0
+    prefix = index.search('subject:anal*')
+    assert prefix['total'] >= 3 and all('anal' in corpus[hit['position']]['subject'].lower() for hit in prefix['hits'])
+
+    # Paging: totals stay the same and pages do not overlap
+    first, second = index.search('the', limit=5), index.search('the', limit=5, offset=5)
+    assert first['total'] == second['total'] > 5
+    assert not {hit['position'] for hit in first['hits']} & {hit['position'] for hit in second['hits']}
+
+    # Hostile input never reaches FTS5 as syntax
+    for query in ('NEAR(', '"unbalanced', 'AND OR NOT', 'x:y:z', '^', 'subject:'):
+        assert isinstance(index.search(query)['total'], int)
+
+    # Free-text ranking for retrieval ORs the distinctive terms
+    assert keyword_expression('The Romulan ships near the Neutral Zone') is not None
+    ranked = index.rank('Romulan activity near the Neutral Zone', limit=3)
+    assert corpus[ranked[0][0]]['subject'] == 'Strategic Analysis - Romulan Neutral Zone Activity'
+    print("✅ search over sample emails")
+
+def test_keyword_only_rag():
+    from response_generator import ResponseGenerator
+
+    corpus = sample_corpus()
+    generator = ResponseGenerator.__new__(ResponseGenerator)
+    generator.llm = MockLLM()
+    result = generator.generate_response(
+        "Your warp drive efficiency proposal raised questions about the plasma injectors.",
+        'kirk@enterprise.starfleet',
+        None,
+        text_index=FullTextIndex(corpus),
+        parsed_emails=corpus
+    )
+    assert result['success'], result
+    assert result['mode'] == 'Keyword RAG (no embeddings)'
+    assert 'vector' not in result['retrieval_timings'] and 'lexical' in result['retrieval_timings']
+    subjects = [source['subject'] for source in result['sources']]
+    assert 'Warp Drive Efficiency Optimization Proposal' in subjects, subjects
+    assert len(subjects) == len(set(subjects))
+
+    # Without either index there is nothing to retrieve from
+    try:
+        generator.generate_response("Hello", 'kirk@enterprise.starfleet', None)
+        raise AssertionError("expected ValueError without any index")
+    except ValueError:
+        pass
+    print("✅ keyword-only RAG")
+
+if __name__ == "__main__":
+    test_parse_query()
+    test_search_samples()
+    test_keyword_only_rag()
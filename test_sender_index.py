@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Test sender lookups by address, display name and domain, and rebuilding on a new corpus"""
+
+from email_corpus import EmailCorpus
+from email_text import parse_date_header
+from response_generator import ResponseGenerator
+from sender_index import SenderIndex
+
+def make_email(sender, date, subject):
+    # The fields EmailProcessor fills in, dates parsed the same way
+    return {'filename': f"{subject}.eml", 'from': sender, 'subject': subject, 'date': date,
+            'date_ts': parse_date_header(date)[0], 'body': subject}
+
+EMAILS = [
+    make_email('Jean-Luc Picard <picard@enterprise.starfleet>', 'Mon, 1 Jan 2024 09:00:00 +0000', 'oldest'),
+    make_email('"Picard, Jean-Luc" <Picard@Enterprise.Starfleet>', 'Wed, 3 Jan 2024 09:00:00 +0000', 'newest'),
+    make_email('William Riker <riker@enterprise.starfleet>', 'Tue, 2 Jan 2024 09:00:00 +0000', 'riker'),
+    make_email('Jean-Luc Picard <picard@enterprise.starfleet>', 'not a date', 'undated'),
+    make_email('Q <q@continuum.net>, Jean-Luc Picard <picard@enterprise.starfleet>',
+               'Tue, 2 Jan 2024 12:00:00 +0000', 'both'),
+]
+
+def subjects(emails, positions):
+    return [emails[pos]['subject'] for pos in positions]
+
+def test_lookup():
+    for emails in (EMAILS, EmailCorpus.from_records(EMAILS)):
+        index = SenderIndex(emails)
+        newest_first = ['newest', 'both', 'oldest', 'undated']
+        # Addresses match case-insensitively, bare or inside a From header
+        assert subjects(emails, index.lookup('picard@enterprise.starfleet')) == newest_first
+        assert subjects(emails, index.lookup('PICARD@enterprise.starfleet')) == newest_first
+        assert subjects(emails, index.lookup('Captain <picard@enterprise.starfleet>')) == newest_first
+        # Display names, however they were quoted or spaced
+        assert subjects(emails, index.lookup('Jean-Luc Picard')) == ['both', 'oldest', 'undated']
+        assert subjects(emails, index.lookup('picard,  jean-luc')) == ['newest']
+        assert subjects(emails, index.lookup('William Riker')) == ['riker']
+        # Domains, with or without the @
+        assert subjects(emails, index.lookup('enterprise.starfleet')) == ['newest', 'both', 'riker', 'oldest', 'undated']
+        assert subjects(emails, index.lookup('@continuum.net')) == ['both']
+        # Every mailbox of a multi-address From header is indexed
+        assert subjects(emails, index.lookup('q@continuum.net')) == ['both']
+        assert index.lookup('data@enterprise.starfleet') == [] and index.lookup('') == []
+        assert subjects(emails, index.recent(2)) == ['newest', 'both']
+    print("✅ lookup by address, name and domain")
+
+def test_rebuild_on_corpus_change():
+    generator = ResponseGenerator.__new__(ResponseGenerator)
+    index = SenderIndex(EMAILS)
+    assert index.indexes(EMAILS)
+    found = generator.find_relevant_emails_direct('riker@enterprise.starfleet', EMAILS, sender_index=index)
+    assert [email['subject'] for email in found] == ['riker']
+
+    # A new upload of the same size is a different corpus
+    replacement = [make_email('Deanna Troi <troi@enterprise.starfleet>', email['date'], f"troi {i}")
+                   for i, email in enumerate(EMAILS)]
+    assert not index.indexes(replacement)
+    found = generator.find_relevant_emails_direct('troi@enterprise.starfleet', replacement, sender_index=index)
+    assert [email['subject'] for email in found] == ['troi 1', 'troi 4', 'troi 2', 'troi 0', 'troi 3']
+
+    # So is the same list after it grew
+    grown = list(EMAILS)
+    index = SenderIndex(grown)
+    grown.append(make_email('Data <data@enterprise.starfleet>', 'Thu, 4 Jan 2024 09:00:00 +0000', 'data'))
+    assert not index.indexes(grown)
+    found = generator.find_relevant_emails_direct('data@enterprise.starfleet', grown, sender_index=index)
+    assert [email['subject'] for email in found] == ['data']
+
+    # An unknown sender falls back to the newest emails of the current corpus
+    found = generator.find_relevant_emails_direct('worf@enterprise.starfleet', replacement, limit=2, sender_index=index)
+    assert [email['subject'] for email in found] == ['troi 1', 'troi 4']
+    print("✅ rebuild on corpus change")
+
+if __name__ == "__main__":
+    test_lookup()
+    test_rebuild_on_corpus_change()
@@ -2,11 +2,46 @@
 Secrets Manager for handling API keys and sensitive configuration
 """
 import os
-import streamlit as st
+import sys
 import logging
+import tomllib
+from functools import lru_cache
+from typing import Dict, Optional
 
 logger = logging.getLogger(__name__)
 
+# Where Streamlit looks for secrets.toml; later files override earlier ones
+SECRETS_FILE_PATHS = [
+    os.path.join(os.path.expanduser('~'), '.streamlit', 'secrets.toml'),
+    os.path.join(os.getcwd(), '.streamlit', 'secrets.toml'),
+]
+
+def streamlit_runtime():
+    """The streamlit module when running under ``streamlit run``, else None
+    
+    Scripts such as ingest.py never import Streamlit, so they get None
+    without paying for the import or its bare-mode warnings.
+    """
+    st = sys.modules.get('streamlit')
+    try:
+        return st if st is not None and st.runtime.exists() else None
+    except Exception:
+        return None
+
+@lru_cache(maxsize=1)
+def load_secrets_files() -> Dict:
+    """Merged contents of the secrets.toml files that exist, read once"""
+    secrets = {}
+    for path in SECRETS_FILE_PATHS:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'rb') as f:
+                secrets.update(tomllib.load(f))
+        except (OSError, tomllib.TOMLDecodeError) as e:
+            logger.warning(f"Could not read secrets file {path}: {str(e)}")
+    return secrets
+
 class SecretsManager:
     """Centralized secrets management for Streamlit deployment"""
     
@@ -28,31 +63,47 @@ class SecretsManager:
             logger.debug(f"Found {key} in environment variables")
             return value
         
-        # Try Streamlit secrets (for Streamlit Cloud)
-        try:
-            if hasattr(st, 'secrets'):
-                value = st.secrets.get(key)
-                if value:
-                    logger.debug(f"Found {key} in Streamlit secrets")
-                    return value
-        except Exception as e:
-            logger.warning(f"Error accessing Streamlit secrets for {key}: {str(e)}")
+        value = SecretsManager._secrets_value(key)
+        if value:
+            return value
         
-        # Return default or raise error
+        # Return default or raise error; optional settings are expected to
+        # fall back, so this is not worth a warning
         if default is not None:
-            logger.warning(f"Using default value for {key}")
+            logger.debug(f"Using default value for {key}")
             return default
         
         error_msg = f"Secret '{key}' not found in environment or Streamlit secrets"
         logger.error(error_msg)
         raise ValueError(error_msg)
     
+    @staticmethod
+    def _secrets_value(key: str) -> Optional[str]:
+        """``key`` from Streamlit secrets, or from secrets.toml outside a Streamlit run"""
+        st = streamlit_runtime()
+        if st is None:
+            value = load_secrets_files().get(key)
+            if value:
+                logger.debug(f"Found {key} in secrets.toml")
+            return value
+        
+        # Try Streamlit secrets (for Streamlit Cloud)
+        try:
+            value = st.secrets.get(key)
+            if value:
+                logger.debug(f"Found {key} in Streamlit secrets")
+                return value
+        except Exception as e:
+            logger.warning(f"Error accessing Streamlit secrets for {key}: {str(e)}")
+        return None
+    
     @staticmethod
     def get_openai_key() -> str:
         """Get OpenAI API key with proper error handling"""
         try:
             return SecretsManager.get_secret("OPENAI_API_KEY")
         except ValueError:
+            import streamlit as st
             st.error("❌ OpenAI API key not configured. Please add OPENAI_API_KEY to Streamlit secrets.")
             st.stop()
     
@@ -62,6 +113,7 @@ class SecretsManager:
         try:
             return SecretsManager.get_secret("PINECONE_API_KEY")
         except ValueError:
+            import streamlit as st
             st.error("❌ Pinecone API key not configured. Please add PINECONE_API_KEY to Streamlit secrets.")
             st.stop()
     
@@ -1,41 +1,232 @@
 from pinecone import Pinecone, ServerlessSpec
-from llama_index.core import VectorStoreIndex, Document
-from llama_index.vector_stores.pinecone import PineconeVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
-import streamlit as st
-from typing import List, Dict
+from llama_index.core import VectorStoreIndex, Document, StorageContext
+from llama_index.core.schema import MetadataMode
+from email_chunker import DEFAULT_CHUNK_TOKENS, EmailNodeParser
+from email_text import count_tokens
+from embedding_cache import CachedEmbedding
+from embedding_executor import (DEFAULT_BATCH_SIZE as DEFAULT_EMBEDDING_BATCH_SIZE,
+                                DEFAULT_MAX_CONCURRENCY, EmbeddingExecutor,
+                                ScheduledEmbedding, openai_embed_batch, shared_executor)
+from local_vector_store import LocalVectorStore, DEFAULT_LOCAL_INDEX_DIR
+from pinecone_writer import (DEFAULT_UPSERT_WORKERS, BulkPineconeVectorStore,
+                             cached_client, cached_index)
+from progress import ProgressReporter, StreamlitReporter
+from retrieval_filters import FILTER_METADATA_KEYS, filter_metadata
+from utils.secrets_manager import SecretsManager
+from typing import List, Dict, Iterator, Optional, Tuple
 import os
+import re
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
+def email_doc_id(email: Dict) -> str:
+    """Stable document ID for an email
+    
+    Derived from the Message-ID header when present, otherwise from the
+    content hash, so the same email maps to the same ID on every upload.
+    """
+    message_id = (email.get('message_id') or '').strip().strip('<>').lower()
+    if message_id:
+        return f"mid-{hashlib.md5(message_id.encode()).hexdigest()}"
+    return f"hash-{email['hash']}"
+
+def chunk_id(i: int, doc) -> str:
+    """Node ID for the i-th chunk of a document"""
+    return f"{doc.doc_id}#{i}"
+
+# Bump when the stored metadata changes, so incremental runs re-index
+# vectors written by an older version even if the email is unchanged
+INDEX_SCHEMA_VERSION = 4
+
+# Vectors written before IDs were deterministic carry random UUIDs instead
+CHUNK_ID_PATTERN = re.compile(r'^(mid|hash)-[0-9a-f]{32}#\d+$')
+
+# 'compact' embeds the body with sender and subject as metadata; 'legacy'
+# is the original banner template, with the headers repeated in the text
+DOCUMENT_TEMPLATES = ['compact', 'legacy']
+DEFAULT_DOCUMENT_TEMPLATE = 'compact'
+
+def email_document(email: Dict, template: str = DEFAULT_DOCUMENT_TEMPLATE) -> Document:
+    """LlamaIndex Document for one email, as stored in the vector index"""
+    # Include FULL email body for better style learning
+    full_body = email.get('body', '')
+    
+    metadata = {
+        'filename': email['filename'],
+        'sender': email['from'],
+        'subject': email['subject'],
+        'date': email['date'],
+        'message_id': email.get('message_id', ''),
+        'content_hash': email.get('hash', ''),
+        'body_preview': full_body[:500] if full_body else '',
+        'full_body_length': len(full_body),
+        'index_version': INDEX_SCHEMA_VERSION,
+        'document_template': template,
+        **filter_metadata(email)
+    }
+    bookkeeping = ['content_hash', 'index_version', 'document_template'] + FILTER_METADATA_KEYS
+    
+    if template == 'legacy':
+        # Create a rich document with full context
+        doc_text = f"""
+            === EMAIL FROM: {email['from']} ===
+            To: {', '.join(email['to']) if isinstance(email['to'], list) else email['to']}
+            Subject: {email['subject']}
+            Date: {email['date']}
+            
+            === FULL EMAIL CONTENT ===
+            {full_body}
+            === END OF EMAIL ===
+            
+            Author Writing Style: {email['from']}
+            This email demonstrates the unique writing style, vocabulary, and mannerisms of {email['from']}.
+            """
+        excluded_embed = excluded_llm = bookkeeping
+    else:
+        # Sender and subject reach the embedding as "key: value" lines
+        # ahead of the body; the rest is only for display and filtering
+        doc_text = full_body.strip() or email['subject']
+        display_only = ['filename', 'message_id', 'body_preview', 'full_body_length']
+        excluded_embed = bookkeeping + display_only + ['date']
+        excluded_llm = bookkeeping + display_only
+    
+    logger.debug(f"Created {template} document for {email['filename']} with {len(full_body)} chars of body")
+    return Document(
+        id_=email_doc_id(email),
+        text=doc_text,
+        metadata=metadata,
+        # Bookkeeping and filter fields, kept out of the embedded and prompted text
+        excluded_embed_metadata_keys=excluded_embed,
+        excluded_llm_metadata_keys=excluded_llm
+    )
+
+def configured_node_parser() -> EmailNodeParser:
+    """Chunker sized by the CHUNK_TOKENS secret"""
+    # Deterministic chunk IDs make re-upserting an email overwrite it
+    return EmailNodeParser(
+        chunk_size=int(SecretsManager.get_secret("CHUNK_TOKENS", DEFAULT_CHUNK_TOKENS)),
+        id_func=chunk_id
+    )
+
+def configured_document_template() -> str:
+    """The DOCUMENT_TEMPLATES entry named by the DOCUMENT_TEMPLATE secret"""
+    template = SecretsManager.get_secret("DOCUMENT_TEMPLATE", DEFAULT_DOCUMENT_TEMPLATE)
+    if template not in DOCUMENT_TEMPLATES:
+        logger.warning(f"Unknown DOCUMENT_TEMPLATE '{template}', using '{DEFAULT_DOCUMENT_TEMPLATE}'")
+        return DEFAULT_DOCUMENT_TEMPLATE
+    return template
+
+def embedded_tokens(documents: List[Document], node_parser) -> Dict:
+    """Chunks and tokens sent to the embedding model for ``documents``"""
+    nodes = node_parser.get_nodes_from_documents(documents)
+    return {
+        'documents': len(documents),
+        'chunks': len(nodes),
+        'tokens': sum(count_tokens(node.get_content(metadata_mode=MetadataMode.EMBED)) for node in nodes),
+    }
+
+class PineconeIndexOps:
+    """ID-level operations on a Pinecone index, matching LocalVectorStore's"""
+    
+    def __init__(self, pinecone_index):
+        self.pinecone_index = pinecone_index
+    
+    def get_metadata(self, node_ids: List[str], batch_size: int = 100) -> Dict[str, Dict]:
+        found = {}
+        for start in range(0, len(node_ids), batch_size):
+            response = self.pinecone_index.fetch(ids=node_ids[start:start + batch_size])
+            for vector_id, vector in response.vectors.items():
+                found[vector_id] = vector.metadata or {}
+        return found
+    
+    def list_ids(self, prefix: Optional[str] = None) -> Iterator[List[str]]:
+        if prefix:
+            return self.pinecone_index.list(prefix=prefix)
+        return self.pinecone_index.list()
+    
+    def delete_nodes(self, node_ids: List[str], batch_size: int = 1000):
+        for start in range(0, len(node_ids), batch_size):
+            self.pinecone_index.delete(ids=node_ids[start:start + batch_size])
+    
+    def persist(self):
+        # Pinecone writes are durable as soon as they are acknowledged
+        pass
+
 class VectorManager:
-    def __init__(self):
-        try:
-            self.api_key = st.secrets.get("PINECONE_API_KEY", "")
-        except:
-            self.api_key = ""
+    def __init__(self, backend: Optional[str] = None, reporter: Optional[ProgressReporter] = None):
+        # Messages go to the Streamlit page unless a caller says otherwise
+        self.reporter = reporter if reporter is not None else StreamlitReporter()
+        self.api_key = SecretsManager.get_secret("PINECONE_API_KEY", "")
         self.index_name = "email-rag-index"
+        # Set to the index's host URL to skip the control plane entirely
+        self.index_host = SecretsManager.get_secret("PINECONE_INDEX_HOST", "")
+        self.upsert_workers = int(SecretsManager.get_secret("PINECONE_UPSERT_WORKERS", DEFAULT_UPSERT_WORKERS))
+        # 'pinecone' (default) or 'local' for the offline on-disk index
+        if backend is None:
+            backend = SecretsManager.get_secret("VECTOR_BACKEND", "pinecone")
+        self.backend = backend
+        self.local_index_dir = SecretsManager.get_secret("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR)
+        self.embedding_executor = self.build_embedding_executor()
+        self.embedding_model = ScheduledEmbedding(self.embedding_executor)
         try:
-            openai_key = st.secrets.get("OPENAI_API_KEY", "")
-        except:
-            openai_key = ""
-        self.embedding_model = OpenAIEmbedding(
-            api_key=openai_key
-        )
+            # Re-uploads and rebuilds only pay for text not embedded before
+            self.embedding_model = CachedEmbedding(self.embedding_model)
+        except Exception as e:
+            logger.warning(f"Embedding cache unavailable, calling OpenAI directly: {str(e)}")
+        self.node_parser = configured_node_parser()
+        self.document_template = configured_document_template()
+    
+    @staticmethod
+    def build_embedding_executor() -> EmbeddingExecutor:
+        """The process-wide embedding executor, sized and rate limited from secrets
+        
+        OPENAI_RPM / OPENAI_TPM should match the account's rate limits;
+        OPENAI_BASE_URL points at any OpenAI-compatible server. Managers
+        share one executor per key and endpoint, so the limits apply to the
+        whole process and no thread or client is left behind per manager.
+        """
+        api_key = SecretsManager.get_secret("OPENAI_API_KEY", "")
+        base_url = SecretsManager.get_secret("OPENAI_BASE_URL", "") or None
+        
+        def create() -> EmbeddingExecutor:
+            rpm = SecretsManager.get_secret("OPENAI_RPM", "")
+            tpm = SecretsManager.get_secret("OPENAI_TPM", "")
+            return EmbeddingExecutor(
+                openai_embed_batch(api_key=api_key, base_url=base_url),
+                batch_size=int(SecretsManager.get_secret("EMBEDDING_BATCH_SIZE", DEFAULT_EMBEDDING_BATCH_SIZE)),
+                max_concurrency=int(SecretsManager.get_secret("EMBEDDING_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                requests_per_minute=float(rpm) if rpm else None,
+                tokens_per_minute=float(tpm) if tpm else None
+            )
+        
+        return shared_executor(api_key, base_url, create)
+    
+    def has_embedding_key(self) -> bool:
+        return bool(SecretsManager.get_secret("OPENAI_API_KEY", ""))
     
     def initialize_pinecone(self):
         """Initialize Pinecone connection"""
         try:
-            self.pc = Pinecone(api_key=self.api_key)
+            # One client per process, so its connection pool is reused
+            self.pc = cached_client(self.api_key, lambda: Pinecone(api_key=self.api_key))
             return True
         except Exception as e:
-            st.error(f"Failed to initialize Pinecone: {str(e)}")
+            self.reporter.error(f"Failed to initialize Pinecone: {str(e)}")
             return False
     
     def create_or_connect_index(self):
+        """Index handle, created once per process and reused by later connections"""
+        return cached_index(self.api_key, self.index_name, self._open_index)
+    
+    def _open_index(self):
         """Create new index or connect to existing one"""
         try:
+            if self.index_host:
+                logger.info(f"Connecting to Pinecone index at {self.index_host}")
+                return self.pc.Index(host=self.index_host, pool_threads=self.upsert_workers)
+            
             existing_indexes = [index.name for index in self.pc.list_indexes()]
             
             if self.index_name not in existing_indexes:
@@ -48,108 +239,228 @@ class VectorManager:
                         region='us-east-1'
                     )
                 )
-                st.success(f"✅ Created new index: {self.index_name}")
+                self.reporter.success(f"✅ Created new index: {self.index_name}")
             else:
-                st.info(f"📌 Connected to existing index: {self.index_name}")
+                self.reporter.info(f"📌 Connected to existing index: {self.index_name}")
             
-            return self.pc.Index(self.index_name)
+            return self.pc.Index(self.index_name, pool_threads=self.upsert_workers)
         except Exception as e:
-            st.error(f"Index operation failed: {str(e)}")
+            self.reporter.error(f"Index operation failed: {str(e)}")
             return None
     
     def process_emails_to_documents(self, emails: List[Dict]) -> List[Document]:
         """Convert email data to LlamaIndex Documents"""
-        documents = []
+        return [email_document(email, self.document_template) for email in emails]
+    
+    def embedding_token_report(self, emails: List[Dict]) -> Dict[str, Dict]:
+        """embedded_tokens() for ``emails`` under every DOCUMENT_TEMPLATES entry
         
-        for email in emails:
-            # Include FULL email body for better style learning
-            full_body = email.get('body', '')
-            
-            # Create a rich document with full context
-            doc_text = f"""
-            === EMAIL FROM: {email['from']} ===
-            To: {', '.join(email['to']) if isinstance(email['to'], list) else email['to']}
-            Subject: {email['subject']}
-            Date: {email['date']}
-            
-            === FULL EMAIL CONTENT ===
-            {full_body}
-            === END OF EMAIL ===
-            
-            Author Writing Style: {email['from']}
-            This email demonstrates the unique writing style, vocabulary, and mannerisms of {email['from']}.
-            """
-            
-            metadata = {
-                'filename': email['filename'],
-                'sender': email['from'],
-                'subject': email['subject'],
-                'date': email['date'],
-                'message_id': email['message_id'],
-                'body_preview': full_body[:500] if full_body else '',
-                'full_body_length': len(full_body)
-            }
-            
-            documents.append(Document(text=doc_text, metadata=metadata))
-            logger.debug(f"Created document for {email['filename']} with {len(full_body)} chars of body")
+        Counted locally with the configured chunking, without calling the
+        embedding API.
+        """
+        return {
+            template: embedded_tokens([email_document(email, template) for email in emails], self.node_parser)
+            for template in DOCUMENT_TEMPLATES
+        }
+    
+    def fetch_indexed_hashes(self, index_ops, doc_ids: List[str]) -> Dict[str, str]:
+        """Map each already-indexed document ID to the content hash stored with it
+        
+        Documents stored under an older INDEX_SCHEMA_VERSION or another
+        document template map to an empty hash, so they count as changed
+        and are re-indexed.
+        """
+        # Every indexed document has a first chunk, so fetching it is enough
+        stored = index_ops.get_metadata([f"{doc_id}#0" for doc_id in doc_ids])
+        return {
+            metadata['doc_id']: (
+                metadata.get('content_hash', '')
+                if metadata.get('index_version') == INDEX_SCHEMA_VERSION
+                and metadata.get('document_template') == self.document_template else ''
+            )
+            for metadata in stored.values() if metadata.get('doc_id')
+        }
+    
+    def select_new_documents(self, documents: List[Document], indexed: Dict[str, str]) -> List[Document]:
+        """Drop documents already indexed with identical content"""
+        new_docs = [
+            doc for doc in documents
+            if indexed.get(doc.doc_id) != doc.metadata.get('content_hash')
+        ]
+        logger.info(
+            f"Incremental update: {len(new_docs)} new or changed, "
+            f"{len(documents) - len(new_docs)} already indexed"
+        )
+        return new_docs
+    
+    def delete_stale_chunks(self, index_ops, nodes, doc_ids: List[str]) -> int:
+        """Remove chunks left over from an earlier, longer version of a document"""
+        current_ids = {node.node_id for node in nodes}
+        stale = []
+        for doc_id in doc_ids:
+            for page in index_ops.list_ids(prefix=f"{doc_id}#"):
+                stale.extend(vector_id for vector_id in page if vector_id not in current_ids)
         
-        return documents
+        if stale:
+            logger.info(f"Deleting {len(stale)} stale chunks")
+            index_ops.delete_nodes(stale)
+        return len(stale)
     
-    def create_vector_store(self, emails: List[Dict]):
-        """Create vector store from emails"""
-        logger.info(f"Starting create_vector_store with {len(emails)} emails")
+    def reconcile_index(self, index_ops, emails: Optional[List[Dict]] = None,
+                        prune: bool = False, prune_unknown: bool = False) -> Dict:
+        """Report, and optionally delete, vectors that no longer belong in the index
         
-        with st.spinner("🔄 Creating vector embeddings..."):
+        Orphans are vectors with legacy random IDs and chunks beyond an
+        email's current chunk count. When ``emails`` is the complete corpus,
+        ``prune_unknown`` also removes vectors of emails not in it.
+        """
+        expected_ids = None
+        corpus_doc_ids = set()
+        if emails is not None:
+            documents = self.process_emails_to_documents(emails)
+            corpus_doc_ids = {doc.doc_id for doc in documents}
+            expected_ids = {node.node_id for node in self.node_parser.get_nodes_from_documents(documents)}
+        
+        report = {'total': 0, 'legacy': [], 'stale': [], 'unknown': [], 'pruned': 0}
+        for page in index_ops.list_ids():
+            for vector_id in page:
+                report['total'] += 1
+                if not CHUNK_ID_PATTERN.match(vector_id):
+                    report['legacy'].append(vector_id)
+                elif expected_ids is not None:
+                    doc_id = vector_id.rsplit('#', 1)[0]
+                    if doc_id not in corpus_doc_ids:
+                        report['unknown'].append(vector_id)
+                    elif vector_id not in expected_ids:
+                        report['stale'].append(vector_id)
+        
+        logger.info(
+            f"Reconcile: {report['total']} vectors, {len(report['legacy'])} legacy, "
+            f"{len(report['stale'])} stale, {len(report['unknown'])} not in corpus"
+        )
+        
+        if prune:
+            orphans = report['legacy'] + report['stale']
+            if prune_unknown:
+                orphans += report['unknown']
+            index_ops.delete_nodes(orphans)
+            index_ops.persist()
+            report['pruned'] = len(orphans)
+            logger.info(f"Pruned {len(orphans)} orphaned vectors")
+        
+        return report
+    
+    def reconcile(self, emails: Optional[List[Dict]] = None, prune: bool = False,
+                  prune_unknown: bool = False) -> Optional[Dict]:
+        """Connect to the vector backend and reconcile it against ``emails``"""
+        connection = self.connect_vector_store()
+        if not connection:
+            return None
+        _, index_ops = connection
+        
+        try:
+            return self.reconcile_index(index_ops, emails, prune, prune_unknown)
+        except Exception as e:
+            logger.error(f"Error reconciling vector index: {str(e)}", exc_info=True)
+            self.reporter.error(f"Failed to reconcile vector index: {str(e)}")
+            return None
+    
+    def connect_vector_store(self) -> Optional[Tuple[object, object]]:
+        """Open the configured backend as ``(vector_store, index_ops)``"""
+        if self.backend == "local":
+            logger.info(f"Opening local vector index in {self.local_index_dir}")
+            store = LocalVectorStore.from_persist_dir(self.local_index_dir)
+            return store, store
+        
+        if not self.api_key:
+            logger.error("PINECONE_API_KEY not found in secrets")
+            self.reporter.error("⚠️ PINECONE_API_KEY not found in the environment or .streamlit/secrets.toml")
+            self.reporter.info("You can still use Direct Context mode without Pinecone, or set VECTOR_BACKEND = \"local\"")
+            return None
+        
+        logger.info("Initializing Pinecone...")
+        if not self.initialize_pinecone():
+            logger.error("Failed to initialize Pinecone")
+            return None
+        
+        logger.info("Creating or connecting to Pinecone index...")
+        pinecone_index = self.create_or_connect_index()
+        if not pinecone_index:
+            logger.error("Failed to create or connect to Pinecone index")
+            return None
+        
+        vector_store = BulkPineconeVectorStore(pinecone_index=pinecone_index, workers=self.upsert_workers)
+        return vector_store, PineconeIndexOps(pinecone_index)
+    
+    def create_vector_store(self, emails: List[Dict], incremental: bool = True):
+        """Create vector store from emails
+        
+        In incremental mode only emails that are not yet in the index, or
+        whose content changed, are embedded and upserted; the returned index
+        covers everything stored in the backend.
+        """
+        logger.info(f"Starting create_vector_store with {len(emails)} emails (incremental={incremental}, backend={self.backend})")
+        
+        with self.reporter.stage("🔄 Creating vector embeddings..."):
             # Check for API keys first
-            if not self.api_key:
-                logger.error("PINECONE_API_KEY not found in secrets")
-                st.error("⚠️ PINECONE_API_KEY not found in .streamlit/secrets.toml")
-                st.info("You can still use Direct Context mode without Pinecone")
-                return None
-            
-            try:
-                openai_key = st.secrets.get("OPENAI_API_KEY", "")
-            except:
-                openai_key = ""
-            if not openai_key:
+            if not self.has_embedding_key():
                 logger.error("OPENAI_API_KEY not found in secrets")
-                st.error("⚠️ OPENAI_API_KEY not found in .streamlit/secrets.toml")
-                return None
-            
-            logger.info("Initializing Pinecone...")
-            if not self.initialize_pinecone():
-                logger.error("Failed to initialize Pinecone")
+                self.reporter.error("⚠️ OPENAI_API_KEY not found in the environment or .streamlit/secrets.toml")
                 return None
             
-            logger.info("Creating or connecting to Pinecone index...")
-            pinecone_index = self.create_or_connect_index()
-            if not pinecone_index:
-                logger.error("Failed to create or connect to Pinecone index")
+            connection = self.connect_vector_store()
+            if not connection:
                 return None
+            vector_store, index_ops = connection
             
             logger.info(f"Processing {len(emails)} emails to documents...")
             documents = self.process_emails_to_documents(emails)
             logger.info(f"Created {len(documents)} documents")
             
+            # Later duplicates of the same email win
+            documents = list({doc.doc_id: doc for doc in documents}.values())
             try:
-                logger.info("Creating PineconeVectorStore...")
-                vector_store = PineconeVectorStore(
-                    pinecone_index=pinecone_index
-                )
+                indexed = self.fetch_indexed_hashes(index_ops, [doc.doc_id for doc in documents])
+            except Exception as e:
+                logger.warning(f"Could not diff against index, embedding everything: {str(e)}")
+                indexed = {}
+            
+            if incremental:
+                documents = self.select_new_documents(documents, indexed)
+                self.reporter.info(f"🧮 {len(documents)} of {len(emails)} emails need embedding")
+            
+            try:
+                if documents:
+                    logger.info(f"Embedding and upserting {len(documents)} documents...")
+                    nodes = self.node_parser.get_nodes_from_documents(documents, show_progress=True)
+                    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+                    VectorStoreIndex(
+                        nodes,
+                        storage_context=storage_context,
+                        embed_model=self.embedding_model,
+                        show_progress=True
+                    )
+                    
+                    # Upserts overwrite by ID, but a re-indexed email may now
+                    # have fewer chunks than the copy already stored
+                    reindexed = [doc.doc_id for doc in documents if doc.doc_id in indexed]
+                    if reindexed:
+                        self.delete_stale_chunks(index_ops, nodes, reindexed)
+                    index_ops.persist()
                 
-                logger.info("Creating VectorStoreIndex from documents...")
-                index = VectorStoreIndex.from_documents(
-                    documents, 
-                    vector_store=vector_store,
-                    embed_model=self.embedding_model,
-                    show_progress=True
+                index = VectorStoreIndex.from_vector_store(
+                    vector_store,
+                    embed_model=self.embedding_model
                 )
                 
+                if isinstance(self.embedding_model, CachedEmbedding):
+                    logger.info(f"Embedding cache: {self.embedding_model.store.stats()}")
+                
                 logger.info("Vector store created successfully!")
-                st.success(f"✅ Successfully created vector database with {len(emails)} emails")
+                self.reporter.success(f"✅ Successfully created vector database with {len(emails)} emails")
                 return index
                 
             except Exception as e:
                 logger.error(f"Error creating vector store: {str(e)}", exc_info=True)
-                st.error(f"Failed to create vector store: {str(e)}")
-                return None
\ No newline at end of file
+                self.reporter.error(f"Failed to create vector store: {str(e)}")
+                return None